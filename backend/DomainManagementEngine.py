@@ -1,23 +1,313 @@
 from __future__ import annotations
 
-import json
 import os
 import re
+import time
+import zlib
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from threading import RLock
-from typing import Dict, List, Tuple, Any, Optional
+from queue import Queue
+from threading import Condition, Lock, RLock, Thread
+from typing import Callable, Dict, Iterator, List, Set, Tuple, Any, Optional
 from logger import setup_logger
+from DomainStore import DomainStore, SerializedListCache, USERS_DATA_DIR, make_domain_store
+from ProbeMetrics import ScanStats
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
 
 # ----------------------------
-# Thread-safety for file IO
+# Thread- and process-safety for storage read-modify-write
 # ----------------------------
-_lock = RLock()
+# Locks users are spread over; users on different stripes never wait for each other
+DOMAIN_LOCK_STRIPES = int(os.getenv("DOMAIN_LOCK_STRIPES", "64"))
+# Per-user lock files that serialize users' operations across processes
+# (several gunicorn workers, the scheduler); "" turns file locking off
+DOMAIN_LOCK_DIR = os.getenv("DOMAIN_LOCK_DIR", os.path.join(USERS_DATA_DIR, "locks"))
+
+
+class UserLocks:
+    """
+    Striped per-user locks. Every operation on a user's records (including
+    read-modify-write sequences like add or remove) holds the user's stripe,
+    so one user's long bulk upload only delays users hashed to the same
+    stripe. Reentrant, and no operation holds two users, so no deadlocks.
+
+    Across processes, the outermost hold also takes an exclusive advisory
+    lock (flock) on the user's file in DOMAIN_LOCK_DIR, so API workers and
+    the scheduler sharing UsersData do not lose each other's updates.
+    Without fcntl (Windows) only threads are serialized.
+
+    The time spent waiting (for the stripe and the file lock) is recorded
+    per operation, "free" when both were taken without waiting and
+    "contended" otherwise.
+
+    The lock file also holds the user's version, "<epoch> <counter>",
+    counted up with every change to the user's records (the epoch is
+    random, so a recreated file never repeats an earlier version). Without
+    file locks the versions are kept per process.
+    """
+
+    def __init__(self, stripes: int = DOMAIN_LOCK_STRIPES, lock_dir: Optional[str] = DOMAIN_LOCK_DIR):
+        self._locks = [RLock() for _ in range(max(1, stripes))]
+        self.lock_dir = lock_dir if fcntl is not None else None
+        # username -> [file descriptor, depth]; only touched while holding the user's stripe
+        self._files: Dict[str, List[int]] = {}
+        self._pinned: Set[str] = set()
+        self._versions: Dict[str, int] = {}
+        self._epoch = os.urandom(4).hex()
+        self.waits = ScanStats()
+
+    def _lock_path(self, username: str) -> str:
+        safe_user = re.sub(r"[^A-Za-z0-9_.-]", "_", username.strip())
+        return os.path.join(self.lock_dir, f"{safe_user}.lock")
+
+    def _lock_file(self, username: str) -> float:
+        """Take (or re-enter) the user's file lock; returns seconds waited."""
+        held = self._files.get(username)
+        if held is not None:
+            held[1] += 1
+            return 0.0
+        os.makedirs(self.lock_dir, exist_ok=True)
+        fd = os.open(self._lock_path(username), os.O_RDWR | os.O_CREAT, 0o644)
+        waited = 0.0
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                started = time.monotonic()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                waited = time.monotonic() - started
+        except BaseException:
+            os.close(fd)
+            raise
+        self._files[username] = [fd, 1]
+        return waited
+
+    def _unlock_file(self, username: str) -> None:
+        held = self._files[username]
+        held[1] -= 1
+        if held[1] == 0:
+            del self._files[username]
+            # Closing the descriptor releases the flock
+            os.close(held[0])
+
+    @contextmanager
+    def hold(self, username: str, operation: str) -> Iterator[None]:
+        lock = self._locks[zlib.crc32(username.encode()) % len(self._locks)]
+        waited, contended = 0.0, False
+        if not lock.acquire(blocking=False):
+            started = time.monotonic()
+            lock.acquire()
+            waited, contended = time.monotonic() - started, True
+        try:
+            if self.lock_dir:
+                file_wait = self._lock_file(username)
+                waited += file_wait
+                contended = contended or file_wait > 0
+            try:
+                self.waits.observe(operation, waited * 1000, "contended" if contended else "free")
+                yield
+            finally:
+                if self.lock_dir:
+                    self._unlock_file(username)
+        finally:
+            lock.release()
+
+    def pin(self, username: str) -> None:
+        """Keep the user's file lock past the current hold, until unpin (caller holds the user)."""
+        if self.lock_dir and username not in self._pinned:
+            self._files[username][1] += 1
+            self._pinned.add(username)
+
+    def unpin(self, username: str) -> None:
+        """Release a pin (caller holds the user, so the file lock goes with that hold)."""
+        if username in self._pinned:
+            self._pinned.discard(username)
+            self._unlock_file(username)
+
+    def _read_version(self, username: str) -> Tuple[str, int]:
+        """(epoch, counter) of the user (caller holds the user)."""
+        if not self.lock_dir:
+            return self._epoch, self._versions.get(username, 0)
+        fd = self._files[username][0]
+        try:
+            epoch, counter = os.pread(fd, 64, 0).decode().split()
+            return epoch, int(counter)
+        except ValueError:
+            # New (empty) lock file
+            epoch = os.urandom(4).hex()
+            os.pwrite(fd, f"{epoch} 0\n".encode(), 0)
+            return epoch, 0
+
+    def bump_version(self, username: str) -> None:
+        """Count a change of the user's records (caller holds the user)."""
+        epoch, counter = self._read_version(username)
+        if self.lock_dir:
+            os.pwrite(self._files[username][0], f"{epoch} {counter + 1}\n".encode(), 0)
+        else:
+            self._versions[username] = counter + 1
+
+    def version(self, username: str) -> str:
+        """Opaque tag of the user's current records; changes with every counted change."""
+        with self.hold(username, "version"):
+            epoch, counter = self._read_version(username)
+        return f"{epoch}.{counter}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stripes": len(self._locks), "file_locks": bool(self.lock_dir),
+                "wait": self.waits.phases(buckets=False)}
+
+
+_locks = UserLocks()
+
+
+class GroupCommitter:
+    """
+    Group commit of staged domain lists (JsonDomainStore with group_commit).
+
+    A write operation stages the user's new list, releases the user's lock
+    and waits here until a disk write covering its change is done. The
+    first waiter becomes the leader and writes the latest staged list; the
+    operations staged meanwhile (a burst of adds) wait for that write or the
+    leader's next one, so N changes cost one fsynced write instead of N.
+    The user's file lock stays pinned until the staged list is on disk, so
+    other processes never read a file missing staged changes. Dropping a
+    user waits for the write in progress (see wait_idle), so a leader never
+    recreates a deleted file.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        # commit key -> {"durable": generation written, "failed": ..., "error": ..., "leader": bool}
+        self._state: Dict[str, Dict[str, Any]] = {}
+
+    def commit(self, store: DomainStore, username: str, generation: int) -> None:
+        """Return once the user's staged list of this generation (or a later one) is written."""
+        with self._cond:
+            state = self._state.setdefault(username, {"durable": 0, "failed": 0, "error": None,
+                                                      "leader": False})
+            while True:
+                if state["durable"] >= generation:
+                    return
+                if state["failed"] >= generation:
+                    raise state["error"]
+                if not state["leader"]:
+                    state["leader"] = True
+                    break
+                self._cond.wait()
+
+        try:
+            while True:
+                with _locks.hold(username, "commit"):
+                    staged = store.staged(username)
+                    if staged is None:
+                        # Dropped (remove_user_domains) before it was written
+                        _locks.unpin(username)
+                if staged is None:
+                    break
+                index, written = staged
+                try:
+                    store.write(username, index=index)
+                except BaseException as e:
+                    with _locks.hold(username, "commit"):
+                        # Back to what is on disk; every change staged so far fails
+                        latest = store.generation(username)
+                        store.discard_staged(username)
+                        _locks.unpin(username)
+                    with self._cond:
+                        state["failed"] = latest or written
+                        state["error"] = e
+                    raise
+                with _locks.hold(username, "commit"):
+                    done = store.discard_staged(username, written)
+                    if done:
+                        _locks.unpin(username)
+                with self._cond:
+                    state["durable"] = written
+                    self._cond.notify_all()
+                if done:
+                    break
+        finally:
+            with self._cond:
+                state["leader"] = False
+                self._cond.notify_all()
+
+    def busy(self, username: str) -> bool:
+        """True while a leader is writing the user's staged lists."""
+        with self._cond:
+            return self._state.get(username, {}).get("leader", False)
+
+    def wait_idle(self, username: str) -> None:
+        """Wait until no leader is writing the user's staged lists (caller must not hold the user)."""
+        with self._cond:
+            while self._state.get(username, {}).get("leader", False):
+                self._cond.wait()
+
+
+_commits = GroupCommitter()
+
+
+class LogCompactor:
+    """
+    Background compaction of log-structured stores (DOMAIN_STORE=log):
+    writers hand over users whose log passed the threshold, and one daemon
+    thread (started on first use) folds each log into a new snapshot while
+    holding the user, so the writer's request does not pay for it.
+    """
+
+    def __init__(self):
+        self._queue: "Queue[Tuple[DomainStore, str]]" = Queue()
+        self._pending: Set[Tuple[int, str]] = set()
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        self.compacted = 0
+        self.failed = 0
+
+    def submit(self, store: DomainStore, username: str) -> None:
+        with self._lock:
+            if (id(store), username) in self._pending:
+                return
+            self._pending.add((id(store), username))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="domain-log-compactor", daemon=True)
+                self._thread.start()
+        self._queue.put((store, username))
+
+    def _run(self) -> None:
+        logger = setup_logger("LogCompactor")
+        while True:
+            store, username = self._queue.get()
+            with self._lock:
+                self._pending.discard((id(store), username))
+            try:
+                with _locks.hold(username, "compact"):
+                    # Another process may have compacted it meanwhile
+                    if not store.needs_compaction(username):
+                        continue
+                    store.compact(username)
+                self.compacted += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Compacting the domain log of {username} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self._queue.qsize(), "compacted": self.compacted, "failed": self.failed}
+
+
+_compactor = LogCompactor()
+
+# Serialized domain list responses, per user and list version
+_bodies = SerializedListCache()
 
 # ----------------------------
-# Base directory for per-user JSON files
+# Scan result persistence
 # ----------------------------
-BASE_DIR = os.path.dirname(__file__)
-USERS_DATA_DIR = os.path.join(BASE_DIR, "UsersData")
+# A result whose fields match the stored record is not written, unless the
+# stored last_check is older than this many seconds
+RESULTS_LAST_CHECK_REFRESH = float(os.getenv("RESULTS_LAST_CHECK_REFRESH", "3600"))
 
 
 def _utc_now_iso() -> str:
@@ -25,15 +315,23 @@ def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
 
 
-def _domains_path(username: str) -> str:
-    """Generate per-user JSON file path."""
-    safe_user = re.sub(r"[^A-Za-z0-9_.-]", "_", username.strip())
-    return os.path.join(USERS_DATA_DIR, f"{safe_user}_domains.json")
+def _result_changed(record: Dict[str, Any], result: Dict[str, Any], now: datetime) -> bool:
+    """True if storing result would change record in more than a fresh last_check."""
+    if any(record.get(key) != value for key, value in result.items() if key != "last_check"):
+        return True
+    try:
+        stored = datetime.fromisoformat(str(record.get("last_check")).replace("Z", "+00:00"))
+    except ValueError:
+        return True
+    return (now - stored).total_seconds() >= RESULTS_LAST_CHECK_REFRESH
 
 
 class DomainManagementEngine:
     """
-    File-backed user domain storage and domain validation/CRUD.
+    User domain storage and domain validation/CRUD.
+    Records live in a DomainStore: JSON files by default, a JSON snapshot
+    plus an append-only operation log (DOMAIN_STORE=log), or SQLite
+    (DOMAIN_STORE=sqlite).
 
     JSON structure example (UsersData/alex_domains.json):
     [
@@ -53,8 +351,36 @@ class DomainManagementEngine:
         r"^(?=.{1,253}$)(?!-)([A-Za-z0-9-]{1,63}(?<!-)\.)+[A-Za-z]{2,63}$"
     )
 
-    def __init__(self):
+    def __init__(self, store: Optional[DomainStore] = None):
         os.makedirs(USERS_DATA_DIR, exist_ok=True)
+        self.store = store or make_domain_store()
+
+    @contextmanager
+    def _writing(self, username: str, operation: str) -> Iterator[None]:
+        """
+        Hold the user for a write operation; afterwards, with the lock
+        released, wait until its staged changes are on disk (group commit).
+        """
+        generation = None
+        try:
+            with _locks.hold(username, operation):
+                try:
+                    yield
+                finally:
+                    generation = self.store.generation(username)
+                    if generation is not None:
+                        _locks.pin(username)
+        finally:
+            if generation is not None:
+                _commits.commit(self.store, username, generation)
+        if self.store.needs_compaction(username):
+            _compactor.submit(self.store, username)
+
+    @staticmethod
+    def _changed(username: str) -> None:
+        """Record a change of the user's records (caller holds the user): new version, old bodies dropped."""
+        _locks.bump_version(username)
+        _bodies.discard(username)
 
     @staticmethod
     def _normalize_domain(raw: str) -> str:
@@ -101,42 +427,72 @@ class DomainManagementEngine:
 
     def load_user_domains(self, username: str) -> List[Dict[str, Any]]:
         """
-        Load (or initialize) user's domain list.
-        The JSON file contains only a list of domain objects.
+        Load (or initialize) user's domain list, sorted by domain.
         """
-        path = _domains_path(username)
-        with _lock:
-            if not os.path.exists(path):
-                os.makedirs(USERS_DATA_DIR, exist_ok=True)
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump([], f, ensure_ascii=False, indent=2)
-                return []
-
-            with open(path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    if not isinstance(data, list):
-                        data = []
-                except json.JSONDecodeError:
-                    data = []
-            return sorted(data, key=lambda x: x["domain"].lower())
-
+        with _locks.hold(username, "load"):
+            return self.store.load(username)
 
     def save_user_domains(self, username: str, data: List[Dict[str, Any]]) -> None:
-        """Save user's domain list to disk."""
-        path = _domains_path(username)
-        with _lock:
-            os.makedirs(USERS_DATA_DIR, exist_ok=True)
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(sorted(data, key=lambda x: x["domain"].lower()), 
-                          f, ensure_ascii=False, indent=2)
+        """Replace user's domain list."""
+        with self._writing(username, "save"):
+            self.store.save(username, data)
+            self._changed(username)
+
+    def update_domain_results(self, username: str, results: List[Dict[str, Any]]) -> int:
+        """
+        Merge probe results into the user's stored records, writing only the
+        records that changed (see _result_changed: a new last_check alone is
+        not worth a write until RESULTS_LAST_CHECK_REFRESH passed).
+        Domains removed in the meantime are not re-added.
+        :return: number of records changed
+        """
+        by_domain = {r.get("domain"): r for r in results}
+        now = datetime.now(timezone.utc)
+
+        with self._writing(username, "update_results"):
+            stored = self.store.get(username, [d for d in by_domain if d])
+            changed = [
+                dict(record, **by_domain[domain])
+                for domain, record in stored.items()
+                if _result_changed(record, by_domain[domain], now)
+            ]
+            if changed:
+                self.store.update(username, changed)
+                self._changed(username)
+
+        return len(changed)
 
     def list_domains(self, username: str) -> List[Dict[str, Any]]:
         return self.load_user_domains(username)
 
+    def domains_version(self, username: str) -> str:
+        """
+        Tag of the user's current domain list, changed by every write that
+        changes it (across processes). Read it before the list: a racing
+        write can then only make the tag older than the data, never newer.
+        """
+        return _locks.version(username)
+
+    def serialized(self, username: str, version: str, key: Any, build: Callable[[], bytes]) -> bytes:
+        """
+        Bytes build() makes from the user's list as of version (e.g. a
+        response body), built once and then served from memory until the
+        list changes. key tells apart the forms kept per user.
+        """
+        body = _bodies.get(username, key, version)
+        if body is None:
+            body = build()
+            _bodies.put(username, key, version, body)
+        return body
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """Backend name, domain list and response cache counters, lock wait times and log compactions."""
+        return dict(self.store.stats(), locks=_locks.stats(), compactor=_compactor.stats(),
+                    bodies=_bodies.stats())
+
     def set_last_full_check_now(self, username: str) -> None:
         """Update last full check timestamp (to be called after MonitoringSystem run)."""
-        with _lock:
+        with self._writing(username, "set_last_full_check"):
             data = self.load_user_domains(username)
             data["last_full_check"] = _utc_now_iso()
             self.save_user_domains(username, data)
@@ -146,21 +502,16 @@ class DomainManagementEngine:
         if not ok or not host:
             return False
 
-        with _lock:
-            domains = self.load_user_domains(username)
-            existing = {d.get("domain") for d in domains}
-            if host in existing:
-                return False
-
-            domains.append({
+        with self._writing(username, "add"):
+            added = self.store.insert(username, [{
                 "domain": host,
                 "status": "Pending",
                 "ssl_expiration": "N/A",
                 "ssl_issuer": "N/A"
-            })
-
-            self.save_user_domains(username, domains)
-            return True
+            }])
+            if added:
+                self._changed(username)
+            return bool(added)
 
 
     def bulk_upload(self, username: str, file_path: str) -> Dict[str, Any]:
@@ -193,32 +544,38 @@ class DomainManagementEngine:
 
         added, duplicates, invalid = [], [], []
 
-        with _lock:
-            domains = self.load_user_domains(username)
-            existing = {d.get("domain") for d in domains}
-
-            for raw in domains_to_add:
-                ok, normalized, reason = self.validate_domain(raw)
-                if not ok or not normalized:
-                    logger.warning(f"Invalid domain skipped: {raw} ({reason})")
-                    invalid.append({"input": raw, "reason": reason})
-                    continue
-
-                if normalized in existing:
-                    logger.warning(f"Duplicate domain skipped: {normalized}")
-                    duplicates.append(normalized)
-                    continue
+        records, seen = [], set()
+        for raw in domains_to_add:
+            ok, normalized, reason = self.validate_domain(raw)
+            if not ok or not normalized:
+                logger.warning(f"Invalid domain skipped: {raw} ({reason})")
+                invalid.append({"input": raw, "reason": reason})
+                continue
+
+            if normalized in seen:
+                logger.warning(f"Duplicate domain skipped: {normalized}")
+                duplicates.append(normalized)
+                continue
+
+            records.append({
+                "domain": normalized,
+                "status": "Pending",
+                "ssl_expiration": "N/A",
+                "ssl_issuer": "N/A"
+            })
+            seen.add(normalized)
 
-                domains.append({
-                    "domain": normalized,
-                    "status": "Pending",
-                    "ssl_expiration": "N/A",
-                    "ssl_issuer": "N/A"
-                })
-                added.append(normalized)
-                existing.add(normalized)
+        with self._writing(username, "bulk_upload"):
+            added = self.store.insert(username, records)
+            if added:
+                self._changed(username)
 
-            self.save_user_domains(username, domains)
+        # Domains the user already had
+        inserted = set(added)
+        for record in records:
+            if record["domain"] not in inserted:
+                logger.warning(f"Duplicate domain skipped: {record['domain']}")
+                duplicates.append(record["domain"])
 
         summary = {
             "ok": True,
@@ -240,21 +597,26 @@ class DomainManagementEngine:
         to_remove = {self._normalize_domain(h) for h in (hosts or []) if h and h.strip()}
         to_remove.discard("")
 
-        removed, not_found = [], []
-
-        with _lock:
-            domains = self.load_user_domains(username)
-            current = {d.get("domain") for d in domains}
-
-            # Remove matching entries
-            new_list = [d for d in domains if d.get("domain") not in to_remove]
-            removed = list(current.intersection(to_remove))
+        with self._writing(username, "remove"):
+            removed = self.store.delete(username, list(to_remove))
+            if removed:
+                self._changed(username)
 
-            # Track domains that didn't exist
-            not_found = list(to_remove - current)
-
-            self.save_user_domains(username, new_list)
+        # Track domains that didn't exist
+        not_found = list(to_remove - set(removed))
 
         return {"removed": removed, "not_found": not_found}
 
+    def remove_user_domains(self, username: str) -> None:
+        """Delete all of the user's records (user removal)."""
+        while True:
+            # A group commit leader writes without holding the user: let it finish first
+            _commits.wait_idle(username)
+            with _locks.hold(username, "remove_user"):
+                if _commits.busy(username):
+                    continue
+                self.store.drop_user(username)
+                self._changed(username)
+                return
+
     
@@ -0,0 +1,201 @@
+import base64
+import binascii
+import json
+import os
+import re
+from datetime import date
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+# ----------------------------
+# Domain list query configuration
+# ----------------------------
+# Largest page GET /api/domains returns (limit=...)
+DOMAIN_PAGE_MAX = int(os.getenv("DOMAIN_PAGE_MAX", "1000"))
+
+SORT_FIELDS = ("domain", "status", "ssl_expiration", "ssl_issuer", "last_check")
+
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,63}$")
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# Values that mean "not known yet" and sort after every known value
+_MISSING = (None, "", "N/A")
+
+
+class DomainQueryError(ValueError):
+    """Invalid query parameter (answered with 400)."""
+
+
+class _Descending:
+    """Sort key component compared in reverse."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+
+def _field_key(record: Dict[str, Any], field: str) -> Tuple[Any, ...]:
+    """JSON-friendly, comparable key of one field; unknown values sort last."""
+    if field == "domain":
+        return (record["domain"].lower(), record["domain"])
+    value = record.get(field)
+    if value in _MISSING:
+        return (1, "")
+    return (0, str(value).lower())
+
+
+class DomainQuery:
+    """
+    A page of a user's domain list: filters, sort order, keyset cursor and
+    field projection, parsed from GET /api/domains query parameters:
+
+        limit=200                      page size (default: the whole list)
+        cursor=<next_cursor>           continue after the previous page
+        status=Live,Down               any of these statuses (case-insensitive)
+        issuer=let's                   issuer contains this (case-insensitive)
+        expiring_before=2025-12-31     SSL expiration before this date
+        sort=-ssl_expiration,domain    sort keys, "-" for descending
+        fields=domain,status           only these fields ("domain" is always sent)
+
+    The cursor holds the sort key of the last record sent, so pages stay
+    consistent while domains are added or removed between requests: the
+    next page starts right after that key (the domain breaks ties).
+    """
+
+    def __init__(self, limit: Optional[int] = None, cursor: Optional[str] = None,
+                 statuses: Optional[Sequence[str]] = None, issuer: Optional[str] = None,
+                 expiring_before: Optional[str] = None, sort: Sequence[Tuple[str, bool]] = (("domain", False),),
+                 fields: Optional[Sequence[str]] = None):
+        self.limit = limit
+        self.statuses = {s.lower() for s in statuses} if statuses else None
+        self.issuer = issuer.lower() if issuer else None
+        self.expiring_before = expiring_before
+        # (field, descending); the domain is the last key, so keys are unique
+        self.sort = list(sort)
+        if not any(field == "domain" for field, _ in self.sort):
+            self.sort.append(("domain", False))
+        self.fields = list(dict.fromkeys(["domain", *fields])) if fields else None
+        self.after = self._decode_cursor(cursor) if cursor else None
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "DomainQuery":
+        """Parse request query parameters; raises DomainQueryError."""
+        limit = None
+        if args.get("limit"):
+            try:
+                limit = int(args["limit"])
+            except ValueError:
+                raise DomainQueryError("limit must be an integer")
+            if not 1 <= limit <= DOMAIN_PAGE_MAX:
+                raise DomainQueryError(f"limit must be between 1 and {DOMAIN_PAGE_MAX}")
+
+        expiring_before = args.get("expiring_before") or None
+        if expiring_before is not None:
+            try:
+                expiring_before = date.fromisoformat(expiring_before).isoformat()
+            except ValueError:
+                raise DomainQueryError("expiring_before must be a date (YYYY-MM-DD)")
+
+        sort = []
+        for key in _split(args.get("sort")):
+            field, descending = (key[1:], True) if key.startswith("-") else (key, False)
+            if field not in SORT_FIELDS:
+                raise DomainQueryError(f"Cannot sort by '{field}' (one of: {', '.join(SORT_FIELDS)})")
+            sort.append((field, descending))
+
+        fields = _split(args.get("fields"))
+        for field in fields:
+            if not _FIELD_RE.match(field):
+                raise DomainQueryError(f"Invalid field name '{field}'")
+
+        return cls(limit=limit, cursor=args.get("cursor") or None, statuses=_split(args.get("status")),
+                   issuer=args.get("issuer") or None, expiring_before=expiring_before,
+                   sort=sort or (("domain", False),), fields=fields)
+
+    def _sort_spec(self) -> str:
+        return ",".join(f"-{field}" if descending else field for field, descending in self.sort)
+
+    def _raw_key(self, record: Dict[str, Any]) -> List[Tuple[Any, ...]]:
+        return [_field_key(record, field) for field, _ in self.sort]
+
+    def _key(self, raw: Sequence[Sequence[Any]]) -> Tuple[Any, ...]:
+        key = []
+        for part, (field, descending) in zip(raw, self.sort):
+            if not descending:
+                key.append(tuple(part))
+            elif field == "domain":
+                key.append(_Descending(tuple(part)))
+            else:
+                # Unknown values stay last in either direction
+                key.append((part[0], _Descending(part[1])))
+        return tuple(key)
+
+    def _encode_cursor(self, record: Dict[str, Any]) -> str:
+        data = json.dumps({"sort": self._sort_spec(), "after": self._raw_key(record)}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def _decode_cursor(self, cursor: str) -> Tuple[Any, ...]:
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            after = data["after"]
+            sort = data["sort"]
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            raise DomainQueryError("Invalid cursor")
+        if sort != self._sort_spec() or not isinstance(after, list) or len(after) != len(self.sort):
+            raise DomainQueryError("Cursor does not match the sort order")
+        for part, (field, _) in zip(after, self.sort):
+            types = (str, str) if field == "domain" else (int, str)
+            if (not isinstance(part, list) or len(part) != 2
+                    or not all(isinstance(v, t) for v, t in zip(part, types))):
+                raise DomainQueryError("Invalid cursor")
+        return self._key(after)
+
+    def _matches(self, record: Dict[str, Any]) -> bool:
+        if self.statuses is not None and str(record.get("status", "")).lower() not in self.statuses:
+            return False
+        if self.issuer is not None and self.issuer not in str(record.get("ssl_issuer", "")).lower():
+            return False
+        if self.expiring_before is not None:
+            expiration = str(record.get("ssl_expiration", ""))
+            if not _DATE_RE.match(expiration) or expiration >= self.expiring_before:
+                return False
+        return True
+
+    def run(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Apply the query to a user's records.
+        :return: {"domains": page, "total": records matching the filters,
+                  "next_cursor": cursor of the next page, or None after the last}
+        """
+        keyed = [(self._key(self._raw_key(r)), r) for r in records if self._matches(r)]
+        # Lists come in domain order, so the default sort is a linear pass
+        keyed.sort(key=lambda item: item[0])
+
+        start = 0
+        if self.after is not None:
+            # First record after the cursor's key (binary search over the sorted keys)
+            low, high = 0, len(keyed)
+            while low < high:
+                middle = (low + high) // 2
+                if self.after < keyed[middle][0]:
+                    high = middle
+                else:
+                    low = middle + 1
+            start = low
+        end = len(keyed) if self.limit is None else min(len(keyed), start + self.limit)
+        page = [record for _, record in keyed[start:end]]
+
+        next_cursor = self._encode_cursor(page[-1]) if page and end < len(keyed) else None
+        if self.fields is not None:
+            page = [{field: record[field] for field in self.fields if field in record} for record in page]
+        return {"domains": page, "total": len(keyed), "next_cursor": next_cursor}
+
+
+def _split(value: Optional[str]) -> List[str]:
+    """Comma-separated query parameter -> list of non-empty items."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
@@ -0,0 +1,1006 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, get_ident, local
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from logger import setup_logger
+
+logger = setup_logger("DomainStore")
+
+# ----------------------------
+# Base directory for per-user JSON files
+# ----------------------------
+BASE_DIR = os.path.dirname(__file__)
+USERS_DATA_DIR = os.path.join(BASE_DIR, "UsersData")
+
+# ----------------------------
+# Storage backend configuration
+# ----------------------------
+# "json" (one file per user, default), "log" (per-user snapshot plus append-only
+# operation log) or "sqlite" (one indexed table)
+DOMAIN_STORE = os.getenv("DOMAIN_STORE", "json").strip().lower()
+DOMAIN_STORE_FILE = os.getenv("DOMAIN_STORE_FILE", os.path.join(USERS_DATA_DIR, "domains.db"))
+
+# ----------------------------
+# Domain list cache configuration (json store)
+# ----------------------------
+# Users whose parsed, indexed lists are kept in memory (0 disables the cache)
+DOMAIN_CACHE_SIZE = int(os.getenv("DOMAIN_CACHE_SIZE", "1000"))
+# Upper bound of the cached lists' total file size, in MB
+DOMAIN_CACHE_MAX_MB = float(os.getenv("DOMAIN_CACHE_MAX_MB", "256"))
+# Upper bound of the serialized domain list responses kept in memory, in MB (0 disables)
+DOMAIN_BODY_CACHE_MB = float(os.getenv("DOMAIN_BODY_CACHE_MB", "128"))
+
+# Stage json store changes and write a burst of them to disk once (see GroupCommitter)
+DOMAIN_GROUP_COMMIT = os.getenv("DOMAIN_GROUP_COMMIT", "1") == "1"
+
+# Log size (bytes) after which the log store folds a user's log into a new snapshot
+DOMAIN_LOG_COMPACT_BYTES = int(os.getenv("DOMAIN_LOG_COMPACT_BYTES", str(1024 * 1024)))
+
+# Largest IN (...) list per statement (SQLite's default variable limit is 999)
+_SQL_CHUNK = 500
+
+
+def _safe_user(username: str) -> str:
+    """The username as it appears in file names."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", username.strip())
+
+
+def _domains_path(username: str) -> str:
+    """Generate per-user JSON file path."""
+    return os.path.join(USERS_DATA_DIR, f"{_safe_user(username)}_domains.json")
+
+
+class DomainIndex:
+    """
+    A user's records in list order (case-insensitive by domain) plus a
+    domain -> record map for membership and lookups.
+
+    The order is maintained by bisect on every add and removal instead of
+    re-sorting the whole list, so a change costs O(log n) comparisons (and
+    a pointer move in the list); only building an index from unsorted
+    records sorts. Records are shared, not copied: callers must not modify
+    them in place.
+    """
+
+    __slots__ = ("_keys", "_list", "_records")
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = ()):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            if isinstance(record, dict) and record.get("domain"):
+                self._records.setdefault(record["domain"], record)
+        # (domain.lower(), domain), in list order; _list holds the records in the same order
+        self._keys = sorted((domain.lower(), domain) for domain in self._records)
+        self._list = [self._records[domain] for _, domain in self._keys]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self._records
+
+    def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        return self._records.get(domain)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """The records in order (a new list)."""
+        return list(self._list)
+
+    def copy(self) -> "DomainIndex":
+        """An independent index of the same records (copies the lists, no re-sort)."""
+        index = DomainIndex.__new__(DomainIndex)
+        index._records = dict(self._records)
+        index._keys = list(self._keys)
+        index._list = list(self._list)
+        return index
+
+    def add(self, record: Dict[str, Any]) -> bool:
+        """Add record unless its domain is indexed; returns True if added."""
+        domain = record["domain"]
+        if domain in self._records:
+            return False
+        self._records[domain] = record
+        key = (domain.lower(), domain)
+        position = bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self._list.insert(position, record)
+        return True
+
+    def put(self, record: Dict[str, Any]) -> bool:
+        """Add or replace the record of its domain; returns True if added."""
+        domain = record["domain"]
+        if domain not in self._records:
+            return self.add(record)
+        self._records[domain] = record
+        self._list[bisect_left(self._keys, (domain.lower(), domain))] = record
+        return False
+
+    def discard(self, domain: str) -> bool:
+        """Remove domain; returns True if it was indexed."""
+        if self._records.pop(domain, None) is None:
+            return False
+        position = bisect_left(self._keys, (domain.lower(), domain))
+        del self._keys[position]
+        del self._list[position]
+        return True
+
+
+def _encode_list(records: List[Dict[str, Any]]) -> str:
+    """
+    A JSON list with one record per line: still readable, but every record
+    goes through the C encoder (json.dump with indent runs in pure Python,
+    several times slower on large lists).
+    """
+    if not records:
+        return "[]\n"
+    encode = _RECORD_ENCODER.encode
+    return "[\n" + ",\n".join(encode(record) for record in records) + "\n]\n"
+
+
+_RECORD_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+# (st_mtime_ns, st_size, st_ino) of a user's file: any write changes at least one,
+# except a same-size rewrite within one tick of the kernel's file time clock
+_FileKey = Tuple[int, int, int]
+# Upper bound of that tick (Linux updates file times at most every 1/HZ s)
+_MTIME_GRANULARITY_NS = 20_000_000
+
+
+def _file_key(path: str) -> Optional[_FileKey]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class DomainListCache:
+    """
+    Bounded LRU of parsed domain lists (DomainIndex) per user.
+
+    An entry is only used while the user's file still has the mtime, size
+    and inode it was cached with, so changes written by other processes
+    (the scheduler, other API workers) are picked up on the next read.
+    As with git's index, an entry read within one file time tick of the
+    file's mtime is "racy" (a same-size rewrite could keep the key) and is
+    re-read once. Writes through the store replace the entry; they are
+    made under the user's lock, so their entries are trusted as is. Cached
+    indexes are shared: callers must not modify them, nor their records.
+    Memory use is reported as the cached lists' file size (JSON); the
+    parsed objects take a few times more.
+    """
+
+    def __init__(self, max_entries: int = DOMAIN_CACHE_SIZE,
+                 max_bytes: int = int(DOMAIN_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # username -> (file key, index, time.time_ns() before the key was read, or None if written)
+        self._lists: "OrderedDict[str, Tuple[_FileKey, DomainIndex, Optional[int]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.racy = 0
+        self.evictions = 0
+
+    def get(self, username: str, key: Optional[_FileKey]) -> Optional[DomainIndex]:
+        with self._lock:
+            entry = self._lists.get(username)
+            if entry is not None and entry[0] == key:
+                if entry[2] is None or key[0] < entry[2] - _MTIME_GRANULARITY_NS:
+                    self._lists.move_to_end(username)
+                    self.hits += 1
+                    return entry[1]
+                self.racy += 1
+            elif entry is not None:
+                # Changed behind our back (another process wrote the file)
+                self.stale += 1
+            self._remove(username)
+            self.misses += 1
+            return None
+
+    def put(self, username: str, key: Optional[_FileKey], index: DomainIndex,
+            observed_ns: Optional[int] = None) -> None:
+        """
+        Cache the index as key: read, with observed_ns the time.time_ns()
+        from before the stat, or written by this process (observed_ns None).
+        """
+        if key is None or self.max_entries <= 0 or key[1] > self.max_bytes:
+            self.discard(username)
+            return
+        with self._lock:
+            self._remove(username)
+            self._lists[username] = (key, index, observed_ns)
+            self._bytes += key[1]
+            while len(self._lists) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._lists)))
+                self.evictions += 1
+
+    def _remove(self, username: str) -> None:
+        """Drop an entry (caller holds the lock)."""
+        entry = self._lists.pop(username, None)
+        if entry is not None:
+            self._bytes -= entry[0][1]
+
+    def discard(self, username: str) -> None:
+        with self._lock:
+            self._remove(username)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lists.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lists),
+                "max_entries": self.max_entries,
+                "records": sum(len(entry[1]) for entry in self._lists.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "racy": self.racy,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class SerializedListCache:
+    """
+    Bounded LRU of ready-to-send serialized forms of users' domain lists
+    (e.g. the JSON and gzip bodies of one GET /api/domains query), so an
+    unchanged list is not loaded and serialized again for every request.
+
+    Each body is stored with the list version it was built from (see
+    DomainManagementEngine.domains_version) and only served for that
+    version, so writes by any process invalidate it; writes in this
+    process also drop the user's bodies right away.
+    """
+
+    def __init__(self, max_bytes: int = int(DOMAIN_BODY_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        # (username, key) -> (version, body)
+        self._bodies: "OrderedDict[Tuple[str, Any], Tuple[str, bytes]]" = OrderedDict()
+        self._keys: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, username: str, key: Any, version: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._bodies.get((username, key))
+            if entry is not None and entry[0] == version:
+                self._bodies.move_to_end((username, key))
+                self.hits += 1
+                return entry[1]
+            self._remove(username, key)
+            self.misses += 1
+            return None
+
+    def put(self, username: str, key: Any, version: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(username, key)
+            self._bodies[(username, key)] = (version, body)
+            self._keys.setdefault(username, set()).add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(*next(iter(self._bodies)))
+                self.evictions += 1
+
+    def _remove(self, username: str, key: Any) -> None:
+        """Drop an entry (caller holds the lock)."""
+        entry = self._bodies.pop((username, key), None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+            keys = self._keys[username]
+            keys.discard(key)
+            if not keys:
+                del self._keys[username]
+
+    def discard(self, username: str) -> None:
+        """Drop all of the user's bodies (their list changed)."""
+        with self._lock:
+            for key in list(self._keys.get(username, ())):
+                self._remove(username, key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._bodies),
+                "users": len(self._keys),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class DomainStore(ABC):
+    """
+    Storage of the users' domain records, keyed by (username, domain).
+
+    Backends only store; validation and merging stay in DomainManagementEngine,
+    which also serializes the writes of a user (backends need not lock).
+    Records are dicts with at least a "domain" key; load returns them sorted.
+    A backend must implement the abstract methods to be constructed.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def load(self, username: str) -> List[Dict[str, Any]]:
+        """The user's records, sorted by domain."""
+
+    @abstractmethod
+    def save(self, username: str, records: List[Dict[str, Any]]) -> None:
+        """Replace the user's whole list."""
+
+    def get(self, username: str, domains: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Stored records of the given domains (missing ones are left out)."""
+        wanted = set(domains)
+        return {r["domain"]: r for r in self.load(username) if r.get("domain") in wanted}
+
+    @abstractmethod
+    def insert(self, username: str, records: List[Dict[str, Any]]) -> List[str]:
+        """Add records whose domain is not stored yet; returns the domains added."""
+
+    @abstractmethod
+    def update(self, username: str, records: List[Dict[str, Any]]) -> None:
+        """Replace stored records by domain; records of domains not stored are dropped."""
+
+    @abstractmethod
+    def delete(self, username: str, domains: Sequence[str]) -> List[str]:
+        """Remove domains; returns those that were stored."""
+
+    @abstractmethod
+    def drop_user(self, username: str) -> None:
+        """Remove everything stored for the user."""
+
+    def staged(self, username: str) -> Optional[Tuple[DomainIndex, int]]:
+        """Changes accepted but not written yet (group commit); None when writes are immediate."""
+        return None
+
+    def generation(self, username: str) -> Optional[int]:
+        """Generation of staged(username) without copying it; None if nothing is staged."""
+        return None
+
+    def needs_compaction(self, username: str) -> bool:
+        """True if compact(username) is due (log-structured backends)."""
+        return False
+
+    def compact(self, username: str) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class JsonDomainStore(DomainStore):
+    """
+    One JSON list per user, a record per line (UsersData/<user>_domains.json).
+    Every change rewrites the user's file; parsed lists are served from a
+    DomainListCache while the file is unchanged.
+
+    Files are replaced atomically (temp file, fsync, rename, directory
+    fsync), so a crash leaves either the old or the new list, never a
+    truncated one. With group_commit, changes are staged in memory (loads
+    see them) and DomainManagementEngine writes each user's latest staged
+    list once for a whole burst of changes (see GroupCommitter).
+    """
+
+    name = "json"
+
+    # Staged lists not written yet, per file path, shared by all instances: (index, generation)
+    _staged: Dict[str, Tuple[DomainIndex, int]] = {}
+    _generations: Dict[str, int] = {}
+    _counters_lock = Lock()
+
+    def __init__(self, data_dir: Optional[str] = None, cache: Optional[DomainListCache] = None,
+                 group_commit: bool = False):
+        # Resolved per call unless given, so tests and tools may repoint USERS_DATA_DIR
+        self.data_dir = data_dir
+        self.cache = cache or DomainListCache()
+        self.group_commit = group_commit
+        self.saves = 0
+        self.writes = 0
+
+    def _path(self, username: str) -> str:
+        if self.data_dir is None:
+            return _domains_path(username)
+        return os.path.join(self.data_dir, os.path.basename(_domains_path(username)))
+
+    def _index(self, username: str) -> DomainIndex:
+        """The user's current index (staged, cached, or read and cached); read-only for callers."""
+        path = self._path(username)
+        staged = self._staged.get(path)
+        if staged is not None:
+            return staged[0]
+
+        observed_ns = time.time_ns()
+        key = _file_key(path)
+        if key is None:
+            index = DomainIndex()
+            self.write(username, index=index)
+            return index
+
+        cached = self.cache.get(username, key)
+        if cached is not None:
+            return cached
+
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+                if not isinstance(data, list):
+                    data = []
+            except json.JSONDecodeError as e:
+                # Keep the damaged file for recovery instead of overwriting it on the next save
+                aside = f"{path}.corrupt-{int(time.time())}"
+                logger.error(f"Domain list of {username} is not valid JSON ({e}), moved to {aside}")
+                os.replace(path, aside)
+                data = []
+        index = DomainIndex(data)
+        self.cache.put(username, key, index, observed_ns)
+        return index
+
+    def _modifiable(self, username: str) -> DomainIndex:
+        """
+        The user's index to change in place: the staged one, or the current
+        one taken out of the cache (write() puts it back), so a failed write
+        never leaves a changed index cached. Only call it for a change.
+        """
+        path = self._path(username)
+        staged = self._staged.get(path)
+        if staged is not None:
+            return staged[0]
+        index = self._index(username)
+        self.cache.discard(username)
+        return index
+
+    def load(self, username: str) -> List[Dict[str, Any]]:
+        """Load (or initialize) the user's list; the file holds only the list of records."""
+        return self._index(username).records()
+
+    def get(self, username: str, domains: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        index = self._index(username)
+        return {d: index.get(d) for d in domains if d in index}
+
+    def save(self, username: str, records: List[Dict[str, Any]]) -> None:
+        self._commit(username, DomainIndex(records))
+
+    def _commit(self, username: str, index: DomainIndex) -> None:
+        """Write the user's changed index, or stage it (group commit)."""
+        with self._counters_lock:
+            self.saves += 1
+        if not self.group_commit:
+            self.write(username, index=index)
+            return
+        path = self._path(username)
+        generation = self._generations.get(path, 0) + 1
+        self._generations[path] = generation
+        self._staged[path] = (index, generation)
+
+    def write(self, username: str, records: Optional[List[Dict[str, Any]]] = None,
+              index: Optional[DomainIndex] = None) -> None:
+        """
+        Durably replace the user's file with records, or with the records of
+        index (already in order: nothing is sorted). The index is cached.
+        """
+        path = self._path(username)
+        if index is None:
+            index = DomainIndex(records or [])
+        records = index.records()
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}-{get_ident()}"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(_encode_list(records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        with self._counters_lock:
+            self.writes += 1
+        self.cache.put(username, _file_key(path), index)
+
+    def staged(self, username: str) -> Optional[Tuple[DomainIndex, int]]:
+        """
+        (index, generation) staged for the user and not written yet. The index
+        is a copy, so it can be written while later changes stage the next one.
+        """
+        staged = self._staged.get(self._path(username))
+        return (staged[0].copy(), staged[1]) if staged is not None else None
+
+    def generation(self, username: str) -> Optional[int]:
+        staged = self._staged.get(self._path(username))
+        return staged[1] if staged is not None else None
+
+    def discard_staged(self, username: str, generation: Optional[int] = None) -> bool:
+        """
+        Forget the staged list once written (only if no newer one was staged
+        meanwhile, when generation is given). :return: True if nothing is staged now
+        """
+        path = self._path(username)
+        staged = self._staged.get(path)
+        if staged is not None and (generation is None or staged[1] == generation):
+            del self._staged[path]
+            return True
+        return staged is None
+
+    def insert(self, username: str, records: List[Dict[str, Any]]) -> List[str]:
+        current = self._index(username)
+        if all(record["domain"] in current for record in records):
+            return []
+        index = self._modifiable(username)
+        added = [record["domain"] for record in records if index.add(record)]
+        self._commit(username, index)
+        return added
+
+    def update(self, username: str, records: List[Dict[str, Any]]) -> None:
+        current = self._index(username)
+        replaced = [record for record in records if record["domain"] in current]
+        if not replaced:
+            return
+        index = self._modifiable(username)
+        for record in replaced:
+            index.put(record)
+        self._commit(username, index)
+
+    def delete(self, username: str, domains: Sequence[str]) -> List[str]:
+        current = self._index(username)
+        removed = [domain for domain in dict.fromkeys(domains) if domain in current]
+        if not removed:
+            return []
+        index = self._modifiable(username)
+        for domain in removed:
+            index.discard(domain)
+        self._commit(username, index)
+        return removed
+
+    def drop_user(self, username: str) -> None:
+        self.discard_staged(username)
+        self.cache.discard(username)
+        try:
+            os.remove(self._path(username))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counters_lock:
+            commits = {"group_commit": self.group_commit, "saves": self.saves, "writes": self.writes}
+        return {"backend": self.name, "cache": self.cache.stats(), "commits": commits}
+
+
+class _LogState:
+    """A user's records as of the snapshot plus the log up to offset."""
+
+    __slots__ = ("snapshot_key", "log_ino", "offset", "index")
+
+    def __init__(self, snapshot_key: Optional[_FileKey], index: DomainIndex):
+        self.snapshot_key = snapshot_key
+        self.log_ino: Optional[int] = None
+        self.offset = 0
+        self.index = index
+
+
+class LogDomainStore(DomainStore):
+    """
+    Log-structured per-user storage: a snapshot (the same
+    UsersData/<user>_domains.json list the json store uses) plus an
+    append-only NDJSON log (<user>_domains.log) of operations:
+
+        {"op": "put", "record": {...}}    add or replace the record of a domain
+        {"op": "del", "domain": "..."}    remove a domain
+        {"op": "replace", "records": [...]}   the whole list (save)
+
+    Adds, removes and result updates append (and fsync) only their lines,
+    so N single adds cost O(N) bytes instead of O(N^2). Reads replay the
+    log over the snapshot; the state is kept in memory and only log bytes
+    appended since (by any process) are read again. Once the log passes
+    DOMAIN_LOG_COMPACT_BYTES, compact() folds it into a new snapshot
+    (DomainManagementEngine runs it in the background). Operations are
+    idempotent, so a crash between writing the snapshot and removing the
+    log only replays the log again, and a torn last line is skipped.
+    save() first appends its list as one "replace" line: the old log can
+    then only be replayed under it, never over the new list.
+    """
+
+    name = "log"
+
+    def __init__(self, data_dir: Optional[str] = None, compact_bytes: int = DOMAIN_LOG_COMPACT_BYTES,
+                 max_users: int = DOMAIN_CACHE_SIZE):
+        self.snapshots = JsonDomainStore(data_dir, cache=DomainListCache(max_entries=0))
+        self.compact_bytes = compact_bytes
+        self.max_users = max_users
+        self._states: "OrderedDict[str, _LogState]" = OrderedDict()
+        self._lock = Lock()
+        self.appended_bytes = 0
+        self.compactions = 0
+
+    def _log_path(self, username: str) -> str:
+        return os.path.splitext(self.snapshots._path(username))[0] + ".log"
+
+    def _state(self, username: str) -> _LogState:
+        """Current state: cached, brought up to date with new log lines, or rebuilt (caller holds the user)."""
+        snapshot_key = _file_key(self.snapshots._path(username))
+        with self._lock:
+            state = self._states.get(username)
+            if state is not None:
+                self._states.move_to_end(username)
+        if state is None or snapshot_key is None or state.snapshot_key != snapshot_key:
+            # First read, or the snapshot was replaced (compaction, possibly by another process)
+            # Not cached by the snapshot store (max_entries=0): ours to change
+            index = self.snapshots._index(username)
+            state = _LogState(_file_key(self.snapshots._path(username)), index)
+            with self._lock:
+                self._states[username] = state
+                while len(self._states) > max(1, self.max_users):
+                    self._states.popitem(last=False)
+        self._replay(username, state)
+        return state
+
+    def _replay(self, username: str, state: _LogState) -> None:
+        """Apply the log lines appended since state.offset."""
+        try:
+            f = open(self._log_path(username), "rb")
+        except FileNotFoundError:
+            state.log_ino, state.offset = None, 0
+            return
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            if ino != state.log_ino:
+                if state.log_ino is not None:
+                    # Log replaced without a new snapshot: rebuild from scratch
+                    state.index = self.snapshots._index(username)
+                state.log_ino, state.offset = ino, 0
+            f.seek(state.offset)
+            data = f.read()
+        # Only complete lines; a torn last line (crash mid-append) stays unread
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                self._apply(state, json.loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.warning(f"Skipping damaged line in the domain log of {username}: {line[:80]!r}")
+        state.offset += end
+
+    @staticmethod
+    def _apply(state: _LogState, op: Dict[str, Any]) -> None:
+        if op["op"] == "put":
+            state.index.put(op["record"])
+        elif op["op"] == "del":
+            state.index.discard(op["domain"])
+        elif op["op"] == "replace":
+            state.index = DomainIndex(op["records"])
+
+    def _append(self, username: str, ops: List[Dict[str, Any]]) -> None:
+        """Durably append operations to the user's log and apply them to the cached state."""
+        if not ops:
+            return
+        state = self._state(username)
+        path = self._log_path(username)
+        data = "".join(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n" for op in ops).encode()
+        with open(path, "ab") as f:
+            size = f.tell()
+            if size > state.offset:
+                # A torn line from a crash: terminate it so it is skipped as one damaged line
+                data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            ino = os.fstat(f.fileno()).st_ino
+        if state.log_ino is None:
+            state.log_ino = ino
+        # Our lines are applied directly; the state is at the end of the log again
+        for op in ops:
+            self._apply(state, op)
+        state.offset = size + len(data)
+        with self._lock:
+            self.appended_bytes += len(data)
+
+    def load(self, username: str) -> List[Dict[str, Any]]:
+        return self._state(username).index.records()
+
+    def get(self, username: str, domains: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        index = self._state(username).index
+        return {d: index.get(d) for d in domains if d in index}
+
+    def save(self, username: str, records: List[Dict[str, Any]]) -> None:
+        """
+        Replace the whole list. The "replace" line is the commit point: a
+        crash before the new snapshot is in, or before the old log is gone,
+        replays the old operations under the new list instead of over it.
+        """
+        self._append(username, [{"op": "replace", "records": records}])
+        self._write_snapshot(username, records)
+
+    def _write_snapshot(self, username: str, records: List[Dict[str, Any]]) -> None:
+        """A new snapshot of the current list; the log it includes is dropped."""
+        self.snapshots.write(username, records)
+        try:
+            os.remove(self._log_path(username))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._states.pop(username, None)
+
+    def insert(self, username: str, records: List[Dict[str, Any]]) -> List[str]:
+        current = self._state(username).index
+        ops, added = [], set()
+        for record in records:
+            if record["domain"] not in current and record["domain"] not in added:
+                ops.append({"op": "put", "record": record})
+                added.add(record["domain"])
+        self._append(username, ops)
+        return [op["record"]["domain"] for op in ops]
+
+    def update(self, username: str, records: List[Dict[str, Any]]) -> None:
+        current = self._state(username).index
+        self._append(username, [{"op": "put", "record": r} for r in records if r["domain"] in current])
+
+    def delete(self, username: str, domains: Sequence[str]) -> List[str]:
+        current = self._state(username).index
+        removed = [d for d in dict.fromkeys(domains) if d in current]
+        self._append(username, [{"op": "del", "domain": d} for d in removed])
+        return removed
+
+    def drop_user(self, username: str) -> None:
+        with self._lock:
+            self._states.pop(username, None)
+        for path in (self._log_path(username), self.snapshots._path(username)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def needs_compaction(self, username: str) -> bool:
+        try:
+            return os.path.getsize(self._log_path(username)) > self.compact_bytes
+        except FileNotFoundError:
+            return False
+
+    def compact(self, username: str) -> None:
+        """Fold the log into a new snapshot (caller holds the user)."""
+        # The snapshot holds the log's operations already: replaying them again is harmless
+        self._write_snapshot(username, self.load(username))
+        with self._lock:
+            self.compactions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "users_cached": len(self._states),
+                "appended_bytes": self.appended_bytes,
+                "compactions": self.compactions,
+                "compact_bytes": self.compact_bytes,
+            }
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    username TEXT NOT NULL,
+    domain   TEXT NOT NULL,
+    record   TEXT NOT NULL,
+    PRIMARY KEY (username, domain)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteDomainStore(DomainStore):
+    """
+    All users' records in one SQLite table (WAL mode) keyed by (username,
+    domain), so adding, removing or updating a domain writes only its row.
+    Each record is stored as JSON next to its key.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = DOMAIN_STORE_FILE):
+        self.path = path
+        self._local = local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit, transactions are explicit."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def load(self, username: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT record FROM domains WHERE username = ?", (username,)).fetchall()
+        records = [json.loads(record) for (record,) in rows]
+        # The other stores' (DomainIndex) order; SQLite's ORDER BY is case-sensitive
+        records.sort(key=lambda r: (r["domain"].lower(), r["domain"]))
+        return records
+
+    def save(self, username: str, records: List[Dict[str, Any]]) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM domains WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO domains (username, domain, record) VALUES (?, ?, ?)",
+                [(username, r["domain"], json.dumps(r, ensure_ascii=False)) for r in records]
+            )
+
+    def get(self, username: str, domains: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        found = {}
+        domains = list(domains)
+        conn = self._conn()
+        for i in range(0, len(domains), _SQL_CHUNK):
+            chunk = domains[i:i + _SQL_CHUNK]
+            rows = conn.execute(
+                f"SELECT domain, record FROM domains WHERE username = ? "
+                f"AND domain IN ({','.join('?' * len(chunk))})",
+                (username, *chunk)
+            ).fetchall()
+            found.update((domain, json.loads(record)) for domain, record in rows)
+        return found
+
+    def insert(self, username: str, records: List[Dict[str, Any]]) -> List[str]:
+        added = []
+        with self._transaction() as conn:
+            for r in records:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO domains (username, domain, record) VALUES (?, ?, ?)",
+                    (username, r["domain"], json.dumps(r, ensure_ascii=False))
+                )
+                if cursor.rowcount:
+                    added.append(r["domain"])
+        return added
+
+    def update(self, username: str, records: List[Dict[str, Any]]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE domains SET record = ? WHERE username = ? AND domain = ?",
+                [(json.dumps(r, ensure_ascii=False), username, r["domain"]) for r in records]
+            )
+
+    def delete(self, username: str, domains: Sequence[str]) -> List[str]:
+        removed = []
+        with self._transaction() as conn:
+            for domain in domains:
+                cursor = conn.execute("DELETE FROM domains WHERE username = ? AND domain = ?",
+                                      (username, domain))
+                if cursor.rowcount:
+                    removed.append(domain)
+        return removed
+
+    def drop_user(self, username: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM domains WHERE username = ?", (username,))
+
+
+def make_domain_store(kind: str = DOMAIN_STORE) -> DomainStore:
+    """Backend selected by the DOMAIN_STORE setting."""
+    if kind == "sqlite":
+        return SqliteDomainStore()
+    if kind == "log":
+        return LogDomainStore()
+    if kind != "json":
+        logger.warning(f"Unknown domain store '{kind}', using json")
+    return JsonDomainStore(group_commit=DOMAIN_GROUP_COMMIT)
+
+
+def _users_by_file_name(users_file: str) -> Dict[str, Optional[str]]:
+    """
+    File name form of every username in users_file -> the username, or None
+    when several usernames share the form (their files cannot be told apart).
+    """
+    try:
+        with open(users_file, "r", encoding="utf-8") as f:
+            usernames = [user["username"] for user in json.load(f)]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"{users_file} could not be read: {e}")
+        return {}
+    users: Dict[str, Optional[str]] = {}
+    for username in usernames:
+        safe_user = _safe_user(username)
+        users[safe_user] = username if users.get(safe_user, username) == username else None
+    return users
+
+
+def migrate_json_files(target: DomainStore, source_dir: str = USERS_DATA_DIR,
+                       users_file: Optional[str] = None) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Import every <user>_domains.json of source_dir (with its log, if the log
+    store wrote one) into target, replacing what target held for those users
+    (so the import can be re-run).
+
+    File names hold the username with unsafe characters replaced, so the
+    owner of a file is looked up in users_file (default: source_dir's
+    users.json). Files of no registered user, or of several, are skipped.
+    :return: ({username: records imported}, paths skipped)
+    """
+    users = _users_by_file_name(users_file or os.path.join(source_dir, "users.json"))
+    source = LogDomainStore(source_dir)
+    imported, skipped = {}, []
+    for path in sorted(glob.glob(os.path.join(source_dir, "*_domains.json"))):
+        username = users.get(os.path.basename(path)[:-len("_domains.json")])
+        if username is None:
+            logger.warning(f"Skipped {path}: it belongs to no single user of the users file")
+            skipped.append(path)
+            continue
+        records = [r for r in source.load(username) if isinstance(r, dict) and r.get("domain")]
+        target.save(username, records)
+        imported[username] = len(records)
+        logger.info(f"Imported {len(records)} domains of {username} from {path}")
+    return imported, skipped
+
+
+# -------------------------------------------------
+# ENTRYPOINT
+# -------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Domain storage maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="import UsersData/*_domains.json into SQLite")
+    migrate.add_argument("--source", default=USERS_DATA_DIR, help="directory of the JSON files")
+    migrate.add_argument("--db", default=DOMAIN_STORE_FILE, help="SQLite file (default: DOMAIN_STORE_FILE)")
+    migrate.add_argument("--users", help="users.json naming the files' owners (default: the one in --source)")
+    compact = subcommands.add_parser("compact", help="fold every log of the log store into its snapshot "
+                                                     "(e.g. before switching back to the json store)")
+    compact.add_argument("--source", default=USERS_DATA_DIR, help="directory of the snapshots and logs")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        counts, skipped = migrate_json_files(SqliteDomainStore(args.db), args.source, args.users)
+        print(f"Imported {sum(counts.values())} domains of {len(counts)} users into {args.db}")
+        if skipped:
+            print(f"Skipped {len(skipped)} files that match no single user:", *skipped, sep="\n  ")
+            sys.exit(1)
+    else:
+        # Stop the API and the scheduler first: compaction takes no user locks here
+        store = LogDomainStore(args.source)
+        logs = sorted(glob.glob(os.path.join(args.source, "*_domains.log")))
+        for path in logs:
+            store.compact(os.path.basename(path)[:-len("_domains.log")])
+        print(f"Compacted {len(logs)} domain logs in {args.source}")
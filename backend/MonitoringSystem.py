@@ -1,80 +1,302 @@
+import asyncio
+import errno
+import os
+import select
 import socket
 import ssl
+import time
 import concurrent.futures
 from datetime import datetime, timezone
-from typing import Dict, Any, List
+from threading import Event
+from typing import Callable, Dict, Any, List, Optional
 from logger import setup_logger
-from DomainManagementEngine import DomainManagementEngine
+from DomainManagementEngine import DomainManagementEngine, _utc_now_iso
+from ProbeCaches import (
+    DNS_CACHE, PROBE_COALESCER, CERT_CACHE, TLS_SESSIONS, HOST_TIMEOUTS, PROBE_TIMEOUT_FLOOR, _normalize_host
+)
+from ProbeMetrics import PROCESS_STATS, ScanStats, current_scan, count, observe
+from ScanCheckpoint import BatchedResultWriter, ScanCheckpoint
+from ScanExecutor import SCAN_EXECUTOR
+from ScanProcessPool import SCAN_PROCESS_POOL
 
 logger = setup_logger("MonitoringSystem")
 
 SSL_CTX = ssl.create_default_context()
 
+# ----------------------------
+# Scan engine configuration
+# ----------------------------
+# "threads" (shared ScanExecutor, default), "asyncio" (single event loop)
+# or "processes" (domains sharded across ScanProcessPool worker processes)
+SCAN_ENGINE = os.getenv("SCAN_ENGINE", "threads").strip().lower()
+SCAN_ENGINES = ("threads", "asyncio", "processes")
+# Upper bound of concurrent probes for the asyncio engine
+ASYNC_MAX_INFLIGHT = int(os.getenv("SCAN_ASYNC_MAX_INFLIGHT", "1000"))
+# Seconds to wait for a TLS 1.3 session ticket from a host we hold none for
+TLS_TICKET_WAIT = float(os.getenv("TLS_TICKET_WAIT", "0.05"))
+# Ports probed on every host (overridden by the benchmarks' local stand-in servers)
+HTTPS_PORT = int(os.getenv("PROBE_HTTPS_PORT", "443"))
+HTTP_PORT = int(os.getenv("PROBE_HTTP_PORT", "80"))
+
+# connect_ex() results meaning the connect timeout expired
+_TIMEOUT_ERRNOS = {errno.EAGAIN, errno.EWOULDBLOCK, errno.ETIMEDOUT, errno.EINPROGRESS}
+
+
+def _empty_result(domain: str) -> Dict[str, Any]:
+    """Return the result record of a domain that could not be reached."""
+    return {
+        "domain": domain,
+        "status": "Down",
+        "ssl_expiration": "N/A",
+        "ssl_issuer": "N/A",
+        "last_check": _utc_now_iso()
+    }
+
+
+def _apply_cert(result: Dict[str, Any], cert: Optional[Dict[str, Any]]) -> Optional[datetime]:
+    """
+    Fill SSL expiration, issuer and status from a parsed peer certificate.
+    Returns the certificate expiry, or None when it has no notAfter.
+    """
+    cert = cert or {}
+    expiry_date = None
+
+    expiry_str = cert.get("notAfter")
+    if expiry_str:
+        expiry_date = datetime.strptime(expiry_str, "%b %d %H:%M:%S %Y %Z").replace(
+            tzinfo=timezone.utc
+        )
+        result["ssl_expiration"] = expiry_date.strftime("%Y-%m-%d")
+
+        result["status"] = "Live"
+
+    issuer = next(
+        (v for tup in cert.get("issuer", []) for k, v in tup if k == "organizationName"),
+        None
+    )
+    result["ssl_issuer"] = issuer or "Unknown"
+    return expiry_date
+
+
+def _failure_outcome(error: BaseException) -> str:
+    """Outcome label of a failed probe phase, for the phase histograms."""
+    if isinstance(error, (socket.timeout, asyncio.TimeoutError, ConnectionAbortedError)):
+        return "timeout"
+    if isinstance(error, ConnectionRefusedError):
+        return "refused"
+    return "error"
+
+
+def _http_head_request(host: str) -> bytes:
+    return f"HEAD / HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode()
+
+
+class _HostTiming:
+    """
+    One probe's view of a host's learned timeouts (see HostTimeouts).
+    Timeouts are fixed when the probe starts; observed durations and
+    timeouts are fed back for the next probe of the host.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.connect_timeout = HOST_TIMEOUTS.timeout(host, "connect")
+        self.handshake_timeout = HOST_TIMEOUTS.timeout(host, "handshake")
+        self.http_timeout = HOST_TIMEOUTS.timeout(host, "http")
+
+    def connected(self, seconds: float) -> None:
+        HOST_TIMEOUTS.observe(self.host, "connect", seconds)
+
+    def handshaken(self, seconds: float) -> None:
+        HOST_TIMEOUTS.observe(self.host, "handshake", seconds)
+
+    def responded(self, seconds: float) -> None:
+        HOST_TIMEOUTS.observe(self.host, "http", seconds)
+
+    def timed_out(self, phase: str) -> None:
+        HOST_TIMEOUTS.timed_out(self.host, phase)
+
+
 class MonitoringSystem:
+    # username -> summary of that user's last scan
+    _scan_summaries: Dict[str, Dict[str, Any]] = {}
+
     @staticmethod
-    def _check_domain(domain: str) -> Dict[str, Any]:
+    def _check_domain(domain: str, force_refresh: bool = False) -> Dict[str, Any]:
         """
         Check reachability and SSL certificate details using sockets.
         Falls back to HTTP port 80 if SSL is unavailable.
+        While the host's certificate is cached (see CertCache) a TCP connect to
+        port 443 replaces the TLS handshake, unless force_refresh is set.
+        Timeouts are learned per host (see HostTimeouts).
         Returns: Live / Expired SSL / Down
         """
-        result = {
-            "domain": domain,
-            "status": "Down",
-            "ssl_expiration": "N/A",
-            "ssl_issuer": "N/A"
-        }
+        result = _empty_result(domain)
 
         # Normalize host
-        host = domain.lower().strip().replace("http://", "").replace("https://", "").split("/")[0]
+        host = _normalize_host(domain)
 
-        # DNS Check - no need to check further if the dns did not resolve the ip
-        try:
-            ip = socket.gethostbyname(host)
-        except Exception as e:
+        # DNS Check - no need to check further if the dns did not resolve the ip.
+        # The address is resolved once (through the shared cache) and reused by
+        # both connections; the host name is still sent as SNI / Host header.
+        started = time.monotonic()
+        ip = DNS_CACHE.resolve(host)
+        observe("dns", time.monotonic() - started, "ok" if ip else "failed")
+        if ip is None:
             logger.warning(f"DNS failed to resolve the domain: {domain}")
             return result
 
+        timing = _HostTiming(host)
+
+        # --- Certificate still cached: HTTPS reachability is all we need ---
+        cached = None if force_refresh else CERT_CACHE.get(host, ip)
+        if cached is not None:
+            if MonitoringSystem._tcp_connects(domain, ip, HTTPS_PORT, timing):
+                count("cert_cache_hits")
+                result.update(cached)
+                return result
+            CERT_CACHE.invalidate(host, ip)
+
         # --- Try HTTPS first ---
+        elif MonitoringSystem._check_https(domain, host, ip, result, timing):
+            return result
+
+        # --- Fallback: try HTTP port 80 ---
+        MonitoringSystem._check_http(domain, host, ip, result, timing)
+        return result
+
+    @staticmethod
+    def _connect(sock: socket.socket, ip: str, port: int, timing: _HostTiming) -> int:
+        """connect_ex within the host's connect timeout; leaves the handshake timeout set."""
+        sock.settimeout(timing.connect_timeout)
+        started = time.monotonic()
+        code = sock.connect_ex((ip, port))
+        elapsed = time.monotonic() - started
+
+        if code == 0:
+            timing.connected(elapsed)
+            observe("tcp", elapsed)
+        elif code in _TIMEOUT_ERRNOS or elapsed >= timing.connect_timeout:
+            timing.timed_out("connect")
+            observe("tcp", elapsed, "timeout")
+        else:
+            observe("tcp", elapsed, "refused" if code == errno.ECONNREFUSED else "error")
+
+        sock.settimeout(timing.handshake_timeout)
+        return code
+
+    @staticmethod
+    def _tcp_connects(domain: str, ip: str, port: int, timing: _HostTiming) -> bool:
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.settimeout(1)
-                if sock.connect_ex((host, 443)) == 0:
-                    with SSL_CTX.wrap_socket(sock, server_hostname=host) as ssock:
-                        cert = ssock.getpeercert()
-
-                        expiry_str = cert.get("notAfter")
-                        if expiry_str:
-                            expiry_date = datetime.strptime(expiry_str, "%b %d %H:%M:%S %Y %Z").replace(
-                                tzinfo=timezone.utc
-                            )
-                            result["ssl_expiration"] = expiry_date.strftime("%Y-%m-%d")
-
-                            result["status"] = "Live"
-
-                        issuer = next(
-                            (v for tup in cert.get("issuer", []) for k, v in tup if k == "organizationName"),
-                            None
-                        )
-                        result["ssl_issuer"] = issuer or "Unknown"
+                if MonitoringSystem._connect(sock, ip, port, timing) == 0:
+                    return True
+                logger.debug(f"TCP connection to port {port} is unavailable for {domain}")
+        except Exception as e:
+            logger.warning(f"TCP check of port {port} failed for {domain}: {e}")
+        return False
 
-                        return result 
+    @staticmethod
+    def _check_https(domain: str, host: str, ip: str, result: Dict[str, Any],
+                     timing: _HostTiming) -> bool:
+        """TLS handshake on port 443; True when a certificate was read into result."""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                if MonitoringSystem._connect(sock, ip, HTTPS_PORT, timing) == 0:
+                    session = TLS_SESSIONS.get(host)
+                    started = time.monotonic()
+                    try:
+                        ssock = SSL_CTX.wrap_socket(sock, server_hostname=host, session=session)
+                    except Exception as e:
+                        observe("tls", time.monotonic() - started, _failure_outcome(e))
+                        raise
+                    elapsed = time.monotonic() - started
+                    timing.handshaken(elapsed)
+                    observe("tls", elapsed, "resumed" if ssock.session_reused else "ok")
+                    with ssock:
+                        MonitoringSystem._read_session_ticket(ssock, host, have_ticket=session is not None)
+                        MonitoringSystem._record_tls_session(host, ssock, offered=session is not None)
+                        expiry_date = _apply_cert(result, ssock.getpeercert())
+                        CERT_CACHE.put(host, ip, result, expiry_date)
+                        return True
                 else:
                     logger.debug(f"HTTPS connection is unavailable for {domain}")
 
-        except (socket.timeout, ssl.SSLError) as e:
+        except socket.timeout as e:
+            timing.timed_out("handshake")
+            logger.warning(f"HTTPS failed for {domain}: {e}")
+        except ssl.SSLError as e:
             logger.warning(f"HTTPS failed for {domain}: {e}")
         except Exception as e:
             logger.error(f"HTTPS Error for {domain}: {e}")
+        return False
 
-        # --- Fallback: try HTTP port 80 ---
-        try:   
+    @staticmethod
+    def _read_session_ticket(ssock: ssl.SSLSocket, host: str, have_ticket: bool) -> None:
+        """
+        TLS 1.3 servers send session tickets after the handshake, about one RTT
+        later. Process a ticket if one is already here; only when no ticket is
+        known for the host, wait up to TLS_TICKET_WAIT seconds for it, and
+        return as soon as it arrived. A host that sends none within the wait
+        is not waited for again (see TlsSessionCache.no_ticket).
+        """
+        if ssock.version() != "TLSv1.3" or (ssock.session and ssock.session.has_ticket):
+            return
+        wait = TLS_TICKET_WAIT if not have_ticket and TLS_SESSIONS.sends_tickets(host) else 0
+        deadline = time.monotonic() + wait
+        # Non-blocking reads process what arrived (the ticket is no application
+        # data, so a blocking read would wait for the whole timeout anyway)
+        ssock.setblocking(False)
+        while True:
+            try:
+                ssock.recv(1)
+                return  # Application data or the connection closed: no ticket coming
+            except ssl.SSLWantReadError:
+                pass
+            except (ssl.SSLError, OSError):
+                return
+            if ssock.session and ssock.session.has_ticket:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([ssock], [], [], remaining)[0]:
+                break
+        if wait > 0:
+            TLS_SESSIONS.no_ticket(host)
+
+    @staticmethod
+    def _record_tls_session(host: str, ssl_obj: Any, offered: bool) -> None:
+        """Count the handshake and keep a resumable session for the next connection."""
+        if ssl_obj is None:
+            return
+        count("tls_handshakes")
+        if offered:
+            count("tls_sessions_offered")
+        if ssl_obj.session_reused:
+            count("tls_sessions_resumed")
+
+        session = ssl_obj.session
+        # A TLS 1.3 session is only resumable once its ticket arrived
+        if session is not None and (session.has_ticket or ssl_obj.version() != "TLSv1.3"):
+            TLS_SESSIONS.put(host, session)
+
+    @staticmethod
+    def _check_http(domain: str, host: str, ip: str, result: Dict[str, Any],
+                    timing: _HostTiming) -> None:
+        """HEAD request on port 80; marks result Live when an HTTP response comes back."""
+        try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.settimeout(1)
-                if sock.connect_ex((host, 80)) == 0:
-                    http_request = f"HEAD / HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n"
-                    sock.sendall(http_request.encode())
-                    response = sock.recv(512).decode(errors="ignore")
+                if MonitoringSystem._connect(sock, ip, HTTP_PORT, timing) == 0:
+                    sock.settimeout(timing.http_timeout)
+                    started = time.monotonic()
+                    try:
+                        sock.sendall(_http_head_request(host))
+                        response = sock.recv(512).decode(errors="ignore")
+                    except Exception as e:
+                        observe("http", time.monotonic() - started, _failure_outcome(e))
+                        raise
+                    elapsed = time.monotonic() - started
+                    timing.responded(elapsed)
+                    observe("http", elapsed, "ok" if response else "empty")
 
                     if "HTTP" in response:
                         result["status"] = "Live"
@@ -84,32 +306,459 @@ class MonitoringSystem:
                     logger.debug(f"HTTP connection is unavailable for {domain}")
 
         except socket.timeout:
+            timing.timed_out("http")
             logger.warning(f"Timeout while checking HTTP for {domain}")
         except Exception as e:
             logger.warning(f"HTTP fallback failed for {domain}: {e}")
 
+
+    @staticmethod
+    async def _check_domain_async(domain: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        asyncio counterpart of _check_domain: same checks, same result dict,
+        but a probe only costs a coroutine instead of a blocked thread.
+        """
+        result = _empty_result(domain)
+        host = _normalize_host(domain)
+
+        # DNS Check - no need to check further if the dns did not resolve the ip
+        started = time.monotonic()
+        ip = await DNS_CACHE.resolve_async(host)
+        observe("dns", time.monotonic() - started, "ok" if ip else "failed")
+        if ip is None:
+            logger.warning(f"DNS failed to resolve the domain: {domain}")
+            return result
+
+        timing = _HostTiming(host)
+
+        # --- Certificate still cached: HTTPS reachability is all we need ---
+        cached = None if force_refresh else CERT_CACHE.get(host, ip)
+        if cached is not None:
+            if await MonitoringSystem._tcp_connects_async(domain, ip, HTTPS_PORT, timing):
+                count("cert_cache_hits")
+                result.update(cached)
+                return result
+            CERT_CACHE.invalidate(host, ip)
+
+        # --- Try HTTPS first ---
+        elif await MonitoringSystem._check_https_async(domain, host, ip, result, timing):
+            return result
+
+        # --- Fallback: try HTTP port 80 ---
+        await MonitoringSystem._check_http_async(domain, host, ip, result, timing)
+        return result
+
+    @staticmethod
+    async def _open_async(ip: str, port: int, timing: _HostTiming):
+        """open_connection within the host's connect timeout, feeding the estimate."""
+        started = time.monotonic()
+        try:
+            streams = await asyncio.wait_for(asyncio.open_connection(ip, port),
+                                             timeout=timing.connect_timeout)
+        except asyncio.TimeoutError:
+            timing.timed_out("connect")
+            observe("tcp", time.monotonic() - started, "timeout")
+            raise
+        except Exception as e:
+            observe("tcp", time.monotonic() - started, _failure_outcome(e))
+            raise
+        elapsed = time.monotonic() - started
+        timing.connected(elapsed)
+        observe("tcp", elapsed)
+        return streams
+
+    @staticmethod
+    async def _tcp_connects_async(domain: str, ip: str, port: int, timing: _HostTiming) -> bool:
+        writer = None
+        try:
+            _, writer = await MonitoringSystem._open_async(ip, port, timing)
+            return True
+        except ConnectionRefusedError:
+            logger.debug(f"TCP connection to port {port} is unavailable for {domain}")
+        except Exception as e:
+            logger.warning(f"TCP check of port {port} failed for {domain}: {e!r}")
+        finally:
+            await MonitoringSystem._close_writer(writer)
+        return False
+
+    @staticmethod
+    async def _check_https_async(domain: str, host: str, ip: str, result: Dict[str, Any],
+                                 timing: _HostTiming) -> bool:
+        """
+        open_connection(ssl=...) connects and handshakes in one call, so the
+        measured duration (fed to the handshake estimate and the "tls" phase)
+        includes the connect.
+        """
+        writer = None
+        started = time.monotonic()
+        try:
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        ip, HTTPS_PORT, ssl=SSL_CTX, server_hostname=host,
+                        ssl_handshake_timeout=timing.handshake_timeout
+                    ),
+                    timeout=timing.connect_timeout + timing.handshake_timeout
+                )
+            except Exception as e:
+                outcome = _failure_outcome(e)
+                observe("tcp" if outcome == "refused" else "tls", time.monotonic() - started, outcome)
+                raise
+            elapsed = time.monotonic() - started
+            timing.handshaken(elapsed)
+            observe("tls", elapsed)
+            # asyncio cannot offer a session on connect, but the one it gets
+            # is kept for the thread engine's next handshake with this host
+            MonitoringSystem._record_tls_session(host, writer.get_extra_info("ssl_object"), offered=False)
+            expiry_date = _apply_cert(result, writer.get_extra_info("peercert"))
+            CERT_CACHE.put(host, ip, result, expiry_date)
+            return True
+
+        except ConnectionRefusedError:
+            logger.debug(f"HTTPS connection is unavailable for {domain}")
+        except (asyncio.TimeoutError, ConnectionAbortedError) as e:
+            # ConnectionAbortedError is raised when ssl_handshake_timeout expires
+            timing.timed_out("handshake")
+            logger.warning(f"HTTPS failed for {domain}: {e!r}")
+        except ssl.SSLError as e:
+            logger.warning(f"HTTPS failed for {domain}: {e!r}")
+        except Exception as e:
+            logger.error(f"HTTPS Error for {domain}: {e!r}")
+        finally:
+            await MonitoringSystem._close_writer(writer)
+        return False
+
+    @staticmethod
+    async def _check_http_async(domain: str, host: str, ip: str, result: Dict[str, Any],
+                                timing: _HostTiming) -> None:
+        writer = None
+        try:
+            reader, writer = await MonitoringSystem._open_async(ip, HTTP_PORT, timing)
+            started = time.monotonic()
+            try:
+                writer.write(_http_head_request(host))
+                await writer.drain()
+                response = await asyncio.wait_for(reader.read(512), timeout=timing.http_timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    timing.timed_out("http")
+                observe("http", time.monotonic() - started, _failure_outcome(e))
+                raise
+            elapsed = time.monotonic() - started
+            timing.responded(elapsed)
+            observe("http", elapsed, "ok" if response else "empty")
+
+            if "HTTP" in response.decode(errors="ignore"):
+                result["status"] = "Live"
+            else:
+                result["status"] = "Down"
+
+        except ConnectionRefusedError:
+            logger.debug(f"HTTP connection is unavailable for {domain}")
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout while checking HTTP for {domain}")
+        except Exception as e:
+            logger.warning(f"HTTP fallback failed for {domain}: {e!r}")
+        finally:
+            await MonitoringSystem._close_writer(writer)
+
+    @staticmethod
+    async def _close_writer(writer: Optional[asyncio.StreamWriter]) -> None:
+        """Close a stream without letting a slow or broken peer stall the probe."""
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), timeout=PROBE_TIMEOUT_FLOOR)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _probe(domain: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        _check_domain shared across users: if the host is already being probed,
+        or was probed within PROBE_REUSE_WINDOW seconds, reuse that result.
+        force_refresh only joins probes that are still running.
+        """
+        started = time.monotonic()
+        host = _normalize_host(domain)
+        future, owner = PROBE_COALESCER.claim(host, reuse_finished=not force_refresh)
+        if owner:
+            try:
+                result = MonitoringSystem._check_domain(domain, force_refresh)
+            except BaseException as e:
+                PROBE_COALESCER.finish(host, future, error=e)
+                raise
+            PROBE_COALESCER.finish(host, future, result)
+
+        # Every user gets an own copy of the record, under its own domain spelling
+        result = dict(future.result(), domain=domain)
+        observe("probe", time.monotonic() - started, result["status"])
         return result
 
+    @staticmethod
+    async def _probe_async(domain: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """asyncio counterpart of _probe; shares results with the thread engine too."""
+        started = time.monotonic()
+        host = _normalize_host(domain)
+        future, owner = PROBE_COALESCER.claim(host, reuse_finished=not force_refresh)
+        if owner:
+            try:
+                result = await MonitoringSystem._check_domain_async(domain, force_refresh)
+            except BaseException as e:
+                PROBE_COALESCER.finish(host, future, error=e)
+                raise
+            PROBE_COALESCER.finish(host, future, result)
+
+        result = dict(await asyncio.wrap_future(future), domain=domain)
+        observe("probe", time.monotonic() - started, result["status"])
+        return result
+
+    @staticmethod
+    def _scan_with_threads(username: str, domains: List[str], force_refresh: bool,
+                           on_result: Callable[[Dict[str, Any]], None],
+                           cancel: Optional[Event], keep_results: bool) -> List[Dict[str, Any]]:
+        """Queue the probes on the process-wide executor, fairly shared with other users."""
+        results = []
+        futures = [SCAN_EXECUTOR.submit(username, MonitoringSystem._probe, d, force_refresh) for d in domains]
+        for future in concurrent.futures.as_completed(futures):
+            if cancel is not None and cancel.is_set():
+                # Probes still queued are dropped; running ones finish unobserved
+                for pending in futures:
+                    pending.cancel()
+                break
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Domain check failed in worker: {e}")
+                continue
+            if keep_results:
+                results.append(result)
+            on_result(result)
+        return results
+
+    @staticmethod
+    def _scan_with_processes(username: str, domains: List[str], force_refresh: bool,
+                             on_result: Callable[[Dict[str, Any]], None],
+                             cancel: Optional[Event], keep_results: bool) -> List[Dict[str, Any]]:
+        """Shard the probes across worker processes; their stats are merged into this scan's."""
+        results, shard_stats = SCAN_PROCESS_POOL.scan(username, domains, force_refresh, on_result, cancel,
+                                                      keep_results=keep_results)
+        stats = current_scan.get()
+        for exported in shard_stats:
+            PROCESS_STATS.merge(exported)
+            if stats is not None:
+                stats.merge(exported)
+        return results
+
+    @staticmethod
+    async def _scan_with_asyncio(domains: List[str], max_inflight: int, force_refresh: bool,
+                                 on_result: Callable[[Dict[str, Any]], None],
+                                 cancel: Optional[Event], keep_results: bool) -> List[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(max_inflight)
+
+        async def bounded_check(domain: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                if cancel is not None and cancel.is_set():
+                    return None
+                return await MonitoringSystem._probe_async(domain, force_refresh)
+
+        results = []
+        for next_done in asyncio.as_completed([bounded_check(d) for d in domains]):
+            try:
+                result = await next_done
+            except Exception as e:
+                logger.error(f"Domain check failed in event loop: {e}")
+                continue
+            if result is None:
+                continue
+            if keep_results:
+                results.append(result)
+            on_result(result)
+        return results
 
     @staticmethod
-    def scan_user_domains(username: str, dme: DomainManagementEngine, max_workers: int = 50) -> List[Dict[str, Any]]:
+    def scan_domains(username: str, domains: List[str], engine: Optional[str] = None,
+                     force_refresh: bool = False,
+                     on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     cancel: Optional[Event] = None,
+                     stats: Optional[ScanStats] = None,
+                     keep_results: bool = True) -> List[Dict[str, Any]]:
+        """
+        Probe the given domains on behalf of username, without touching storage.
+        The "threads" engine runs on the shared ScanExecutor, whose size
+        (SCAN_MAX_WORKERS) caps probe threads for the whole process.
+        :param engine: "threads", "asyncio" or "processes"; defaults to the SCAN_ENGINE
+                       setting. The thread engine is used whenever asyncio cannot run.
+        :param force_refresh: ignore cached certificates and recent shared results,
+                              so every domain gets a full TLS handshake.
+        :param on_result: called with each result as soon as its probe finishes
+        :param cancel: once set, remaining probes are skipped and the results
+                       gathered so far are returned
+        :param stats: collect this scan's counters and phase histograms here
+        :param keep_results: False returns an empty list, for callers that
+                             consume results through on_result only (large
+                             scans then do not hold every result in memory)
+        """
+        engine = (engine or SCAN_ENGINE).strip().lower()
+        if engine not in SCAN_ENGINES:
+            logger.warning(f"Unknown scan engine '{engine}', using threads")
+            engine = "threads"
+
+        scanned = 0
+
+        def emit(result: Dict[str, Any]) -> None:
+            nonlocal scanned
+            scanned += 1
+            if on_result is not None:
+                on_result(result)
+
+        results = None
+        stats = stats if stats is not None else ScanStats()
+        started = time.monotonic()
+        token = current_scan.set(stats)
+        try:
+            if engine == "processes":
+                results = MonitoringSystem._scan_with_processes(
+                    username, domains, force_refresh, emit, cancel, keep_results
+                )
+            elif engine == "asyncio":
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    results = asyncio.run(
+                        MonitoringSystem._scan_with_asyncio(
+                            domains, ASYNC_MAX_INFLIGHT, force_refresh, emit, cancel, keep_results
+                        )
+                    )
+                else:
+                    logger.warning("asyncio engine called from a running event loop, using threads")
+                    engine = "threads"
+
+            if results is None:
+                results = MonitoringSystem._scan_with_threads(
+                    username, domains, force_refresh, emit, cancel, keep_results
+                )
+        finally:
+            current_scan.reset(token)
+
+        summary = MonitoringSystem._summarize(engine, scanned, time.monotonic() - started, stats)
+        MonitoringSystem._scan_summaries[username] = summary
+        HOST_TIMEOUTS.maybe_save()
+        return results
+
+    @staticmethod
+    def scan_user_domains(username: str, dme: DomainManagementEngine,
+                          engine: Optional[str] = None,
+                          force_refresh: bool = False,
+                          on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                          cancel: Optional[Event] = None,
+                          on_start: Optional[Callable[[int], None]] = None,
+                          scan_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Run SSL and reachability checks for all domains concurrently.
+        Results are stored in batches while the scan runs (only those that
+        changed, the summary's "changed" count) and checkpointed, so a scan
+        interrupted by a crash or restart resumes with the domains it had not
+        stored yet (the summary's "resumed" count) the next time it runs.
+        See scan_domains for the options;
+        on_start is called with the number of domains about to be probed;
+        scan_id names the scan's checkpoint (a new id if not given).
+        A cancelled scan keeps the results it stored and starts over next time.
+        :return: the scan summary, None if the user has no domains
         """
-        domains = dme.load_user_domains(username)
+        domains = [d["domain"] for d in dme.load_user_domains(username)]
         if not domains:
+            if on_start is not None:
+                on_start(0)
             logger.info(f"No domains found for user {username}")
-            return []
+            return None
 
-        results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(MonitoringSystem._check_domain, d["domain"]): d for d in domains}
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    results.append(future.result())
-                except Exception as e:
-                    logger.error(f"Domain check failed in worker: {e}")
+        checkpoint = ScanCheckpoint(username, scan_id)
+        try:
+            remaining = checkpoint.resume(domains)
+            if on_start is not None:
+                on_start(len(remaining))
 
-        dme.save_user_domains(username, results)
-        logger.info(f"{len(results)} domains scanned for {username}")
-        return results
+            writer = BatchedResultWriter(dme, username, checkpoint)
+
+            def store(result: Dict[str, Any]) -> None:
+                writer.add(result)
+                if on_result is not None:
+                    on_result(result)
+
+            try:
+                MonitoringSystem.scan_domains(
+                    username, remaining, engine=engine, force_refresh=force_refresh,
+                    on_result=store, cancel=cancel, keep_results=False
+                )
+            finally:
+                # Also on errors: what was probed is kept, the checkpoint says what is left
+                writer.flush()
+            checkpoint.clear()
+        finally:
+            # Unlocked, a checkpoint left behind is resumed by the user's next scan
+            checkpoint.close()
+
+        summary = MonitoringSystem.get_scan_summary(username)
+        if summary is not None:
+            summary["changed"] = writer.changed
+            summary["resumed"] = len(domains) - len(remaining)
+
+        if cancel is not None and cancel.is_set():
+            logger.info(f"Scan for {username} cancelled after {writer.stored} of {len(remaining)} domains")
+            return summary
+
+        logger.info(f"{writer.stored} domains scanned for {username}, {writer.changed} changed; "
+                    f"summary: {summary}; caches: {MonitoringSystem.cache_stats()}")
+        return summary
+
+    @staticmethod
+    def _summarize(engine: str, scanned: int, duration: float, stats: ScanStats) -> Dict[str, Any]:
+        counters = stats.snapshot()
+        handshakes = counters.get("tls_handshakes", 0)
+        resumed = counters.get("tls_sessions_resumed", 0)
+        return {
+            "engine": engine,
+            "domains": scanned,
+            "duration_ms": round(duration * 1000, 1),
+            "cert_cache_hits": counters.get("cert_cache_hits", 0),
+            "tls": {
+                "handshakes": handshakes,
+                "sessions_offered": counters.get("tls_sessions_offered", 0),
+                "sessions_resumed": resumed,
+                "resumption_rate": round(resumed / handshakes, 4) if handshakes else 0.0,
+            },
+            # Where the time went: queue (waiting for a worker) / dns / tcp / tls / http / probe
+            # durations and outcomes
+            "phases": stats.phases(buckets=False),
+        }
+
+    @staticmethod
+    def get_scan_summary(username: str) -> Optional[Dict[str, Any]]:
+        """Summary of the user's last scan in this process (None if never scanned)."""
+        return MonitoringSystem._scan_summaries.get(username)
+
+    @staticmethod
+    def cache_stats() -> Dict[str, Any]:
+        """Counters of the process-wide probe caches."""
+        return {
+            "dns": DNS_CACHE.stats(),
+            "probes": PROBE_COALESCER.stats(),
+            "certificates": CERT_CACHE.stats(),
+            "tls_sessions": TLS_SESSIONS.stats(),
+            "host_timeouts": HOST_TIMEOUTS.stats(),
+        }
+
+    @staticmethod
+    def metrics() -> Dict[str, Any]:
+        """Counters and per-phase latency histograms of every probe since process start."""
+        return {
+            "counters": PROCESS_STATS.snapshot(),
+            "phases": PROCESS_STATS.phases(),
+        }
+
+    @staticmethod
+    def executor_stats() -> Dict[str, Any]:
+        """Queue depth, running probes and queue wait times of the shared executor."""
+        return dict(SCAN_EXECUTOR.stats(), process_pool=SCAN_PROCESS_POOL.stats())
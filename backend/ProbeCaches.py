@@ -0,0 +1,522 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import ssl
+import concurrent.futures
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple, Any
+
+# Seconds allowed for a network step of a host nothing has been learned about yet
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "1"))
+
+# ----------------------------
+# Adaptive timeout configuration
+# ----------------------------
+PROBE_TIMEOUT_FLOOR = float(os.getenv("PROBE_TIMEOUT_FLOOR", "0.2"))
+PROBE_TIMEOUT_CEILING = float(os.getenv("PROBE_TIMEOUT_CEILING", "5"))
+# Consecutive connect timeouts after which a host is treated as black-holed
+HOST_BLACKHOLE_AFTER = int(os.getenv("HOST_BLACKHOLE_AFTER", "4"))
+# Seconds between full-length connect attempts to a black-holed host
+HOST_BLACKHOLE_RETRY = float(os.getenv("HOST_BLACKHOLE_RETRY", "3600"))
+HOST_TIMEOUTS_FILE = os.getenv(
+    "HOST_TIMEOUTS_FILE",
+    os.path.join(os.path.dirname(__file__), "UsersData", "host_timeouts.json")
+)
+HOST_TIMEOUTS_SAVE_INTERVAL = float(os.getenv("HOST_TIMEOUTS_SAVE_INTERVAL", "60"))
+
+# ----------------------------
+# DNS cache configuration
+# ----------------------------
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "300"))
+DNS_NEGATIVE_TTL = float(os.getenv("DNS_NEGATIVE_TTL", "30"))
+DNS_CACHE_MAX_ENTRIES = int(os.getenv("DNS_CACHE_MAX_ENTRIES", "50000"))
+
+# ----------------------------
+# Probe coalescing configuration
+# ----------------------------
+# Seconds a finished probe result is reused by other users' scans (0 = in-flight only)
+PROBE_REUSE_WINDOW = float(os.getenv("PROBE_REUSE_WINDOW", "60"))
+
+# ----------------------------
+# Certificate cache configuration
+# ----------------------------
+# An entry lives for this fraction of the certificate's remaining validity...
+CERT_CACHE_TTL_FRACTION = float(os.getenv("CERT_CACHE_TTL_FRACTION", "0.1"))
+# ...clamped to these bounds (seconds)
+CERT_CACHE_MIN_TTL = float(os.getenv("CERT_CACHE_MIN_TTL", "300"))
+CERT_CACHE_MAX_TTL = float(os.getenv("CERT_CACHE_MAX_TTL", "86400"))
+
+# ----------------------------
+# TLS session cache configuration
+# ----------------------------
+TLS_SESSION_CACHE_SIZE = int(os.getenv("TLS_SESSION_CACHE_SIZE", "10000"))
+
+# getaddrinfo errors meaning "this name does not exist" (safe to cache).
+# Temporary failures such as EAI_AGAIN are never cached.
+_NXDOMAIN_ERRNOS = {socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)}
+
+
+def _normalize_host(domain: str) -> str:
+    """Strip scheme and path from a stored domain to get the host to probe (and cache by)."""
+    return domain.lower().strip().replace("http://", "").replace("https://", "").split("/")[0]
+
+
+def _system_resolve(host: str) -> str:
+    """Resolve host to its first IPv4 address (probes use AF_INET sockets)."""
+    infos = socket.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+    return infos[0][4][0]
+
+
+class DnsCache:
+    """
+    Process-wide resolver cache shared by every probe.
+
+    Successful lookups are kept for `ttl` seconds, names that do not exist
+    (NXDOMAIN) for `negative_ttl` seconds. `resolver` can be swapped for a
+    stub resolver (e.g. in benchmarks); it must return an IPv4 string or
+    raise socket.gaierror.
+    """
+
+    def __init__(self, ttl: float = DNS_CACHE_TTL, negative_ttl: float = DNS_NEGATIVE_TTL,
+                 max_entries: int = DNS_CACHE_MAX_ENTRIES,
+                 resolver: Callable[[str], str] = _system_resolve):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.resolver = resolver
+        # host -> (ip or None for NXDOMAIN, expires_at on the monotonic clock)
+        self._entries: Dict[str, Tuple[Optional[str], float]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _cached(self, host: str) -> Tuple[bool, Optional[str]]:
+        """Return (found, ip) and count the hit or miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry and entry[1] > now:
+                self.hits += 1
+                if entry[0] is None:
+                    self.negative_hits += 1
+                return True, entry[0]
+            self.misses += 1
+            return False, None
+
+    def _store(self, host: str, ip: Optional[str], ttl: float) -> None:
+        with self._lock:
+            if len(self._entries) >= self.max_entries and host not in self._entries:
+                now = time.monotonic()
+                for key in [k for k, (_, exp) in self._entries.items() if exp <= now]:
+                    del self._entries[key]
+                if len(self._entries) >= self.max_entries:
+                    # Still full: drop the oldest insertion
+                    del self._entries[next(iter(self._entries))]
+            self._entries[host] = (ip, time.monotonic() + ttl)
+
+    def _resolve_uncached(self, host: str) -> Optional[str]:
+        try:
+            ip = self.resolver(host)
+        except socket.gaierror as e:
+            if e.errno in _NXDOMAIN_ERRNOS:
+                self._store(host, None, self.negative_ttl)
+            return None
+        except (UnicodeError, OSError):
+            return None
+        self._store(host, ip, self.ttl)
+        return ip
+
+    def resolve(self, host: str) -> Optional[str]:
+        """Return the IPv4 address of host, or None if it does not resolve."""
+        found, ip = self._cached(host)
+        if found:
+            return ip
+        return self._resolve_uncached(host)
+
+    async def resolve_async(self, host: str) -> Optional[str]:
+        """Event-loop friendly resolve(); misses run in the loop's default executor."""
+        found, ip = self._cached(host)
+        if found:
+            return ip
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._resolve_uncached, host)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+DNS_CACHE = DnsCache()
+
+
+class ProbeCoalescer:
+    """
+    Host-keyed sharing of probe results between scans of different users.
+
+    The first caller to claim() a host becomes its owner and must publish the
+    outcome with finish(); everyone else gets the owner's future, both while
+    the probe is running and for `window` seconds after it finished.
+    """
+
+    def __init__(self, window: float = PROBE_REUSE_WINDOW, max_entries: int = DNS_CACHE_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        # host -> (future, finished_at on the monotonic clock, None while running)
+        self._entries: Dict[str, Tuple[concurrent.futures.Future, Optional[float]]] = {}
+        self._lock = Lock()
+        self.shared = 0
+        self.probed = 0
+
+    def _purge(self, now: float) -> None:
+        """Drop finished entries older than the window (caller holds the lock)."""
+        stale = [h for h, (_, done) in self._entries.items() if done is not None and now - done >= self.window]
+        for host in stale:
+            del self._entries[host]
+
+    def claim(self, host: str, reuse_finished: bool = True) -> Tuple[concurrent.futures.Future, bool]:
+        """
+        Return (future, owner); owner is True when the caller has to run the probe.
+        With reuse_finished=False only a probe that is still running is joined.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry:
+                future, done = entry
+                if done is None or (reuse_finished and now - done < self.window):
+                    self.shared += 1
+                    return future, False
+            if len(self._entries) >= self.max_entries:
+                self._purge(now)
+
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            self._entries[host] = (future, None)
+            self.probed += 1
+            return future, True
+
+    def finish(self, host: str, future: concurrent.futures.Future,
+               result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Publish the owner's outcome; failed probes are not kept for reuse."""
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry and entry[0] is future:
+                if error is None and self.window > 0:
+                    self._entries[host] = (future, time.monotonic())
+                else:
+                    del self._entries[host]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {h: e for h, e in self._entries.items() if e[1] is None}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.shared + self.probed
+            return {
+                "entries": len(self._entries),
+                "probed": self.probed,
+                "shared": self.shared,
+                "share_rate": round(self.shared / requests, 4) if requests else 0.0,
+            }
+
+
+PROBE_COALESCER = ProbeCoalescer()
+
+
+class CertCache:
+    """
+    Certificate details (status, expiration, issuer) keyed by (host, ip).
+
+    An entry lives for CERT_CACHE_TTL_FRACTION of the certificate's remaining
+    validity, clamped to [min_ttl, max_ttl] and never past the expiry itself,
+    so certificates close to expiry are re-read far more often.
+    """
+
+    def __init__(self, ttl_fraction: float = CERT_CACHE_TTL_FRACTION,
+                 min_ttl: float = CERT_CACHE_MIN_TTL, max_ttl: float = CERT_CACHE_MAX_TTL,
+                 max_entries: int = DNS_CACHE_MAX_ENTRIES):
+        self.ttl_fraction = ttl_fraction
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        # (host, ip) -> (details, expires_at on the monotonic clock)
+        self._entries: Dict[Tuple[str, str], Tuple[Dict[str, str], float]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def ttl_for(self, not_after: datetime) -> float:
+        """Seconds an entry for a certificate expiring at not_after may be reused."""
+        remaining = (not_after - datetime.now(timezone.utc)).total_seconds()
+        if remaining <= 0:
+            return 0.0
+        ttl = min(self.max_ttl, max(self.min_ttl, remaining * self.ttl_fraction))
+        return min(ttl, remaining)
+
+    def get(self, host: str, ip: str) -> Optional[Dict[str, str]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, ip))
+            if entry and entry[1] > now:
+                self.hits += 1
+                return dict(entry[0])
+            if entry:
+                del self._entries[(host, ip)]
+            self.misses += 1
+            return None
+
+    def put(self, host: str, ip: str, result: Dict[str, Any], not_after: Optional[datetime]) -> None:
+        """Remember the certificate fields of a successful probe result."""
+        if not_after is None or result.get("status") != "Live":
+            return
+        ttl = self.ttl_for(not_after)
+        if ttl <= 0:
+            return
+        details = {k: result[k] for k in ("status", "ssl_expiration", "ssl_issuer")}
+        with self._lock:
+            if len(self._entries) >= self.max_entries and (host, ip) not in self._entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[(host, ip)] = (details, time.monotonic() + ttl)
+
+    def invalidate(self, host: str, ip: str) -> None:
+        with self._lock:
+            if self._entries.pop((host, ip), None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+CERT_CACHE = CertCache()
+
+
+class TlsSessionCache:
+    """
+    Bounded LRU of the last ssl.SSLSession seen per host. Offering it on the
+    next connection lets servers that support resumption skip the full
+    handshake (certificate exchange and key agreement) on repeated scans.
+    Also remembers TLS 1.3 hosts that sent no session ticket when waited
+    for, so probes of them do not wait again.
+    """
+
+    def __init__(self, max_entries: int = TLS_SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[str, ssl.SSLSession]" = OrderedDict()
+        self._without_tickets: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, host: str) -> Optional[ssl.SSLSession]:
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                self._sessions.move_to_end(host)
+            return session
+
+    def put(self, host: str, session: Optional[ssl.SSLSession]) -> None:
+        if session is None:
+            return
+        with self._lock:
+            self._sessions[host] = session
+            self._sessions.move_to_end(host)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+            self._without_tickets.pop(host, None)
+
+    def sends_tickets(self, host: str) -> bool:
+        """False if the host sent no ticket the last time it was waited for."""
+        with self._lock:
+            return host not in self._without_tickets
+
+    def no_ticket(self, host: str) -> None:
+        """The host sent no ticket within the wait: do not wait for one again."""
+        with self._lock:
+            self._without_tickets[host] = None
+            self._without_tickets.move_to_end(host)
+            while len(self._without_tickets) > self.max_entries:
+                self._without_tickets.popitem(last=False)
+
+    def discard(self, host: str) -> None:
+        with self._lock:
+            self._sessions.pop(host, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._without_tickets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._sessions), "max_entries": self.max_entries,
+                    "hosts_without_tickets": len(self._without_tickets)}
+
+
+TLS_SESSIONS = TlsSessionCache()
+
+
+class HostTimeouts:
+    """
+    Per-host connect, handshake and HTTP response timeouts learned from
+    observed durations.
+
+    Each phase keeps a smoothed RTT and its variance like TCP's retransmission
+    timer (RFC 6298): timeout = srtt + 4 * rttvar, clamped to [floor, ceiling].
+    A timed-out phase doubles its timeout for the next probe, so slow hosts
+    get the time they need. After HOST_BLACKHOLE_AFTER consecutive connect
+    timeouts the host counts as black-holed and is probed with the floor,
+    except for one full-length attempt every HOST_BLACKHOLE_RETRY seconds.
+    The estimates are saved to HOST_TIMEOUTS_FILE so they outlive the process.
+    """
+
+    PHASES = ("connect", "handshake", "http")
+    _ALPHA = 1 / 8
+    _BETA = 1 / 4
+
+    def __init__(self, initial: float = PROBE_TIMEOUT, floor: float = PROBE_TIMEOUT_FLOOR,
+                 ceiling: float = PROBE_TIMEOUT_CEILING, path: Optional[str] = HOST_TIMEOUTS_FILE,
+                 max_entries: int = DNS_CACHE_MAX_ENTRIES):
+        self.initial = initial
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.path = path
+        self.max_entries = max_entries
+        # host -> {"connect": [srtt|None, rttvar, failures], "handshake": [...], "http": [...],
+        #          "retry_at": epoch}
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self._lock = Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self.load()
+
+    def _entry(self, host: str) -> Dict[str, Any]:
+        """Return (creating if needed) the host's estimates (caller holds the lock)."""
+        entry = self._hosts.get(host)
+        if entry is None:
+            if len(self._hosts) >= self.max_entries:
+                del self._hosts[next(iter(self._hosts))]
+            entry = {phase: [None, 0.0, 0] for phase in self.PHASES}
+            entry["retry_at"] = 0.0
+            self._hosts[host] = entry
+        return entry
+
+    def _clamp(self, seconds: float) -> float:
+        return min(self.ceiling, max(self.floor, seconds))
+
+    def timeout(self, host: str, phase: str) -> float:
+        """Seconds to allow for phase ("connect", "handshake" or "http") of the next probe."""
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                return self._clamp(self.initial)
+
+            srtt, rttvar, failures = entry[phase]
+            if phase == "connect" and failures >= HOST_BLACKHOLE_AFTER:
+                now = time.time()
+                if now < entry["retry_at"]:
+                    return self.floor
+                entry["retry_at"] = now + HOST_BLACKHOLE_RETRY
+                return self.ceiling
+
+            base = self.initial if srtt is None else srtt + 4 * rttvar
+            return self._clamp(base * (2 ** min(failures, 8)))
+
+    def observe(self, host: str, phase: str, seconds: float) -> None:
+        """Feed a successful phase duration into the host's estimate."""
+        with self._lock:
+            estimate = self._entry(host)[phase]
+            srtt, rttvar, _ = estimate
+            if srtt is None:
+                srtt, rttvar = seconds, seconds / 2
+            else:
+                rttvar = (1 - self._BETA) * rttvar + self._BETA * abs(srtt - seconds)
+                srtt = (1 - self._ALPHA) * srtt + self._ALPHA * seconds
+            estimate[:] = [srtt, rttvar, 0]
+            self._dirty = True
+
+    def timed_out(self, host: str, phase: str) -> None:
+        with self._lock:
+            self._entry(host)[phase][2] += 1
+            self._dirty = True
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for host, entry in data.items():
+                if all(isinstance(entry.get(phase), list) for phase in ("connect", "handshake")):
+                    # Files written before the "http" phase existed
+                    entry.setdefault("http", [None, 0.0, 0])
+                    self._hosts[host] = entry
+
+    def save(self) -> None:
+        """Write the estimates to disk (temp file + rename, so readers never see half a file)."""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._hosts)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def maybe_save(self) -> None:
+        """save() if something changed and HOST_TIMEOUTS_SAVE_INTERVAL has passed."""
+        with self._lock:
+            due = self._dirty and time.monotonic() - self._saved_at >= HOST_TIMEOUTS_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hosts": len(self._hosts),
+                "learned": sum(1 for e in self._hosts.values() if e["connect"][0] is not None),
+                "blackholed": sum(1 for e in self._hosts.values()
+                                  if e["connect"][2] >= HOST_BLACKHOLE_AFTER),
+            }
+
+
+HOST_TIMEOUTS = HostTimeouts()
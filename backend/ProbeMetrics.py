@@ -0,0 +1,155 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+# Upper bounds (milliseconds) of the latency histogram buckets; one more
+# bucket catches everything slower than the last bound
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram: observing is a bisect and a few additions,
+    so it is cheap enough for every probe phase. Not locked by itself.
+    """
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.outcomes: Dict[str, int] = {}
+
+    def observe(self, ms: float, outcome: str) -> None:
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def export(self) -> Dict[str, Any]:
+        """Raw state, picklable, for merging into another process' histogram."""
+        return {"buckets": list(self.buckets), "count": self.count, "total_ms": self.total_ms,
+                "max_ms": self.max_ms, "outcomes": dict(self.outcomes)}
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        for i, n in enumerate(data["buckets"]):
+            self.buckets[i] += n
+        self.count += data["count"]
+        self.total_ms += data["total_ms"]
+        self.max_ms = max(self.max_ms, data["max_ms"])
+        for outcome, n in data["outcomes"].items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + n
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                bound = HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self, buckets: bool = True) -> Dict[str, Any]:
+        snapshot = {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 2),
+            "outcomes": dict(self.outcomes),
+        }
+        if buckets:
+            snapshot["buckets"] = {f"le_{b}ms": n for b, n in zip(HISTOGRAM_BOUNDS_MS, self.buckets)}
+            snapshot["buckets"]["inf"] = self.buckets[-1]
+        return snapshot
+
+
+class ScanStats:
+    """Thread-safe named counters and phase histograms of one scan (or of the whole process)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: Dict[str, int] = {}
+        self._phases: Dict[str, Histogram] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, phase: str, ms: float, outcome: str) -> None:
+        with self._lock:
+            histogram = self._phases.get(phase)
+            if histogram is None:
+                histogram = self._phases[phase] = Histogram()
+            histogram.observe(ms, outcome)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters)
+
+    def export(self) -> Dict[str, Any]:
+        """Counters and raw histograms, e.g. to send a worker process' stats to the parent."""
+        with self._lock:
+            return {"counters": dict(self._counters),
+                    "phases": {phase: h.export() for phase, h in self._phases.items()}}
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """Add the counters and histograms of an export() to these stats."""
+        with self._lock:
+            for name, amount in data["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + amount
+            for phase, histogram in data["phases"].items():
+                self._phases.setdefault(phase, Histogram()).merge(histogram)
+
+    def phases(self, buckets: bool = True) -> Dict[str, Any]:
+        """Histogram snapshot of every phase observed so far."""
+        with self._lock:
+            return {phase: histogram.snapshot(buckets) for phase, histogram in self._phases.items()}
+
+
+# Totals since process start
+PROCESS_STATS = ScanStats()
+
+# Stats of the scan the current probe belongs to. Set by scan_user_domains;
+# asyncio tasks inherit it and ScanExecutor runs tasks in the submitter's context.
+current_scan: ContextVar[Optional[ScanStats]] = ContextVar("current_scan", default=None)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a counter of the current scan and of the process totals."""
+    PROCESS_STATS.incr(name, amount)
+    scan = current_scan.get()
+    if scan is not None:
+        scan.incr(name, amount)
+
+
+def observe(phase: str, seconds: float, outcome: str = "ok") -> None:
+    """
+    Record how long one probe phase took and how it ended, in the current
+    scan and in the process totals.
+    :param phase: "dns", "tcp", "tls", "http", "probe" (a whole domain check)
+                  or "queue" (waiting for a ScanExecutor worker)
+    :param outcome: "ok", "resumed" (a "tls" handshake that resumed a session),
+                    "empty" (an "http" connection closed without a response),
+                    or how it failed: "timeout", "refused", "error" ("failed"
+                    for a name that did not resolve); for "probe" the
+                    domain's status ("Live", "Down", ...)
+    """
+    ms = seconds * 1000
+    PROCESS_STATS.observe(phase, ms, outcome)
+    scan = current_scan.get()
+    if scan is not None:
+        scan.observe(phase, ms, outcome)
@@ -0,0 +1,198 @@
+import glob
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+from logger import setup_logger
+from DomainStore import USERS_DATA_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: a running scan's checkpoint is not protected from other scans
+    fcntl = None
+
+logger = setup_logger("ScanCheckpoint")
+
+# ----------------------------
+# Checkpoint configuration
+# ----------------------------
+# Results stored per batch while a scan runs (and checkpointed with it)
+SCAN_SAVE_BATCH = int(os.getenv("SCAN_SAVE_BATCH", "500"))
+# Seconds after which a partly filled batch is stored anyway
+SCAN_SAVE_INTERVAL = float(os.getenv("SCAN_SAVE_INTERVAL", "5"))
+# Seconds after its start an interrupted scan can be resumed (about one scan's
+# duration); older checkpoints start over, so stored results are not trusted
+# as fresh for long
+SCAN_CHECKPOINT_MAX_AGE = float(os.getenv("SCAN_CHECKPOINT_MAX_AGE", "900"))
+
+
+def _safe_user(username: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", username.strip())
+
+
+def _checkpoint_path(username: str, scan_id: str) -> str:
+    return os.path.join(USERS_DATA_DIR, f"{_safe_user(username)}_{scan_id}_scan.checkpoint")
+
+
+class ScanCheckpoint:
+    """
+    Progress of one running scan of a user, so a scan interrupted by a
+    crash or restart resumes where it stopped instead of starting over.
+
+    Append-only NDJSON file per scan (<user>_<scan id>_scan.checkpoint): a
+    header line, then one line per stored batch listing its domains. A line
+    is only written after the batch's results are saved, so every domain
+    listed has its result on disk. A torn last line (crash while appending)
+    is ignored.
+
+    The running scan holds a lock (flock) on its file, so scans of the same
+    user in other workers neither resume nor remove it. A new scan takes
+    over the checkpoints of scans that died, unless they started more than
+    SCAN_CHECKPOINT_MAX_AGE seconds ago.
+    """
+
+    def __init__(self, username: str, scan_id: Optional[str] = None):
+        self.username = username
+        # Letters and digits only, so "<user>_<id>" cannot be another user's name
+        self.scan_id = scan_id if scan_id and re.fullmatch(r"[A-Za-z0-9]+", scan_id) else uuid.uuid4().hex
+        self.path = _checkpoint_path(username, self.scan_id)
+        self._file = None
+
+    def _others(self) -> List[str]:
+        """Checkpoint files of the user's other scans."""
+        name = re.compile(rf"{re.escape(_safe_user(self.username))}_[A-Za-z0-9]+_scan\.checkpoint")
+        pattern = os.path.join(glob.escape(USERS_DATA_DIR), f"{glob.escape(_safe_user(self.username))}_*_scan.checkpoint")
+        return [path for path in glob.glob(pattern)
+                if path != self.path and name.fullmatch(os.path.basename(path))]
+
+    @staticmethod
+    def _running(path: str) -> bool:
+        """True if a live scan holds the checkpoint's lock."""
+        if fcntl is None:
+            return False
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True  # Taken over and removed meanwhile
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        """Header plus the set of done domains, or None if the checkpoint is unusable or too old."""
+        done: Set[str] = set()
+        header = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if header is None:
+                        header = entry
+                    else:
+                        done.update(entry.get("done", []))
+        except OSError as e:
+            logger.warning(f"Could not read scan checkpoint of {self.username}: {e}")
+            return None
+        if header is None or time.time() - header.get("started_at", 0) > SCAN_CHECKPOINT_MAX_AGE:
+            return None
+        return {"started_at": header["started_at"], "done": done}
+
+    def resume(self, domains: List[str]) -> List[str]:
+        """
+        Start this scan's checkpoint and return the domains still to probe:
+        those not done by interrupted scans of the user, or all of them.
+        """
+        started_at, done, abandoned = time.time(), set(), []
+        for path in self._others():
+            if self._running(path):
+                continue
+            abandoned.append(path)
+            previous = self._read(path)
+            if previous is not None:
+                # Taken over results are only as fresh as the scan that stored them
+                started_at = min(started_at, previous["started_at"])
+                done |= previous["done"]
+
+        os.makedirs(USERS_DATA_DIR, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._file.write(json.dumps({"username": self.username, "scan_id": self.scan_id,
+                                     "started_at": started_at, "domains": len(domains)}) + "\n")
+        if done:
+            self._file.write(json.dumps({"done": sorted(done)}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        for path in abandoned:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        remaining = [d for d in domains if d not in done]
+        if len(remaining) < len(domains):
+            logger.info(f"Resuming scan of {self.username}: {len(domains) - len(remaining)} "
+                        f"domains already done, {len(remaining)} left")
+        return remaining
+
+    def mark_done(self, domains: List[str]) -> None:
+        """Record stored domains; flushed to disk before returning."""
+        self._file.write(json.dumps({"done": domains}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """Release the checkpoint (it stays for the next scan to resume unless cleared)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.close()
+
+
+class BatchedResultWriter:
+    """
+    Stores a running scan's results every SCAN_SAVE_BATCH results or
+    SCAN_SAVE_INTERVAL seconds, then checkpoints them, so only the current
+    batch is held in memory and lost on a crash.
+    """
+
+    def __init__(self, dme: Any, username: str, checkpoint: ScanCheckpoint,
+                 batch: int = SCAN_SAVE_BATCH, interval: float = SCAN_SAVE_INTERVAL):
+        self.dme = dme
+        self.username = username
+        self.checkpoint = checkpoint
+        self.batch_size = max(1, batch)
+        self.interval = interval
+        self.changed = 0
+        self.stored = 0
+        self._batch: List[Dict[str, Any]] = []
+        self._flushed_at = time.monotonic()
+
+    def add(self, result: Dict[str, Any]) -> None:
+        self._batch.append(result)
+        if len(self._batch) >= self.batch_size or time.monotonic() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._flushed_at = time.monotonic()
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        self.changed += self.dme.update_domain_results(self.username, batch)
+        self.checkpoint.mark_done([r["domain"] for r in batch])
+        self.stored += len(batch)
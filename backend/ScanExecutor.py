@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import os
+import time
+import concurrent.futures
+import contextvars
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, List
+from logger import setup_logger
+from ProbeMetrics import observe
+
+logger = setup_logger("ScanExecutor")
+
+# ----------------------------
+# Executor configuration
+# ----------------------------
+# Hard cap of probe threads for the whole process (all users together)
+SCAN_MAX_WORKERS = int(os.getenv("SCAN_MAX_WORKERS", "50"))
+
+
+class ScanExecutor:
+    """
+    Process-wide bounded thread pool for domain probes, shared by all users.
+
+    Work is ordered by weighted fair queuing: every task gets a virtual finish
+    tag of max(virtual_time, user's previous tag) + 1/weight and workers always
+    run the smallest tag. Users with queued work therefore take turns, so a
+    user with 5,000 domains cannot starve a user with 10.
+    Tasks run in a copy of the submitter's context (like asyncio tasks do),
+    so context variables such as the current scan's stats follow them.
+
+    Each task's queue wait is recorded as the "queue" phase of the
+    submitter's scan (ProbeMetrics.current_scan), so a user's own scan
+    summary shows how long their probes waited. Per-user state is dropped
+    as soon as the user has nothing queued, and stats() reports only totals
+    (no usernames), since it is served without authentication.
+    """
+
+    def __init__(self, max_workers: int = SCAN_MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._cond = Condition()
+        # (tag, seq, user, context, fn, args, future, enqueued_at)
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._queued: Dict[str, int] = {}
+        # Queue wait of every task taken, and of users' current bursts
+        self._wait = {"count": 0, "total": 0.0, "max": 0.0}
+        self._user_wait: Dict[str, Dict[str, float]] = {}
+        self._running = 0
+        self._workers: List[Thread] = []
+
+    def _ensure_workers(self) -> None:
+        """Start the worker threads on first use (caller holds the lock)."""
+        while len(self._workers) < self.max_workers:
+            worker = Thread(target=self._work, name=f"scan-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, user: str, fn: Callable[..., Any], *args: Any,
+               weight: float = 1.0) -> concurrent.futures.Future:
+        """Queue fn(*args) on behalf of user; a higher weight gets a larger share."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._cond:
+            start = max(self._virtual_time, self._last_tag.get(user, 0.0))
+            tag = start + 1.0 / max(weight, 1e-6)
+            self._last_tag[user] = tag
+            self._queued[user] = self._queued.get(user, 0) + 1
+            heapq.heappush(self._heap, (tag, next(self._seq), user, contextvars.copy_context(),
+                                        fn, args, future, time.monotonic()))
+            self._ensure_workers()
+            self._cond.notify()
+        return future
+
+    def _take(self) -> tuple:
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            item = heapq.heappop(self._heap)
+            tag, _, user, _, _, _, _, enqueued_at = item
+            self._virtual_time = tag
+
+            waited = time.monotonic() - enqueued_at
+            for wait in (self._wait, self._user_wait.setdefault(user, {"count": 0, "total": 0.0, "max": 0.0})):
+                wait["count"] += 1
+                wait["total"] += waited
+                wait["max"] = max(wait["max"], waited)
+
+            self._queued[user] -= 1
+            if not self._queued[user]:
+                # Nothing left for this user: its next burst starts at virtual time
+                del self._queued[user]
+                del self._last_tag[user]
+                del self._user_wait[user]
+
+            self._running += 1
+            return item
+
+    def _work(self) -> None:
+        while True:
+            _, _, user, context, fn, args, future, enqueued_at = self._take()
+            try:
+                if future.set_running_or_notify_cancel():
+                    # In the submitter's context: counted in its scan's stats
+                    context.run(observe, "queue", time.monotonic() - enqueued_at)
+                    try:
+                        future.set_result(context.run(fn, *args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            except Exception as e:
+                logger.error(f"Scan task for {user} could not complete: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Totals only: queue wait of all tasks so far, and the worst average
+        wait among users with work queued now (how fair the queue is). A
+        user's own wait is in their scan summary's "queue" phase.
+        """
+        with self._cond:
+            wait = self._wait
+            user_avgs = [w["total"] / w["count"] for w in self._user_wait.values()]
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queue_depth": len(self._heap),
+                "users_queued": len(self._queued),
+                "wait": {
+                    "tasks": wait["count"],
+                    "avg_wait_ms": round(wait["total"] / wait["count"] * 1000, 2) if wait["count"] else 0.0,
+                    "max_wait_ms": round(wait["max"] * 1000, 2),
+                    "worst_user_avg_wait_ms": round(max(user_avgs) * 1000, 2) if user_avgs else 0.0,
+                },
+            }
+
+
+SCAN_EXECUTOR = ScanExecutor()
@@ -0,0 +1,295 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Event, Lock, Thread, local
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from logger import setup_logger
+from DomainManagementEngine import DomainManagementEngine
+from DomainStore import USERS_DATA_DIR
+from MonitoringSystem import MonitoringSystem
+
+logger = setup_logger("ScanJobs")
+
+# ----------------------------
+# Job configuration
+# ----------------------------
+# SQLite file the jobs live in, shared by all API worker processes
+SCAN_JOBS_FILE = os.getenv("SCAN_JOBS_FILE", os.path.join(USERS_DATA_DIR, "scan_jobs.db"))
+# Seconds a finished job stays available for polling
+SCAN_JOB_RETENTION = float(os.getenv("SCAN_JOB_RETENTION", "600"))
+# Seconds between a running job's progress writes (new results, heartbeat, cancel check)
+SCAN_JOB_SYNC_INTERVAL = float(os.getenv("SCAN_JOB_SYNC_INTERVAL", "0.5"))
+# Seconds without a heartbeat after which a job's process is taken as gone and the job as failed
+SCAN_JOB_STALE_AFTER = float(os.getenv("SCAN_JOB_STALE_AFTER", "30"))
+
+ACTIVE_STATES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_jobs (
+    id               TEXT    PRIMARY KEY,
+    username         TEXT    NOT NULL,
+    force_refresh    INTEGER NOT NULL DEFAULT 0,
+    status           TEXT    NOT NULL DEFAULT 'queued',
+    total            INTEGER NOT NULL DEFAULT 0,
+    done             INTEGER NOT NULL DEFAULT 0,
+    summary          TEXT,
+    error            TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at       REAL    NOT NULL,
+    heartbeat_at     REAL    NOT NULL,
+    finished_at      REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS scan_jobs_active
+    ON scan_jobs (username) WHERE status IN ('queued', 'running');
+CREATE TABLE IF NOT EXISTS scan_job_results (
+    job_id TEXT    NOT NULL,
+    seq    INTEGER NOT NULL,
+    result TEXT    NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class ScanJob:
+    """A background scan run by this process; results are buffered until the next sync."""
+
+    def __init__(self, id: str, username: str, force_refresh: bool = False):
+        self.id = id
+        self.username = username
+        self.force_refresh = force_refresh
+        self.total = 0
+        self.synced = 0
+        self.cancel_event = Event()
+        self.finished = Event()
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = Lock()
+        # Serializes the sync thread with the final sync, so results keep their order
+        self._sync_lock = Lock()
+
+    def _started(self, total: int) -> None:
+        with self._lock:
+            self.total = total
+
+    def _add_result(self, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.append(result)
+
+    def _take_pending(self) -> Tuple[int, List[Dict[str, Any]]]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return self.total, pending
+
+
+class ScanJobManager:
+    """
+    Runs scans in background threads so the HTTP request returns at once.
+
+    Jobs are kept in a SQLite file (WAL mode) shared by every API worker
+    process, so a poll, join or cancel may reach any worker: the worker
+    running a scan writes its new results, progress and a heartbeat every
+    SCAN_JOB_SYNC_INTERVAL seconds and picks up cancel requests at the
+    same time. A job whose heartbeat stops (its process died) is failed
+    after SCAN_JOB_STALE_AFTER seconds.
+
+    A user has at most one active job: a second start() joins it instead of
+    starting another scan.
+    """
+
+    def __init__(self, dme: DomainManagementEngine, monitoring_system=MonitoringSystem,
+                 path: str = SCAN_JOBS_FILE):
+        self.dme = dme
+        self.monitoring_system = monitoring_system
+        self.path = path
+        # Jobs this process runs, by id
+        self._running: Dict[str, ScanJob] = {}
+        self._lock = Lock()
+        self._local = local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit, transactions are explicit."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction taking the database lock up front (no upgrade deadlocks)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _expire(conn: sqlite3.Connection) -> None:
+        """Fail jobs whose process stopped, forget finished jobs past retention (in a transaction)."""
+        now = time.time()
+        conn.execute(
+            "UPDATE scan_jobs SET status = 'failed', error = 'Scan worker stopped', finished_at = ? "
+            "WHERE status IN ('queued', 'running') AND heartbeat_at < ?",
+            (now, now - SCAN_JOB_STALE_AFTER)
+        )
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM scan_jobs WHERE finished_at < ?", (now - SCAN_JOB_RETENTION,)
+        ).fetchall()]
+        conn.executemany("DELETE FROM scan_job_results WHERE job_id = ?", [(job_id,) for job_id in expired])
+        conn.executemany("DELETE FROM scan_jobs WHERE id = ?", [(job_id,) for job_id in expired])
+
+    def start(self, username: str, force_refresh: bool = False) -> Tuple[Dict[str, Any], bool]:
+        """
+        Start a scan of the user's domains, or join the one in flight.
+        :return: (job, without results; created)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn)
+            row = conn.execute(
+                "SELECT id FROM scan_jobs WHERE username = ? AND status IN ('queued', 'running')",
+                (username,)
+            ).fetchone()
+            if row is not None:
+                return self._view(conn, row[0], username, include_results=False), False
+            job = ScanJob(uuid.uuid4().hex, username, force_refresh)
+            conn.execute(
+                "INSERT INTO scan_jobs (id, username, force_refresh, created_at, heartbeat_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job.id, username, int(force_refresh), now, now)
+            )
+
+        with self._lock:
+            self._running[job.id] = job
+        Thread(target=self._run, args=(job,), name=f"scan-job-{job.id[:8]}", daemon=True).start()
+        Thread(target=self._sync_loop, args=(job,), name=f"scan-job-sync-{job.id[:8]}", daemon=True).start()
+        logger.info(f"Scan job {job.id} started for {username}")
+        return self._view(self._conn(), job.id, username, include_results=False), True
+
+    def _run(self, job: ScanJob) -> None:
+        summary, error = None, None
+        try:
+            # Inside the try: if even this fails, finished stops the heartbeat and the job ends as failed
+            with self._transaction() as conn:
+                conn.execute("UPDATE scan_jobs SET status = 'running' WHERE id = ?", (job.id,))
+            summary = self.monitoring_system.scan_user_domains(
+                job.username,
+                dme=self.dme,
+                force_refresh=job.force_refresh,
+                on_result=job._add_result,
+                cancel=job.cancel_event,
+                on_start=job._started,
+                scan_id=job.id
+            )
+            status = "cancelled" if job.cancel_event.is_set() else "completed"
+        except Exception as e:
+            logger.error(f"Scan job {job.id} failed for {job.username}: {e}")
+            status, error = "failed", "Scan failed"
+        finally:
+            job.finished.set()
+
+        try:
+            self._sync(job, final={"status": status, "summary": summary, "error": error})
+        except Exception as e:
+            logger.error(f"Could not store the end of scan job {job.id}: {e}")
+        with self._lock:
+            self._running.pop(job.id, None)
+        logger.info(f"Scan job {job.id} {status} for {job.username}")
+
+    def _sync_loop(self, job: ScanJob) -> None:
+        """Write the job's progress until it finishes (_run writes the last of it)."""
+        while not job.finished.wait(SCAN_JOB_SYNC_INTERVAL):
+            try:
+                self._sync(job)
+            except Exception as e:
+                logger.warning(f"Could not store the progress of scan job {job.id}: {e}")
+
+    def _sync(self, job: ScanJob, final: Optional[Dict[str, Any]] = None) -> None:
+        """Store new results, total and heartbeat; pick up a cancel request from another process."""
+        with job._sync_lock:
+            total, pending = job._take_pending()
+            now = time.time()
+            with self._transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO scan_job_results (job_id, seq, result) VALUES (?, ?, ?)",
+                    [(job.id, job.synced + i, json.dumps(result)) for i, result in enumerate(pending)]
+                )
+                job.synced += len(pending)
+                conn.execute("UPDATE scan_jobs SET total = ?, done = ?, heartbeat_at = ? WHERE id = ?",
+                             (total, job.synced, now, job.id))
+                if final is not None:
+                    conn.execute(
+                        "UPDATE scan_jobs SET status = ?, summary = ?, error = ?, finished_at = ? WHERE id = ?",
+                        (final["status"], json.dumps(final["summary"]) if final["summary"] is not None else None,
+                         final["error"], now, job.id)
+                    )
+                    return
+                cancelled = conn.execute("SELECT cancel_requested FROM scan_jobs WHERE id = ?",
+                                         (job.id,)).fetchone()
+        if cancelled and cancelled[0]:
+            job.cancel_event.set()
+
+    def _view(self, conn: sqlite3.Connection, job_id: str, username: str, since: int = 0,
+              include_results: bool = True) -> Optional[Dict[str, Any]]:
+        """JSON view of the user's job, or None if there is no such job of theirs."""
+        row = conn.execute(
+            "SELECT status, total, done, summary, error, created_at, finished_at, heartbeat_at "
+            "FROM scan_jobs WHERE id = ? AND username = ?",
+            (job_id, username)
+        ).fetchone()
+        if row is None:
+            return None
+        status, total, done, summary, error, created_at, finished_at, heartbeat_at = row
+        if status in ACTIVE_STATES and time.time() - heartbeat_at > SCAN_JOB_STALE_AFTER:
+            status, error = "failed", "Scan worker stopped"
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "done": done,
+            "created_at": created_at,
+            "finished_at": finished_at,
+        }
+        if include_results:
+            job["results"] = [json.loads(result) for (result,) in conn.execute(
+                "SELECT result FROM scan_job_results WHERE job_id = ? AND seq >= ? ORDER BY seq",
+                (job_id, max(since, 0))
+            ).fetchall()]
+        if summary is not None:
+            job["summary"] = json.loads(summary)
+        if error:
+            job["error"] = error
+        return job
+
+    def get(self, job_id: str, username: str, since: int = 0,
+            include_results: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        The job if it exists and belongs to username.
+        :param since: only include results after the first `since` ones (incremental polling)
+        """
+        return self._view(self._conn(), job_id, username, since, include_results)
+
+    def cancel(self, job_id: str, username: str) -> Optional[Dict[str, Any]]:
+        """Ask the user's job to stop (whichever process runs it); results gathered so far are kept."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE scan_jobs SET cancel_requested = 1 "
+                "WHERE id = ? AND username = ? AND status IN ('queued', 'running')",
+                (job_id, username)
+            )
+        with self._lock:
+            job = self._running.get(job_id)
+        if job is not None and job.username == username:
+            job.cancel_event.set()
+        return self.get(job_id, username, include_results=False)
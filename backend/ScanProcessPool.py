@@ -0,0 +1,251 @@
+import os
+import queue
+import time
+import uuid
+import zlib
+import multiprocessing
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from logger import setup_logger
+from ProbeCaches import _normalize_host
+
+logger = setup_logger("ScanProcessPool")
+
+# ----------------------------
+# Process pool configuration
+# ----------------------------
+# Worker processes of the "processes" scan engine (each runs its own probe threads)
+SCAN_PROCESSES = int(os.getenv("SCAN_PROCESSES", str(os.cpu_count() or 1)))
+# Engine each worker process uses for its shard ("threads" or "asyncio")
+SCAN_PROCESS_ENGINE = os.getenv("SCAN_PROCESS_ENGINE", "threads").strip().lower()
+# Results a worker collects before sending them to the parent in one message
+RESULT_BATCH = 100
+# Seconds after which the next result also sends a partly filled batch
+RESULT_BATCH_DELAY = 0.1
+
+
+def _shard_of(domain: str, shards: int) -> int:
+    """Stable host -> worker mapping, so a host's caches stay warm in one worker."""
+    return zlib.crc32(_normalize_host(domain).encode()) % shards
+
+
+# -------------------------------------------------
+# Worker process side
+# -------------------------------------------------
+def _run_shard(index: int, results: Any, scan_id: str, username: str, domains: List[str],
+               engine: str, force_refresh: bool, cancel: Event) -> None:
+    from MonitoringSystem import MonitoringSystem
+    from ProbeMetrics import ScanStats
+
+    batch: List[Dict[str, Any]] = []
+    flushed_at = time.monotonic()
+
+    def send(result: Dict[str, Any]) -> None:
+        nonlocal flushed_at
+        batch.append(result)
+        if len(batch) >= RESULT_BATCH or time.monotonic() - flushed_at >= RESULT_BATCH_DELAY:
+            results.put(("results", scan_id, batch[:]))
+            batch.clear()
+            flushed_at = time.monotonic()
+
+    stats = ScanStats()
+    error = None
+    try:
+        MonitoringSystem.scan_domains(username, domains, engine=engine, force_refresh=force_refresh,
+                                      on_result=send, cancel=cancel, stats=stats)
+    except Exception as e:
+        logger.error(f"Scan worker {index} failed on a shard of {len(domains)} domains: {e}")
+        error = str(e)
+    if batch:
+        results.put(("results", scan_id, batch))
+    results.put(("done", scan_id, index, stats.export(), error))
+
+
+def _worker_main(index: int, tasks: Any, results: Any,
+                 initializer: Optional[Callable[..., None]], initargs: tuple) -> None:
+    """
+    Entry point of a worker process. Every shard runs in its own thread, so
+    shards of several users' scans share this worker's ScanExecutor (and its
+    fair queuing) and caches.
+    """
+    from ProbeCaches import HOST_TIMEOUTS
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    # Learned timeouts: start from the shared file, then keep our own hosts apart
+    if HOST_TIMEOUTS.path:
+        HOST_TIMEOUTS.path = f"{os.path.splitext(HOST_TIMEOUTS.path)[0]}.worker-{index}.json"
+        HOST_TIMEOUTS.load()
+
+    cancels: Dict[str, Event] = {}
+    while True:
+        message = tasks.get()
+        if message is None:
+            HOST_TIMEOUTS.save()
+            return
+        if message[0] == "cancel":
+            cancel = cancels.get(message[1])
+            if cancel is not None:
+                cancel.set()
+            continue
+
+        _, scan_id, username, domains, engine, force_refresh = message
+        cancel = cancels[scan_id] = Event()
+
+        def run(scan_id=scan_id, username=username, domains=domains, engine=engine,
+                force_refresh=force_refresh, cancel=cancel) -> None:
+            try:
+                _run_shard(index, results, scan_id, username, domains, engine, force_refresh, cancel)
+            finally:
+                cancels.pop(scan_id, None)
+
+        Thread(target=run, name=f"shard-{scan_id[:8]}", daemon=True).start()
+
+
+# -------------------------------------------------
+# Parent side
+# -------------------------------------------------
+class ScanProcessPool:
+    """
+    Long-lived worker processes for the "processes" scan engine, so the
+    CPU-bound part of probing (TLS handshakes, certificate parsing) uses all
+    cores instead of one GIL.
+
+    A scan's domains are sharded across the workers by host; each worker
+    probes its shard with its own engine and streams results back in small
+    batches. Workers are started with "spawn" on first use and restarted if
+    they die; their caches live as long as they do. `initializer(*initargs)`
+    runs first in every worker (e.g. a benchmark installing its stub resolver).
+    """
+
+    def __init__(self, processes: int = SCAN_PROCESSES, engine: str = SCAN_PROCESS_ENGINE,
+                 initializer: Optional[Callable[..., None]] = None, initargs: tuple = ()):
+        self.processes = max(1, processes)
+        self.engine = engine if engine in ("threads", "asyncio") else "threads"
+        self.initializer = initializer
+        self.initargs = initargs
+        self._mp = multiprocessing.get_context("spawn")
+        self._lock = Lock()
+        self._workers: List[Optional[Tuple[Any, Any]]] = [None] * self.processes
+        self._results = None
+        self._inboxes: Dict[str, queue.Queue] = {}
+
+    def _ensure_workers(self) -> None:
+        """Start missing or dead workers, and the result dispatcher (caller holds the lock)."""
+        if self._results is None:
+            self._results = self._mp.Queue()
+            Thread(target=self._dispatch, name="scan-pool-dispatch", daemon=True).start()
+
+        for index, worker in enumerate(self._workers):
+            if worker is not None and worker[0].is_alive():
+                continue
+            if worker is not None:
+                logger.warning(f"Scan worker {index} exited ({worker[0].exitcode}), restarting")
+            tasks = self._mp.Queue()
+            process = self._mp.Process(target=_worker_main, args=(index, tasks, self._results,
+                                                                  self.initializer, self.initargs),
+                                       name=f"scan-process-{index}", daemon=True)
+            process.start()
+            self._workers[index] = (process, tasks)
+
+    def _dispatch(self) -> None:
+        """Route worker messages to the inbox of the scan they belong to."""
+        while True:
+            message = self._results.get()
+            with self._lock:
+                inbox = self._inboxes.get(message[1])
+            if inbox is not None:
+                inbox.put(message)
+
+    def scan(self, username: str, domains: List[str], force_refresh: bool = False,
+             on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+             cancel: Optional[Event] = None,
+             keep_results: bool = True) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Probe domains across the worker processes.
+        :return: (results, empty unless keep_results; the workers' exported ScanStats)
+        :raises RuntimeError: if a worker failed or died before finishing its shard
+        """
+        shards: List[List[str]] = [[] for _ in range(self.processes)]
+        for domain in domains:
+            shards[_shard_of(domain, self.processes)].append(domain)
+
+        scan_id = uuid.uuid4().hex
+        inbox: queue.Queue = queue.Queue()
+        with self._lock:
+            self._ensure_workers()
+            self._inboxes[scan_id] = inbox
+            workers = list(self._workers)
+
+        pending = set()
+        for index, shard in enumerate(shards):
+            if shard:
+                workers[index][1].put(("scan", scan_id, username, shard, self.engine, force_refresh))
+                pending.add(index)
+
+        results: List[Dict[str, Any]] = []
+        shard_stats: List[Dict[str, Any]] = []
+        errors: List[str] = []
+        cancel_sent = False
+        try:
+            while pending:
+                if cancel is not None and cancel.is_set() and not cancel_sent:
+                    for index in pending:
+                        workers[index][1].put(("cancel", scan_id))
+                    cancel_sent = True
+                try:
+                    message = inbox.get(timeout=0.2)
+                except queue.Empty:
+                    dead = [i for i in pending if not workers[i][0].is_alive()]
+                    if dead:
+                        raise RuntimeError(f"Scan worker process(es) {dead} exited during the scan")
+                    continue
+
+                if message[0] == "results":
+                    for result in message[2]:
+                        if keep_results:
+                            results.append(result)
+                        if on_result is not None:
+                            on_result(result)
+                else:
+                    _, _, index, stats, error = message
+                    pending.discard(index)
+                    shard_stats.append(stats)
+                    if error:
+                        errors.append(error)
+        finally:
+            with self._lock:
+                del self._inboxes[scan_id]
+
+        if errors:
+            raise RuntimeError(f"Scan worker failed: {errors[0]}")
+        return results, shard_stats
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Stop the workers (they save their learned timeouts first)."""
+        with self._lock:
+            workers, self._workers = self._workers, [None] * self.processes
+        for worker in workers:
+            if worker is not None and worker[0].is_alive():
+                worker[1].put(None)
+        for worker in workers:
+            if worker is not None:
+                worker[0].join(timeout)
+
+    def pids(self) -> List[int]:
+        """Process ids of the running workers."""
+        with self._lock:
+            return [w[0].pid for w in self._workers if w is not None and w[0].is_alive()]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "engine": self.engine,
+                "alive": sum(1 for w in self._workers if w is not None and w[0].is_alive()),
+                "scans_in_flight": len(self._inboxes),
+            }
+
+
+SCAN_PROCESS_POOL = ScanProcessPool()
@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import local
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from logger import setup_logger
+
+logger = setup_logger("ScanQueue")
+
+# ----------------------------
+# Queue configuration
+# ----------------------------
+SCAN_QUEUE_FILE = os.getenv(
+    "SCAN_QUEUE_FILE",
+    os.path.join(os.path.dirname(__file__), "UsersData", "scan_queue.db")
+)
+# Seconds a leased task stays invisible to other workers unless its lease is extended
+SCAN_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("SCAN_QUEUE_VISIBILITY_TIMEOUT", "60"))
+# Leases a task may get before it is given up as failed
+SCAN_QUEUE_MAX_ATTEMPTS = int(os.getenv("SCAN_QUEUE_MAX_ATTEMPTS", "3"))
+# Seconds collected and failed tasks are kept for inspection
+SCAN_QUEUE_RETENTION = float(os.getenv("SCAN_QUEUE_RETENTION", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_tasks (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    username      TEXT    NOT NULL,
+    domain        TEXT    NOT NULL,
+    force_refresh INTEGER NOT NULL DEFAULT 0,
+    status        TEXT    NOT NULL DEFAULT 'queued',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    visible_at    REAL    NOT NULL,
+    enqueued_at   REAL    NOT NULL,
+    finished_at   REAL,
+    result        TEXT,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS scan_tasks_ready ON scan_tasks (status, visible_at);
+CREATE UNIQUE INDEX IF NOT EXISTS scan_tasks_active
+    ON scan_tasks (username, domain) WHERE status IN ('queued', 'leased');
+"""
+
+
+class ScanTask:
+    """One leased probe: check `domain` for `username`."""
+
+    __slots__ = ("id", "username", "domain", "force_refresh", "attempts")
+
+    def __init__(self, id: int, username: str, domain: str, force_refresh: int, attempts: int):
+        self.id = id
+        self.username = username
+        self.domain = domain
+        self.force_refresh = bool(force_refresh)
+        self.attempts = attempts
+
+
+class ScanQueue:
+    """
+    Durable work queue of domain probes in a SQLite file (WAL mode), shared by
+    any number of scan worker processes on the host. No outside service needed.
+
+    Leasing works like a visibility timeout: a leased task is hidden from other
+    workers until its lease expires, so tasks of a crashed worker are leased
+    again. A worker extends the leases of probes that take long. After
+    max_attempts leases a task is marked failed. A user's domain is queued at
+    most once at a time.
+
+    Workers store results in the queue; one collector (ScanScheduler) merges
+    them into the users' domain lists, so those files keep a single writer.
+    Task states: queued -> leased -> done -> collected (or failed).
+    """
+
+    def __init__(self, path: str = SCAN_QUEUE_FILE,
+                 visibility_timeout: float = SCAN_QUEUE_VISIBILITY_TIMEOUT,
+                 max_attempts: int = SCAN_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max(1, max_attempts)
+        self._local = local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit, transactions are explicit."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction taking the database lock up front (no upgrade deadlocks)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, username: str, domains: Sequence[str], force_refresh: bool = False) -> int:
+        """
+        Queue probes of the user's domains; domains already queued or leased are skipped.
+        :return: number of tasks added
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO scan_tasks (username, domain, force_refresh, visible_at, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(username, domain, int(force_refresh), now, now) for domain in domains]
+            )
+            return conn.total_changes - before
+
+    def lease(self, owner: str, limit: int, visibility_timeout: Optional[float] = None) -> List[ScanTask]:
+        """Lease up to `limit` visible tasks to `owner`, oldest first."""
+        now = time.time()
+        timeout = visibility_timeout or self.visibility_timeout
+        with self._transaction() as conn:
+            # Tasks whose leases kept expiring (crashing or stuck workers) are given up
+            conn.execute(
+                "UPDATE scan_tasks SET status = 'failed', finished_at = ?, error = 'lease expired' "
+                "WHERE status = 'leased' AND visible_at <= ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT id, username, domain, force_refresh, attempts FROM scan_tasks "
+                "WHERE status IN ('queued', 'leased') AND visible_at <= ? "
+                "ORDER BY visible_at, id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE scan_tasks SET status = 'leased', lease_owner = ?, visible_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(owner, now + timeout, row[0]) for row in rows]
+            )
+        return [ScanTask(id_, user, domain, force, attempts + 1)
+                for id_, user, domain, force, attempts in rows]
+
+    def extend(self, owner: str, task_ids: Sequence[int],
+               visibility_timeout: Optional[float] = None) -> int:
+        """Push back the lease expiry of tasks still held by owner; returns how many."""
+        deadline = time.time() + (visibility_timeout or self.visibility_timeout)
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE scan_tasks SET visible_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                [(deadline, task_id, owner) for task_id in task_ids]
+            )
+            return conn.total_changes - before
+
+    def complete(self, owner: str, results: Sequence[Tuple[int, Dict[str, Any]]]) -> int:
+        """
+        Store the results of (task_id, result) pairs. Tasks whose lease owner
+        lost (expired and re-leased) are left to their new owner.
+        :return: number of tasks completed
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE scan_tasks SET status = 'done', finished_at = ?, result = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                [(now, json.dumps(result), task_id, owner) for task_id, result in results]
+            )
+            return conn.total_changes - before
+
+    def fail(self, owner: str, task_id: int, error: str, retry_after: float = 5.0) -> None:
+        """Give a task back for another attempt after retry_after seconds, or fail it for good."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE scan_tasks SET "
+                "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "finished_at = CASE WHEN attempts >= ? THEN ? END, "
+                "visible_at = ?, error = ?, lease_owner = NULL "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (self.max_attempts, self.max_attempts, now, now + retry_after, error, task_id, owner)
+            )
+
+    def results(self, limit: int = 1000) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """Up to `limit` (task_id, username, result) of completed, not yet collected tasks."""
+        rows = self._conn().execute(
+            "SELECT id, username, result FROM scan_tasks WHERE status = 'done' ORDER BY id LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [(task_id, username, json.loads(result)) for task_id, username, result in rows]
+
+    def mark_collected(self, task_ids: Sequence[int]) -> None:
+        with self._transaction() as conn:
+            conn.executemany("UPDATE scan_tasks SET status = 'collected' WHERE id = ? AND status = 'done'",
+                             [(task_id,) for task_id in task_ids])
+
+    def purge(self, retention: float = SCAN_QUEUE_RETENTION) -> int:
+        """Delete finished tasks older than retention seconds; returns how many."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM scan_tasks WHERE status IN ('collected', 'failed') AND finished_at < ?",
+                (time.time() - retention,)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM scan_tasks GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(enqueued_at) FROM scan_tasks WHERE status = 'queued'").fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "leased": counts.get("leased", 0),
+            "done": counts.get("done", 0),
+            "collected": counts.get("collected", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age_s": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
@@ -0,0 +1,332 @@
+import argparse
+import concurrent.futures
+import heapq
+import math
+import os
+import time
+from datetime import datetime, timezone
+from threading import Event
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from logger import setup_logger
+from DomainManagementEngine import DomainManagementEngine
+from MonitoringSystem import MonitoringSystem
+from ProbeCaches import HOST_TIMEOUTS
+from ScanExecutor import SCAN_EXECUTOR, ScanExecutor
+from ScanQueue import ScanQueue
+from UserManagementModule import UserManager
+
+logger = setup_logger("ScanScheduler")
+
+# ----------------------------
+# Scheduler configuration
+# ----------------------------
+# Probes started per second across all users
+SCHEDULER_RATE = float(os.getenv("SCHEDULER_RATE", "10"))
+# Seconds between checks of a healthy domain
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "3600"))
+# Seconds between checks of a domain that was Down on its last check
+SCHEDULER_DOWN_INTERVAL = float(os.getenv("SCHEDULER_DOWN_INTERVAL", "300"))
+# Certificates expiring within this many days are checked every SCHEDULER_EXPIRING_INTERVAL
+SCHEDULER_EXPIRY_DAYS = float(os.getenv("SCHEDULER_EXPIRY_DAYS", "14"))
+SCHEDULER_EXPIRING_INTERVAL = float(os.getenv("SCHEDULER_EXPIRING_INTERVAL", "900"))
+# Seconds between checks for changed domain lists (only changed users are re-read)
+SCHEDULER_REFRESH = float(os.getenv("SCHEDULER_REFRESH", "60"))
+# Length (seconds) of one scheduling round
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "1"))
+
+
+def _parse_iso(value: Any) -> Optional[datetime]:
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _parse_date(value: Any) -> Optional[datetime]:
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+class ScanScheduler:
+    """
+    Background service that keeps every user's domains fresh.
+
+    Each domain gets a due time: its last_check plus an interval that is
+    shorter for domains that were Down and for certificates close to expiry.
+    A priority queue ordered by due time hands out at most SCHEDULER_RATE
+    probes per second, so never-checked domains, recent failures, expiring
+    certificates and then the oldest last_check are served first.
+    Due domains are probed on the shared ScanExecutor and their results
+    merged on the following rounds, so a round never waits for a probe.
+    With a ScanQueue, due domains are handed to scan workers (ScanWorker.py)
+    instead of being probed in this process, and the scheduler merges the
+    results the workers left in the queue.
+
+    Only the domain lists of users whose version changed are re-read. A
+    domain handed off is due again after SCHEDULER_DOWN_INTERVAL in case no
+    result ever comes back (e.g. its task was given up).
+    """
+
+    def __init__(self, dme: Optional[DomainManagementEngine] = None,
+                 user_manager: Optional[UserManager] = None,
+                 rate: float = SCHEDULER_RATE,
+                 scan_queue: Optional[ScanQueue] = None,
+                 executor: Optional[ScanExecutor] = None):
+        self.dme = dme or DomainManagementEngine()
+        self.user_manager = user_manager or UserManager()
+        self.rate = max(rate, 0.001)
+        self.scan_queue = scan_queue
+        self.executor = executor or SCAN_EXECUTOR
+        self._queue: List[Tuple[float, str, str]] = []
+        # username -> domain -> due time of its entry in _queue; entries
+        # with another due time are stale and skipped. inf: not queued.
+        self._due: Dict[str, Dict[str, float]] = {}
+        # username -> domain -> last_check of our latest result. Unchanged
+        # results are not written back, so storage may hold an older one.
+        self._checked_at: Dict[str, Dict[str, str]] = {}
+        # username -> domains_version of the list last read
+        self._versions: Dict[str, str] = {}
+        # Handed to the executor or the scan queue, result not merged yet
+        self._pending: Set[Tuple[str, str]] = set()
+        self._probes: Dict[concurrent.futures.Future, Tuple[str, str]] = {}
+        self._refreshed_at: Optional[float] = None
+        self._stop = Event()
+        self.probed = 0
+
+    @staticmethod
+    def due_at(record: Dict[str, Any], now: Optional[datetime] = None) -> float:
+        """Epoch seconds at which a stored domain record should be checked again."""
+        now = now or datetime.now(timezone.utc)
+        last_check = _parse_iso(record.get("last_check"))
+        if last_check is None:
+            # Never checked (e.g. just added): due immediately, ahead of everything else
+            return 0.0
+
+        interval = SCHEDULER_INTERVAL
+        if record.get("status") == "Down":
+            interval = min(interval, SCHEDULER_DOWN_INTERVAL)
+
+        expiry = _parse_date(record.get("ssl_expiration"))
+        if expiry is not None and (expiry - now).total_seconds() < SCHEDULER_EXPIRY_DAYS * 86400:
+            interval = min(interval, SCHEDULER_EXPIRING_INTERVAL)
+
+        return last_check.timestamp() + interval
+
+    def _refresh(self) -> None:
+        """Re-read the domain lists of the users that changed since the last refresh."""
+        self.user_manager.load_users_json_to_memory()
+        users = set(self.user_manager.users)
+        for username in set(self._versions) - users:
+            self._forget_user(username)
+
+        now = datetime.now(timezone.utc)
+        reloaded = 0
+        for username in users:
+            # Read before the list: a racing write then makes us read it again next time
+            version = self.dme.domains_version(username)
+            if self._versions.get(username) != version:
+                self._load_user(username, now)
+                self._versions[username] = version
+                reloaded += 1
+
+        scheduled = sum(len(due) for due in self._due.values())
+        if len(self._queue) > 2 * scheduled:
+            # Mostly stale entries: rebuild from the live due times
+            self._queue = [(due, username, domain) for username, due_by_domain in self._due.items()
+                           for domain, due in due_by_domain.items() if due != math.inf]
+            heapq.heapify(self._queue)
+        self._refreshed_at = time.monotonic()
+        if reloaded:
+            logger.debug(f"Scheduler re-read {reloaded} of {len(users)} users ({scheduled} domains)")
+
+    def _load_user(self, username: str, now: datetime) -> None:
+        """Schedule the user's stored domains; removed ones are dropped."""
+        previous = self._due.get(username, {})
+        checked_at = self._checked_at.get(username, {})
+        due_by_domain: Dict[str, float] = {}
+        for record in self.dme.load_user_domains(username):
+            domain = record["domain"]
+            if (username, domain) in self._pending and domain in previous:
+                # Handed off already: the result schedules it
+                due_by_domain[domain] = previous[domain]
+                continue
+            checked = checked_at.get(domain)
+            if checked is not None and checked > str(record.get("last_check") or ""):
+                record = dict(record, last_check=checked)
+            due = self.due_at(record, now)
+            due_by_domain[domain] = due
+            if previous.get(domain) != due:
+                heapq.heappush(self._queue, (due, username, domain))
+
+        self._due[username] = due_by_domain
+        self._checked_at[username] = {d: c for d, c in checked_at.items() if d in due_by_domain}
+        self._pending -= {(username, d) for d in previous if d not in due_by_domain}
+
+    def _forget_user(self, username: str) -> None:
+        self._due.pop(username, None)
+        self._checked_at.pop(username, None)
+        self._versions.pop(username, None)
+        self._pending = {key for key in self._pending if key[0] != username}
+
+    def _schedule(self, username: str, domain: str, due: float) -> None:
+        """Set the due time of a scheduled domain (not of removed ones)."""
+        due_by_domain = self._due.get(username)
+        if due_by_domain is None or domain not in due_by_domain:
+            return
+        due_by_domain[domain] = due
+        if due != math.inf:
+            heapq.heappush(self._queue, (due, username, domain))
+
+    def _requeue(self, username: str, result: Dict[str, Any]) -> None:
+        """Back into the queue with the due time following this result."""
+        domain = result["domain"]
+        self._pending.discard((username, domain))
+        if domain in self._due.get(username, {}):
+            self._checked_at.setdefault(username, {})[domain] = result["last_check"]
+            self._schedule(username, domain, self.due_at(result))
+
+    def _merge(self, by_user: Dict[str, List[Dict[str, Any]]]) -> None:
+        for username, results in by_user.items():
+            self.dme.update_domain_results(username, results)
+            for result in results:
+                self._requeue(username, result)
+
+    def _collect_results(self) -> int:
+        """Merge the scan workers' finished results into the users' domain lists."""
+        collected = 0
+        while True:
+            rows = self.scan_queue.results()
+            if not rows:
+                return collected
+            by_user: Dict[str, List[Dict[str, Any]]] = {}
+            for _, username, result in rows:
+                by_user.setdefault(username, []).append(result)
+            self._merge(by_user)
+            self.scan_queue.mark_collected([task_id for task_id, _, _ in rows])
+            collected += len(rows)
+
+    def _collect_probes(self) -> int:
+        """Merge the results of the finished executor probes into the users' domain lists."""
+        done = [future for future in self._probes if future.done()]
+        by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for future in done:
+            username, domain = self._probes.pop(future)
+            try:
+                by_user.setdefault(username, []).append(future.result())
+            except Exception as e:
+                logger.error(f"Scheduled probe of {domain} failed for {username}: {e}")
+                self._pending.discard((username, domain))
+                self._schedule(username, domain, time.time() + SCHEDULER_DOWN_INTERVAL)
+        try:
+            self._merge(by_user)
+        except Exception as e:
+            logger.error(f"Storing scheduled results failed: {e}")
+        if done:
+            HOST_TIMEOUTS.maybe_save()
+        return len(done)
+
+    def _take_due(self, limit: int, now: float) -> Dict[str, List[str]]:
+        """Pop up to `limit` due domains, by user."""
+        batches: Dict[str, List[str]] = {}
+        taken = 0
+        while self._queue and taken < limit and self._queue[0][0] <= now:
+            due, username, domain = heapq.heappop(self._queue)
+            if self._due.get(username, {}).get(domain) != due:
+                continue  # Rescheduled or removed since
+            batches.setdefault(username, []).append(domain)
+            taken += 1
+        return batches
+
+    def run_once(self) -> int:
+        """
+        Start probes of (or queue) the domains that are due, within this round's rate budget.
+        :return: number of domains probed or queued
+        """
+        if self.scan_queue is not None:
+            if self._collect_results():
+                logger.debug("Scheduler merged scan worker results")
+        else:
+            self._collect_probes()
+
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= SCHEDULER_REFRESH:
+            self._refresh()
+            if self.scan_queue is not None:
+                self.scan_queue.purge()
+
+        budget = max(1, int(self.rate * SCHEDULER_TICK))
+        now = time.time()
+        started = 0
+        users: Set[str] = set()
+        while started < budget:
+            batches = self._take_due(budget - started, now)
+            if not batches:
+                break
+            for username, domains in batches.items():
+                users.add(username)
+                for domain in domains:
+                    self._pending.add((username, domain))
+                if self.scan_queue is not None:
+                    # Domains already queued (e.g. by a previous run) are not
+                    # counted against the rate; their results come back all the same
+                    started += self.scan_queue.enqueue(username, domains)
+                    for domain in domains:
+                        self._schedule(username, domain, now + SCHEDULER_DOWN_INTERVAL)
+                    continue
+                for domain in domains:
+                    future = self.executor.submit(username, MonitoringSystem._probe, domain)
+                    self._probes[future] = (username, domain)
+                    self._schedule(username, domain, math.inf)
+                started += len(domains)
+
+        self.probed += started
+        if started:
+            logger.info(f"Scheduler {'queued' if self.scan_queue else 'started probes of'} {started} domains "
+                        f"for {len(users)} users")
+        return started
+
+    def wait_for_probes(self, timeout: Optional[float] = None) -> int:
+        """Wait for the probes started so far and merge their results."""
+        concurrent.futures.wait(list(self._probes), timeout=timeout)
+        return self._collect_probes()
+
+    def run_forever(self) -> None:
+        logger.info(f"Scan scheduler started ({self.rate} probes/second)")
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.run_once()
+            self._stop.wait(max(0.0, SCHEDULER_TICK - (time.monotonic() - started)))
+        logger.info("Scan scheduler stopped")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+# -------------------------------------------------
+# ENTRYPOINT
+# -------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background domain scan scheduler")
+    parser.add_argument("--rate", type=float, default=SCHEDULER_RATE,
+                        help="probes started per second across all users")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single scheduling round and exit")
+    parser.add_argument("--queue", action="store_true",
+                        help="queue due domains for ScanWorker.py instead of probing them here")
+    args = parser.parse_args()
+
+    scheduler = ScanScheduler(rate=args.rate, scan_queue=ScanQueue() if args.queue else None)
+    if args.once:
+        scheduler.run_once()
+        scheduler.wait_for_probes()
+    else:
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,123 @@
+import argparse
+import os
+import socket
+import time
+import uuid
+import concurrent.futures
+from threading import Event
+from typing import Any, Dict, List, Optional, Tuple
+
+from logger import setup_logger
+from MonitoringSystem import MonitoringSystem
+from ProbeCaches import HOST_TIMEOUTS
+from ScanExecutor import SCAN_EXECUTOR
+from ScanQueue import ScanQueue, ScanTask
+
+logger = setup_logger("ScanWorker")
+
+# ----------------------------
+# Worker configuration
+# ----------------------------
+# Tasks leased per round (they are probed concurrently on the ScanExecutor)
+SCAN_WORKER_BATCH = int(os.getenv("SCAN_WORKER_BATCH", "50"))
+# Seconds an idle worker waits before polling the queue again
+SCAN_WORKER_IDLE_WAIT = float(os.getenv("SCAN_WORKER_IDLE_WAIT", "1"))
+
+
+class ScanWorker:
+    """
+    Standalone probe worker fed by the durable ScanQueue.
+
+    Each round leases a batch of tasks, runs MonitoringSystem._check_domain for
+    them on the ScanExecutor (fairly across users) and completes the tasks with
+    their results, which the scheduler merges into the users' domain lists.
+    Start as many workers as needed; they only meet in the queue's short
+    transactions. Workers on other hosts need the queue file on storage with
+    working file locks. A worker that crashes loses its leases, so its tasks
+    are probed again, never lost.
+    """
+
+    def __init__(self, queue: Optional[ScanQueue] = None, batch: int = SCAN_WORKER_BATCH):
+        self.queue = queue or ScanQueue()
+        self.batch = max(1, batch)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.processed = 0
+        self._stop = Event()
+
+    def _probe(self, tasks: List[ScanTask]) -> Tuple[List[Tuple[ScanTask, Dict[str, Any]]], int]:
+        """Probe the leased tasks, extending their leases while probes are still running."""
+        futures = {
+            SCAN_EXECUTOR.submit(task.username, MonitoringSystem._check_domain, task.domain, task.force_refresh): task
+            for task in tasks
+        }
+        done: List[Tuple[ScanTask, Dict[str, Any]]] = []
+        failed = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = concurrent.futures.wait(
+                pending, timeout=self.queue.visibility_timeout / 3,
+                return_when=concurrent.futures.ALL_COMPLETED
+            )
+            for future in finished:
+                task = futures[future]
+                try:
+                    done.append((task, future.result()))
+                except Exception as e:
+                    logger.error(f"Probe of {task.domain} for {task.username} failed: {e}")
+                    self.queue.fail(self.worker_id, task.id, str(e))
+                    failed += 1
+            if pending:
+                self.queue.extend(self.worker_id, [futures[f].id for f in pending])
+        return done, failed
+
+    def run_once(self) -> int:
+        """
+        Lease, probe and store one batch.
+        :return: number of tasks leased (0 when the queue had nothing visible)
+        """
+        tasks = self.queue.lease(self.worker_id, self.batch)
+        if not tasks:
+            return 0
+
+        done, failed = self._probe(tasks)
+        completed = self.queue.complete(self.worker_id, [(task.id, result) for task, result in done])
+        HOST_TIMEOUTS.maybe_save()
+
+        self.processed += completed
+        logger.info(f"Worker {self.worker_id} completed {completed} of {len(tasks)} tasks"
+                    f"{f', {failed} failed' if failed else ''}")
+        return len(tasks)
+
+    def run_forever(self, exit_when_empty: bool = False) -> None:
+        logger.info(f"Scan worker {self.worker_id} started on {self.queue.path}")
+        while not self._stop.is_set():
+            if not self.run_once():
+                if exit_when_empty:
+                    break
+                self._stop.wait(SCAN_WORKER_IDLE_WAIT)
+        HOST_TIMEOUTS.save()
+        logger.info(f"Scan worker {self.worker_id} stopped after {self.processed} tasks")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+# -------------------------------------------------
+# ENTRYPOINT
+# -------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan worker fed by the durable scan queue")
+    parser.add_argument("--queue", default=None, help="queue file (default: SCAN_QUEUE_FILE)")
+    parser.add_argument("--batch", type=int, default=SCAN_WORKER_BATCH,
+                        help="tasks leased and probed per round")
+    parser.add_argument("--once", action="store_true",
+                        help="exit once the queue has no visible tasks")
+    args = parser.parse_args()
+
+    worker = ScanWorker(queue=ScanQueue(args.queue) if args.queue else None, batch=args.batch)
+    started = time.monotonic()
+    try:
+        worker.run_forever(exit_when_empty=args.once)
+    except KeyboardInterrupt:
+        worker.stop()
+    print(f"{worker.processed} tasks in {time.monotonic() - started:.1f}s")
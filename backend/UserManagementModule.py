@@ -208,8 +208,7 @@ class UserManager:
                 del self.users[username]
                 self.save_users_from_memory_to_json()
 
-            domain_file = DATA_PATH / f"{username}_domains.json"
-            domain_file.unlink(missing_ok=True)
+            DME.DomainManagementEngine().remove_user_domains(username)
 
         except Exception as e:
             logger.error(f"Error deleting user {username}: {e}")
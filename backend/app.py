@@ -1,10 +1,14 @@
 from flask import Flask, request, jsonify
+import gzip
 import os
 import tempfile
+import zlib
 
 from UserManagementModule import UserManager as UM
 from DomainManagementEngine import DomainManagementEngine as DME
 from MonitoringSystem import MonitoringSystem as MS
+from ScanJobs import ScanJobManager
+from DomainQuery import DomainQuery, DomainQueryError
 
 from auth.token import generate_token
 from auth.decorators import require_auth
@@ -21,6 +25,11 @@ app = Flask(__name__)
 user_manager = UM()
 domain_engine = DME()
 monitoring_system = MS()
+scan_jobs = ScanJobManager(domain_engine)
+
+# JSON responses of at least this many bytes are gzipped for clients that accept it
+API_GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", "1024"))
+API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", "3"))
 
 
 # -------------------------------------------------
@@ -38,15 +47,55 @@ def _add_cors_headers(resp):
     """
     origin = request.headers.get("Origin", "*")
     resp.headers["Access-Control-Allow-Origin"] = origin
-    resp.headers["Vary"] = "Origin"
+    resp.vary.add("Origin")
     resp.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
     resp.headers["Access-Control-Allow-Methods"] = "GET, POST, DELETE, OPTIONS"
     return resp
 
 
+def _gzip(data):
+    return gzip.compress(data, compresslevel=API_GZIP_LEVEL)
+
+
+def _gzip_json(resp, compress=_gzip):
+    """
+    Compress a large JSON response if the client accepts gzip (strong ETags
+    get a -gzip suffix); compress(data) may return an already compressed body.
+    """
+    if (resp.status_code != 200 or resp.mimetype != "application/json" or resp.direct_passthrough
+            or "Content-Encoding" in resp.headers or (resp.calculate_content_length() or 0) < API_GZIP_MIN_BYTES):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if request.accept_encodings["gzip"] <= 0:
+        return resp
+
+    resp.set_data(compress(resp.get_data()))
+    resp.headers["Content-Encoding"] = "gzip"
+    etag, weak = resp.get_etag()
+    if etag:
+        resp.set_etag(f"{etag}-gzip", weak)
+    return resp
+
+
+def _not_modified(etag):
+    """
+    A 304 response if the client already has the representation of etag
+    (If-None-Match), plain or gzipped, or None. Which one matches depends
+    on Accept-Encoding, so the 304 always says so in Vary.
+    """
+    for candidate in (etag, f"{etag}-gzip"):
+        if request.if_none_match.contains_weak(candidate):
+            resp = app.response_class(status=304)
+            resp.set_etag(candidate)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.vary.add("Accept-Encoding")
+            return resp
+    return None
+
+
 @app.after_request
 def after_request(resp):
-    return _add_cors_headers(resp)
+    return _gzip_json(_add_cors_headers(resp))
 
 
 @app.route("/api/<path:_any>", methods=["OPTIONS"])
@@ -120,12 +169,40 @@ def api_register():
 @app.route("/api/domains", methods=["GET"])
 @require_auth
 def api_list_domains(username):
+    """
+    The user's domains, or a page of them: see DomainQuery for the
+    limit/cursor, status/issuer/expiring_before, sort and fields parameters.
+    Without parameters the whole list is returned.
+
+    Responses carry a strong ETag of the user's list version and the query;
+    a request whose If-None-Match still matches gets 304 without the list
+    being loaded. Bodies (plain and gzipped) are kept per version and query,
+    so repeated requests for an unchanged list send stored bytes.
+    """
     try:
-        domains = domain_engine.list_domains(username)
-        return jsonify({
-            "ok": True,
-            "domains": domains
-        }), 200
+        query = DomainQuery.from_args(request.args)
+    except DomainQueryError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    try:
+        version = domain_engine.domains_version(username)
+        etag = f"{version}-{zlib.crc32(request.query_string):08x}"
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        def build():
+            page = query.run(domain_engine.list_domains(username))
+            # Same bytes as jsonify()
+            return f"{app.json.dumps({'ok': True, **page}, separators=(',', ':'))}\n".encode()
+
+        body = domain_engine.serialized(username, version, (request.query_string, "json"), build)
+        resp = app.response_class(body, mimetype="application/json")
+        resp.set_etag(etag)
+        # Browsers keep the list but revalidate it on every request
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return _gzip_json(resp, lambda data: domain_engine.serialized(
+            username, version, (request.query_string, "gzip"), lambda: _gzip(data))), 200
     except Exception as e:
         logger.error(f"List domains failed for {username}: {e}")
         return jsonify({
@@ -217,15 +294,22 @@ def api_bulk_domains(username):
 @app.route("/api/domains/scan", methods=["POST"])
 @require_auth
 def api_scan_domains(username):
+    """
+    Start a background scan (or join the user's scan in flight).
+    Progress is polled with GET /api/scans/<job_id>.
+    """
+    data = _json_payload()
     try:
-        updated = monitoring_system.scan_user_domains(
+        job, created = scan_jobs.start(
             username,
-            dme=domain_engine
+            force_refresh=bool(data.get("force_refresh"))
         )
         return jsonify({
             "ok": True,
-            "updated": len(updated)
-        }), 200
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "joined": not created
+        }), 202
     except Exception as e:
         logger.error(f"Scan failed for {username}: {e}")
         return jsonify({
@@ -234,6 +318,31 @@ def api_scan_domains(username):
         }), 500
 
 
+@app.route("/api/scans/<job_id>", methods=["GET"])
+@require_auth
+def api_scan_status(username, job_id):
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        since = 0
+
+    job = scan_jobs.get(job_id, username, since=since)
+    if job is None:
+        return jsonify({"ok": False, "error": "Scan job not found"}), 404
+
+    return jsonify({"ok": True, **job}), 200
+
+
+@app.route("/api/scans/<job_id>", methods=["DELETE"])
+@require_auth
+def api_cancel_scan(username, job_id):
+    job = scan_jobs.cancel(job_id, username)
+    if job is None:
+        return jsonify({"ok": False, "error": "Scan job not found"}), 404
+
+    return jsonify({"ok": True, **job}), 200
+
+
 # -------------------------------------------------
 # OPS / ADMIN (OPTIONAL)
 # -------------------------------------------------
@@ -246,6 +355,25 @@ def api_reload_users_to_memory():
         logger.error(f"Reload users failed: {e}")
         return jsonify({"ok": False, "error": "Reload failed"}), 500
 
+@app.route("/api/admin/scan_executor", methods=["GET"])
+def api_scan_executor_stats():
+    return jsonify({"ok": True, "executor": monitoring_system.executor_stats()}), 200
+
+
+@app.route("/api/admin/probe_caches", methods=["GET"])
+def api_probe_cache_stats():
+    return jsonify({"ok": True, "caches": monitoring_system.cache_stats()}), 200
+
+
+@app.route("/api/admin/metrics", methods=["GET"])
+def api_probe_metrics():
+    return jsonify({"ok": True, "metrics": monitoring_system.metrics()}), 200
+
+
+@app.route("/api/admin/storage", methods=["GET"])
+def api_storage_stats():
+    return jsonify({"ok": True, "storage": domain_engine.storage_stats()}), 200
+
 # -------------------------------------------------
 # Health Check
 # -------------------------------------------------
@@ -65,25 +65,40 @@ document.addEventListener("DOMContentLoaded", function () {
 
   let domainsToDelete = [];
 
+  // The table is filled page by page; the server sends only the shown fields
+  const PAGE_SIZE = 200;
+  const LIST_FIELDS = "status,ssl_expiration,ssl_issuer";
+  let nextCursor = null;
+  let shownCount = 0;
+
   // =======================
   // Load & Render Domains
   // =======================
-  async function loadDomains() {
-    tbody.innerHTML = `<tr><td colspan="6" class="empty-row">Loading domains…</td></tr>`;
+  async function loadDomains(more = false) {
+    if (!more) {
+      tbody.innerHTML = `<tr><td colspan="6" class="empty-row">Loading domains…</td></tr>`;
+      nextCursor = null;
+      shownCount = 0;
+    }
 
     try {
-      const res = await fetch("/api/domains", {
+      const params = new URLSearchParams({ limit: PAGE_SIZE, fields: LIST_FIELDS });
+      if (more && nextCursor) params.set("cursor", nextCursor);
+
+      const res = await fetch(`/api/domains?${params}`, {
         headers: authHeaders()
       });
 
       const data = await res.json();
 
-      if (!res.ok || !data.domains || !data.domains.length) {
+      if (!more && (!res.ok || !data.domains || !data.domains.length)) {
         tbody.innerHTML = `<tr><td colspan="6" class="empty-row">No domains found</td></tr>`;
         return;
       }
+      if (!res.ok) throw new Error(data.error);
 
-      tbody.innerHTML = "";
+      if (!more) tbody.innerHTML = "";
+      document.getElementById("loadMoreRow")?.remove();
 
       data.domains.forEach(d => {
         const row = document.createElement("tr");
@@ -102,6 +117,20 @@ document.addEventListener("DOMContentLoaded", function () {
         tbody.appendChild(row);
       });
 
+      shownCount += data.domains.length;
+      nextCursor = data.next_cursor;
+      if (nextCursor) {
+        const row = document.createElement("tr");
+        row.id = "loadMoreRow";
+        row.innerHTML = `
+          <td colspan="6" class="empty-row">
+            <button class="dashboard-button">Load more (${shownCount} of ${data.total})</button>
+          </td>
+        `;
+        row.querySelector("button").onclick = () => loadDomains(true);
+        tbody.appendChild(row);
+      }
+
       attachDeleteHandlers();
       attachCheckboxHandlers();
       toggleBulkActions();
@@ -247,7 +276,24 @@ document.addEventListener("DOMContentLoaded", function () {
     scanNowBtn.textContent = "Scanning...";
 
     try {
-      await fetch("/api/domains/scan", { headers: authHeaders() });
+      const res = await fetch("/api/domains/scan", {
+        method: "POST",
+        headers: authHeaders()
+      });
+      const { job_id } = await res.json();
+      if (!res.ok || !job_id) throw new Error("Scan not started");
+
+      let job = { done: 0 };
+      do {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        // since= skips the results already seen, so polling stays cheap on big lists
+        const poll = await fetch(`/api/scans/${job_id}?since=${job.done}`, { headers: authHeaders() });
+        job = await poll.json();
+        if (!poll.ok) throw new Error(job.error || "Scan job not found");
+        if (job.total) scanNowBtn.textContent = `Scanning ${job.done}/${job.total}...`;
+      } while (job.status === "queued" || job.status === "running");
+
+      if (job.status === "failed") throw new Error(job.error);
       loadDomains();
     } catch {
       alert("Scan failed");
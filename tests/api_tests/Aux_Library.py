@@ -2,6 +2,7 @@ import os
 import requests
 import json
 import re
+import time
 from backend.UserManagementModule import UserManager as UM
 
 # -----------------------------------------------------
@@ -106,6 +107,34 @@ def scan_domains(token=None):
     return response
 
 
+def get_scan_job(token, job_id):
+    response = get(
+        f"{API_PREFIX}/scans/{job_id}",
+        headers=auth_headers(token),
+    )
+    print_response(response)
+    return response
+
+
+def cancel_scan_job(token, job_id):
+    response = session.delete(
+        f"{BASE_URL}{API_PREFIX}/scans/{job_id}",
+        headers=auth_headers(token),
+    )
+    print_response(response)
+    return response
+
+
+def wait_for_scan_job(token, job_id, timeout=60):
+    """Poll a scan job until it is no longer queued/running; returns the last response."""
+    deadline = time.time() + timeout
+    while True:
+        response = get_scan_job(token, job_id)
+        if response.json().get("status") not in ("queued", "running") or time.time() > deadline:
+            return response
+        time.sleep(0.5)
+
+
 # -----------------------------------------------------
 # Admin / cleanup
 # -----------------------------------------------------
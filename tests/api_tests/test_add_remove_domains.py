@@ -1,5 +1,6 @@
 import pytest
 import requests
+import time
 import uuid
 from tests.api_tests import Aux_Library as aux
 
@@ -140,3 +141,149 @@ def test_remove_domains_empty_payload(auth_headers):
         headers=auth_headers,
     )
     assert resp.status_code == 400
+
+
+# -------------------------------------------------
+# 4. Domain list cache
+# -------------------------------------------------
+def test_repeated_list_served_from_cache(auth_headers):
+    base = aux.BASE_URL
+    domain = f"cached-{uuid.uuid4().hex[:6]}.com"
+    requests.post(f"{base}/api/domains", json={"domain": domain}, headers=auth_headers)
+
+    # The first list after the POST is already a cache hit (the write filled the cache)
+    before = requests.get(f"{base}/api/admin/storage").json()["storage"]
+    listed = requests.get(f"{base}/api/domains", headers=auth_headers).json()["domains"]
+    assert any(d["domain"] == domain for d in listed)
+    after = requests.get(f"{base}/api/admin/storage").json()["storage"]
+    if after["backend"] == "json":
+        assert after["cache"]["hits"] == before["cache"]["hits"] + 1
+        assert after["cache"]["misses"] == before["cache"]["misses"]
+
+    # Each distinct query loads the list (from the cache) once
+    before = after
+    for fields in ("status", "ssl_issuer", "ssl_expiration"):
+        resp = requests.get(f"{base}/api/domains", params={"fields": fields}, headers=auth_headers)
+        assert any(d["domain"] == domain for d in resp.json()["domains"])
+    after = requests.get(f"{base}/api/admin/storage").json()["storage"]
+    if after["backend"] == "json":
+        assert after["cache"]["hits"] >= before["cache"]["hits"] + 3
+        assert after["cache"]["entries"] >= 1
+
+    # Repeating a query sends its serialized body without loading the list
+    before = after
+    for _ in range(3):
+        listed = requests.get(f"{base}/api/domains", headers=auth_headers).json()["domains"]
+        assert any(d["domain"] == domain for d in listed)
+    after = requests.get(f"{base}/api/admin/storage").json()["storage"]
+    assert after["locks"]["wait"]["load"]["count"] == before["locks"]["wait"]["load"]["count"]
+    assert after["bodies"]["hits"] == before["bodies"]["hits"] + 3
+
+    requests.delete(f"{base}/api/domains", json={"domains": [domain]}, headers=auth_headers)
+    listed = requests.get(f"{base}/api/domains", headers=auth_headers).json()["domains"]
+    assert not any(d["domain"] == domain for d in listed)
+
+
+# -------------------------------------------------
+# 5. Paging, filters and projection
+# -------------------------------------------------
+def test_list_domains_pages_with_cursor(auth_headers):
+    base = aux.BASE_URL
+    prefix = f"page-{uuid.uuid4().hex[:6]}"
+    domains = [f"{prefix}-{i}.com" for i in range(7)]
+    for d in domains:
+        requests.post(f"{base}/api/domains", json={"domain": d}, headers=auth_headers)
+
+    listed, cursor = [], None
+    while True:
+        params = {"limit": 3, "fields": "status", "status": "pending"}
+        if cursor:
+            params["cursor"] = cursor
+        resp = requests.get(f"{base}/api/domains", params=params, headers=auth_headers)
+        assert resp.status_code == 200
+        page = resp.json()
+        assert len(page["domains"]) <= 3
+        assert all(set(d) == {"domain", "status"} for d in page["domains"])
+        listed += [d["domain"] for d in page["domains"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    mine = [d for d in listed if d.startswith(prefix)]
+    assert mine == sorted(domains)
+    assert len(listed) == page["total"]
+
+    newest_first = requests.get(f"{base}/api/domains", params={"sort": "-domain"}, headers=auth_headers).json()
+    names = [d["domain"] for d in newest_first["domains"]]
+    assert names == sorted(names, reverse=True)
+
+    requests.delete(f"{base}/api/domains", json={"domains": domains}, headers=auth_headers)
+
+
+def test_list_domains_filters(auth_headers):
+    base = aux.BASE_URL
+    domain = f"filter-{uuid.uuid4().hex[:6]}.com"
+    requests.post(f"{base}/api/domains", json={"domain": domain}, headers=auth_headers)
+
+    live = requests.get(f"{base}/api/domains", params={"status": "Live"}, headers=auth_headers).json()
+    assert not any(d["domain"] == domain for d in live["domains"])
+    expiring = requests.get(f"{base}/api/domains", params={"expiring_before": "2999-01-01"},
+                            headers=auth_headers).json()
+    # A new domain has no certificate data yet
+    assert not any(d["domain"] == domain for d in expiring["domains"])
+
+    requests.delete(f"{base}/api/domains", json={"domains": [domain]}, headers=auth_headers)
+
+
+@pytest.mark.parametrize("params", [
+    {"limit": 0},
+    {"limit": "many"},
+    {"sort": "password"},
+    {"expiring_before": "soon"},
+    {"expiring_before": "2025-12-31garbage"},
+    {"cursor": "not-a-cursor"},
+])
+def test_list_domains_bad_query(auth_headers, params):
+    resp = requests.get(f"{aux.BASE_URL}/api/domains", params=params, headers=auth_headers)
+    assert resp.status_code == 400
+    assert resp.json()["ok"] is False
+
+
+# -------------------------------------------------
+# 6. Conditional requests and compression
+# -------------------------------------------------
+def test_list_domains_etag_and_gzip(auth_headers):
+    base = aux.BASE_URL
+    prefix = f"etag-{uuid.uuid4().hex[:6]}"
+    domains = [f"{prefix}-{i}.com" for i in range(20)]
+    for d in domains[:-1]:
+        requests.post(f"{base}/api/domains", json={"domain": d}, headers=auth_headers)
+
+    first = requests.get(f"{base}/api/domains", headers=dict(auth_headers, **{"Accept-Encoding": "gzip"}))
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    etag = first.headers["ETag"]
+    assert etag.endswith('-gzip"')
+
+    unchanged = requests.get(f"{base}/api/domains", headers=dict(auth_headers, **{"If-None-Match": etag}))
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == etag
+    assert "Accept-Encoding" in unchanged.headers["Vary"]
+    assert not unchanged.content
+
+    # Another query is another representation
+    paged = requests.get(f"{base}/api/domains", params={"limit": 5},
+                         headers=dict(auth_headers, **{"If-None-Match": etag}))
+    assert paged.status_code == 200
+
+    requests.post(f"{base}/api/domains", json={"domain": domains[-1]}, headers=auth_headers)
+    changed = requests.get(f"{base}/api/domains", headers=dict(auth_headers, **{"If-None-Match": etag}))
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert any(d["domain"] == domains[-1] for d in changed.json()["domains"])
+
+    identity = requests.get(f"{base}/api/domains", headers=dict(auth_headers, **{"Accept-Encoding": "identity"}))
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] == changed.headers["ETag"].replace('-gzip"', '"')
+
+    requests.delete(f"{base}/api/domains", json={"domains": domains}, headers=auth_headers)
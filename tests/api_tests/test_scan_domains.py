@@ -3,8 +3,14 @@ import uuid
 from tests.api_tests.Aux_Library import (
     check_register_user,
     check_login_user,
+    add_domain,
     scan_domains,
+    get_scan_job,
+    cancel_scan_job,
+    wait_for_scan_job,
     remove_user_from_running_app,
+    get,
+    API_PREFIX,
 )
 
 pytestmark = pytest.mark.order(6)
@@ -26,7 +32,7 @@ def test_scan_domains_unauthorized():
 # -------------------------------------------------
 # 2. Authorized access
 # -------------------------------------------------
-def test_scan_domains_authorized():
+def _register_and_login():
     username = f"scan_{uuid.uuid4().hex[:6]}"
     password = "StrongPass12"
 
@@ -38,14 +44,99 @@ def test_scan_domains_authorized():
 
     token = login.json().get("token")
     assert token, "JWT token missing from login response"
+    return username, token
+
+
+def test_scan_domains_authorized():
+    username, token = _register_and_login()
 
     scan = scan_domains(token)
-    assert scan.status_code == 200
+    assert scan.status_code == 202
 
     data = scan.json()
     assert data.get("ok") is True
-    assert "updated" in data
-    assert isinstance(data["updated"], int)
-    assert data["updated"] >= 0
+    assert data.get("job_id")
+
+    job = wait_for_scan_job(token, data["job_id"])
+    assert job.status_code == 200
+
+    job_data = job.json()
+    assert job_data["status"] == "completed"
+    assert isinstance(job_data["done"], int)
+    assert job_data["done"] == job_data["total"] >= 0
+    assert isinstance(job_data["results"], list)
+
+    remove_user_from_running_app(username)
+
+
+# -------------------------------------------------
+# 3. Job lifecycle
+# -------------------------------------------------
+def test_finished_scan_job_is_not_joined_or_cancelled():
+    # Joining and cancelling a running job: tests/unit_tests/test_scan_jobs.py
+    username, token = _register_and_login()
+
+    first = scan_domains(token)
+    assert first.status_code == 202
+    job_id = first.json()["job_id"]
+    assert wait_for_scan_job(token, job_id).json()["status"] == "completed"
+
+    cancel = cancel_scan_job(token, job_id)
+    assert cancel.status_code == 200
+    assert cancel.json()["job_id"] == job_id
+    assert cancel.json()["status"] == "completed"
+
+    second = scan_domains(token)
+    assert second.status_code == 202
+    assert second.json()["joined"] is False
+    assert second.json()["job_id"] != job_id
+    wait_for_scan_job(token, second.json()["job_id"])
+
+    remove_user_from_running_app(username)
+
+
+def test_scan_job_of_other_user_not_found():
+    owner, owner_token = _register_and_login()
+    other, other_token = _register_and_login()
+
+    job_id = scan_domains(owner_token).json()["job_id"]
+
+    assert get_scan_job(other_token, job_id).status_code == 404
+    assert cancel_scan_job(other_token, job_id).status_code == 404
+    assert get_scan_job(owner_token, "does-not-exist").status_code == 404
+
+    wait_for_scan_job(owner_token, job_id)
+    remove_user_from_running_app(owner)
+    remove_user_from_running_app(other)
+
+
+def _dns_metrics():
+    response = get(f"{API_PREFIX}/admin/metrics")
+    assert response.status_code == 200
+    return response.json()["metrics"]["phases"].get("dns", {"outcomes": {}})
+
+
+def test_probe_metrics_endpoint():
+    username, token = _register_and_login()
+    # .invalid never resolves (RFC 6761), with or without network; a new name is in no cache
+    add_domain(token, f"metrics-{uuid.uuid4().hex}.example.invalid")
+    failed_before = _dns_metrics()["outcomes"].get("failed", 0)
+
+    job = wait_for_scan_job(token, scan_domains(token).json()["job_id"])
+    summary = job.json()["summary"]
+    assert summary["changed"] == 1
+    assert summary["resumed"] == 0
+    phases = summary["phases"]
+    assert phases["dns"]["count"] == 1
+    assert phases["dns"]["outcomes"] == {"failed": 1}
+
+    # Same result again: nothing to write
+    rescan = wait_for_scan_job(token, scan_domains(token).json()["job_id"])
+    assert rescan.json()["summary"]["changed"] == 0
+
+    # The process totals include this test's lookup (other tests may add theirs)
+    dns = _dns_metrics()
+    assert dns["outcomes"]["failed"] >= failed_before + 1
+    assert "p99_ms" in dns
 
     remove_user_from_running_app(username)
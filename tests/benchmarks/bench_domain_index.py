@@ -0,0 +1,183 @@
+"""
+Domain list index benchmark: the cost of one add, update and removal on a
+user holding --domains domains (100k by default).
+
+    python tests/benchmarks/bench_domain_index.py
+    python tests/benchmarks/bench_domain_index.py --domains 10000 100000
+    python tests/benchmarks/bench_domain_index.py --baseline reports/domain_index-20250101-120000.json
+
+Cases:
+  resort<n>  what every change used to cost: rebuild the membership set and
+             re-sort the whole list by domain
+  index<n>   DomainIndex (bisect into the kept order, set-like membership)
+  log<n>     a single add/update/remove through LogDomainStore, whose disk
+             cost (an appended, fsynced line) no longer grows with the list
+  engine<n>  end to end through DomainManagementEngine (add_domain,
+             update_domain_results, remove_domains) on the json store with
+             group commit: the index change plus writing the whole file,
+             which is what a change costs the json store
+  engine_log<n>  the same on the log store: the index change plus one line
+
+Writes p50/p99 per operation to reports/domain_index-<timestamp>.json.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from report import REPO_ROOT, compare, write_report  # noqa: E402
+
+REGRESSION_METRICS = {"add_p50_ms": "lower", "remove_p50_ms": "lower", "update_p50_ms": "lower"}
+
+
+def _records(count: int, prefix: str = "d") -> List[Dict[str, Any]]:
+    return [{"domain": f"{prefix}{i:07d}.example.com", "status": "Pending", "ssl_expiration": "N/A",
+             "ssl_issuer": "N/A", "last_check": None} for i in range(count)]
+
+
+def _timed(operation: Callable[[int], Any], ops: int) -> List[float]:
+    latencies = []
+    for i in range(ops):
+        started = time.perf_counter()
+        operation(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def _summary(name: str, size: int, latencies: Dict[str, List[float]]) -> Dict[str, Any]:
+    case: Dict[str, Any] = {"case": f"{name}{size}", "domains": size}
+    for operation, values in latencies.items():
+        values = sorted(values)
+        case[f"{operation}_p50_ms"] = round(statistics.median(values), 4)
+        case[f"{operation}_p99_ms"] = round(values[min(len(values) - 1, int(len(values) * 0.99))], 4)
+    return case
+
+
+def run_resort(size: int, ops: int) -> Dict[str, Any]:
+    records = _records(size)
+    new = _records(ops, prefix="n")
+    order = list(range(size))
+    random.shuffle(order)
+
+    def add(i: int) -> None:
+        existing = {r["domain"] for r in records}
+        if new[i]["domain"] not in existing:
+            records.append(new[i])
+        records.sort(key=lambda x: x["domain"].lower())
+
+    def update(i: int) -> None:
+        by_domain = {records[order[i]]["domain"]: dict(records[order[i]], status="Live")}
+        records[:] = sorted((by_domain.get(r["domain"], r) for r in records), key=lambda x: x["domain"].lower())
+
+    def remove(i: int) -> None:
+        victim = new[i]["domain"]
+        records[:] = sorted((r for r in records if r["domain"] != victim), key=lambda x: x["domain"].lower())
+
+    return _summary("resort", size, {"add": _timed(add, ops), "update": _timed(update, ops),
+                                     "remove": _timed(remove, ops)})
+
+
+def run_index(size: int, ops: int) -> Dict[str, Any]:
+    from DomainStore import DomainIndex
+    index = DomainIndex(_records(size))
+    new = _records(ops, prefix="n")
+    domains = [r["domain"] for r in index.records()]
+    random.shuffle(domains)
+    return _summary("index", size, {
+        "add": _timed(lambda i: index.add(new[i]), ops),
+        "update": _timed(lambda i: index.put(dict(index.get(domains[i]), status="Live")), ops),
+        "remove": _timed(lambda i: index.discard(new[i]["domain"]), ops),
+    })
+
+
+def run_log_store(size: int, ops: int, workdir: str) -> Dict[str, Any]:
+    from DomainStore import LogDomainStore
+    store = LogDomainStore(workdir, compact_bytes=1 << 62)
+    username = f"bench{size}"
+    store.save(username, _records(size))
+    store.load(username)
+    new = _records(ops, prefix="n")
+    domains = [r["domain"] for r in store.load(username)]
+    random.shuffle(domains)
+    case = _summary("log", size, {
+        "add": _timed(lambda i: store.insert(username, [new[i]]), ops),
+        "update": _timed(lambda i: store.update(username, [dict(new[i], status="Live")]), ops),
+        "remove": _timed(lambda i: store.delete(username, [new[i]["domain"]]), ops),
+    })
+    started = time.perf_counter()
+    store.load(username)
+    case["load_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    store.drop_user(username)
+    return case
+
+
+def run_engine(size: int, ops: int, workdir: str, kind: str = "json") -> Dict[str, Any]:
+    import DomainManagementEngine as DME
+    from DomainStore import JsonDomainStore, LogDomainStore
+    DME._locks = DME.UserLocks(lock_dir=os.path.join(workdir, "locks"))
+    data_dir = os.path.join(workdir, f"engine-{kind}")
+    if kind == "log":
+        store = LogDomainStore(data_dir, compact_bytes=1 << 62)
+    else:
+        store = JsonDomainStore(data_dir, group_commit=True)
+    engine = DME.DomainManagementEngine(store=store)
+    username = f"bench{size}"
+    engine.save_user_domains(username, _records(size))
+    new = _records(ops, prefix="n")
+    case = _summary("engine" if kind == "json" else f"engine_{kind}", size, {
+        "add": _timed(lambda i: engine.add_domain(username, new[i]["domain"]), ops),
+        "update": _timed(lambda i: engine.update_domain_results(username, [dict(new[i], status="Live")]), ops),
+        "remove": _timed(lambda i: engine.remove_domains(username, [new[i]["domain"]]), ops),
+    })
+    engine.remove_user_domains(username)
+    return case
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark single changes to large domain lists")
+    parser.add_argument("--domains", type=int, nargs="+", default=[100000], help="domains per user")
+    parser.add_argument("--ops", type=int, default=1000, help="operations of each kind per case")
+    parser.add_argument("--resort-ops", type=int, default=20,
+                        help="operations of each kind for the (slow) re-sorting baseline")
+    parser.add_argument("--engine-ops", type=int, default=50,
+                        help="operations of each kind through DomainManagementEngine (each writes the file)")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative worsening reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="bench-index-")
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    os.chdir(workdir)  # the backend's logs/ go here
+    random.seed(1)
+
+    cases: List[Dict[str, Any]] = []
+    for size in args.domains:
+        for case in (run_resort(size, args.resort_ops), run_index(size, args.ops),
+                     run_log_store(size, args.ops, workdir), run_engine(size, args.engine_ops, workdir),
+                     run_engine(size, args.ops, workdir, kind="log")):
+            cases.append(case)
+            print(f"{case['case']:>16}: add p50 {case['add_p50_ms']} ms  "
+                  f"update p50 {case['update_p50_ms']} ms  remove p50 {case['remove_p50_ms']} ms  "
+                  f"(p99 {case['add_p99_ms']} / {case['update_p99_ms']} / {case['remove_p99_ms']} ms)")
+
+    config = {"domains": args.domains, "ops": args.ops, "resort_ops": args.resort_ops,
+              "engine_ops": args.engine_ops}
+    print(f"Report written to {write_report('domain_index', cases, config)}")
+
+    if baseline:
+        regressions = compare(baseline, cases, REGRESSION_METRICS, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+GET /api/domains benchmark: bytes sent and server latency of the full list
+as plain JSON, gzipped, and as a 304 answer to a matching If-None-Match,
+for users with 1k to 50k domains. The *_cold cases drop the serialized
+bodies before every request (load, serialize and compress each time);
+the others are served from them. Requests go through Flask's test client
+(no network), against the configured domain store.
+
+    python tests/benchmarks/bench_domain_list_http.py
+    python tests/benchmarks/bench_domain_list_http.py --sizes 50000 --requests 50
+    python tests/benchmarks/bench_domain_list_http.py --baseline reports/domain_list_http-20250101-120000.json
+
+Writes the cases to reports/domain_list_http-<timestamp>.json.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from report import REPO_ROOT, compare, write_report  # noqa: E402
+
+REGRESSION_METRICS = {"bytes": "lower", "p50_ms": "lower", "p99_ms": "lower"}
+
+ISSUERS = ["Let's Encrypt", "DigiCert Inc", "Google Trust Services", "Sectigo Limited", "N/A"]
+
+
+def _records(count: int) -> List[Dict[str, Any]]:
+    rng = random.Random(count)
+    records = []
+    for i in range(count):
+        live = rng.random() < 0.8
+        records.append({
+            "domain": f"host{i:06d}.example-{i % 97}.com",
+            "status": "Live" if live else "Down",
+            "ssl_expiration": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if live else "N/A",
+            "ssl_issuer": rng.choice(ISSUERS) if live else "N/A",
+            "last_check": "2026-01-01T00:00:00.000Z",
+        })
+    return records
+
+
+def run_case(client: Any, headers: Dict[str, str], size: int, variant: str, requests: int,
+             before: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    latencies, sizes, status = [], [], None
+    for _ in range(requests):
+        if before:
+            before()
+        started = time.perf_counter()
+        resp = client.get("/api/domains", headers=headers)
+        body = resp.get_data()
+        latencies.append((time.perf_counter() - started) * 1000)
+        sizes.append(len(body))
+        status = resp.status_code
+    latencies.sort()
+    return {
+        "case": f"{variant}{size}",
+        "domains": size,
+        "status": status,
+        "bytes": max(sizes),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark GET /api/domains responses")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--requests", type=int, default=30, help="requests per case")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative worsening reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    os.chdir(tempfile.mkdtemp(prefix="bench-list-"))  # the backend's logs/ go here
+    import app as app_module
+    import DomainManagementEngine
+    from auth.token import generate_token
+
+    client = app_module.app.test_client()
+    engine = app_module.domain_engine
+    cases: List[Dict[str, Any]] = []
+    for size in args.sizes:
+        username = f"bench_list_{uuid.uuid4().hex[:8]}"
+        try:
+            engine.save_user_domains(username, _records(size))
+            auth = {"Authorization": f"Bearer {generate_token(username)}"}
+            plain = dict(auth, **{"Accept-Encoding": "identity"})
+            gzipped = dict(auth, **{"Accept-Encoding": "gzip"})
+            etag = client.get("/api/domains", headers=gzipped).headers["ETag"]
+            revalidate = dict(gzipped, **{"If-None-Match": etag})
+
+            cold = lambda: DomainManagementEngine._bodies.discard(username)  # noqa: E731
+            for variant, headers, before in (("plain_cold", plain, cold), ("gzip_cold", gzipped, cold),
+                                             ("plain", plain, None), ("gzip", gzipped, None),
+                                             ("not_modified", revalidate, None)):
+                case = run_case(client, headers, size, variant, args.requests, before)
+                cases.append(case)
+                print(f"{case['case']:>20}: HTTP {case['status']}  {case['bytes']:>10} bytes  "
+                      f"p50 {case['p50_ms']} ms  p99 {case['p99_ms']} ms")
+        finally:
+            engine.remove_user_domains(username)
+
+    config = {"sizes": args.sizes, "requests": args.requests, "store": engine.store.name,
+              "gzip_min_bytes": app_module.API_GZIP_MIN_BYTES, "gzip_level": app_module.API_GZIP_LEVEL}
+    print(f"Report written to {write_report('domain_list_http', cases, config)}")
+
+    if baseline:
+        regressions = compare(baseline, cases, REGRESSION_METRICS, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Scan benchmark: MonitoringSystem against local stand-in servers (see stand_ins.py).
+
+    python tests/benchmarks/bench_scan.py                        # 100, 1k and 10k domains, both engines
+    python tests/benchmarks/bench_scan.py --sizes 1000 --engines threads processes
+    python tests/benchmarks/bench_scan.py --baseline reports/scan-20250101-120000.json
+
+Per case it reports throughput, p50/p99 probe latency, peak thread count and
+peak RSS (including scan worker processes), and writes them to reports/scan-<timestamp>.json. With --baseline
+it exits non-zero when a case got worse than --tolerance.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stand_ins  # noqa: E402
+from report import REPO_ROOT, compare, write_report  # noqa: E402
+
+REGRESSION_METRICS = {
+    "throughput_per_s": "higher",
+    "p50_ms": "lower",
+    "p99_ms": "lower",
+    "peak_threads": "lower",
+    "peak_rss_mb": "lower",
+}
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Samples the OS thread count and RSS of this process plus the scan worker
+    processes (pids()) until stopped; keeps the peaks of the totals.
+    """
+
+    def __init__(self, pids: Callable[[], List[int]] = list, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss_kb = 0
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _read(pid: str) -> tuple:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+            return int(fields["Threads"]), int(fields["VmRSS"].split()[0])
+        except (OSError, KeyError, ValueError):
+            if pid != "self":
+                return 0, 0
+            # Not Linux: Python threads and the lifetime peak are the best we have
+            return threading.active_count(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            samples = [self._read(str(pid)) for pid in ["self", *self.pids()]]
+            threads = sum(t for t, _ in samples)
+            rss_kb = sum(r for _, r in samples)
+            # Do not count the sampler itself
+            self.peak_threads = max(self.peak_threads, threads - 1)
+            self.peak_rss_kb = max(self.peak_rss_kb, rss_kb)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def run_case(monitoring_system, pool, engine: str, size: int, run: str) -> Dict[str, Any]:
+    domains = stand_ins.make_domains(size, run)
+    expected_live = sum(stand_ins.expected_kind(d) in ("tls", "http", "slow") for d in domains)
+
+    sampler = ResourceSampler(pool.pids)
+    sampler.start()
+    started = time.monotonic()
+    results = monitoring_system.scan_domains("benchmark", domains, engine=engine, force_refresh=True)
+    duration = time.monotonic() - started
+    sampler.stop()
+
+    probe = monitoring_system.get_scan_summary("benchmark")["phases"]["probe"]
+    live = sum(r["status"] == "Live" for r in results)
+    return {
+        "case": f"{engine}-{size}",
+        "engine": engine,
+        "domains": size,
+        "duration_s": round(duration, 3),
+        "throughput_per_s": round(size / duration, 1),
+        "p50_ms": probe["p50_ms"],
+        "p99_ms": probe["p99_ms"],
+        "avg_ms": probe["avg_ms"],
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+        "live": live,
+        "expected_live": expected_live,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark domain scans against local stand-ins")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--engines", nargs="+", default=["threads", "asyncio"])
+    parser.add_argument("--https-port", type=int, default=18443)
+    parser.add_argument("--http-port", type=int, default=18080)
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative worsening reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # MonitoringSystem reads its configuration on import
+    workdir = tempfile.mkdtemp(prefix="bench-scan-")
+    os.environ["PROBE_HTTPS_PORT"] = str(args.https_port)
+    os.environ["PROBE_HTTP_PORT"] = str(args.http_port)
+    os.environ["HOST_TIMEOUTS_FILE"] = os.path.join(workdir, "host_timeouts.json")
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    os.chdir(workdir)  # the backend's logs/ go here
+    import MonitoringSystem as monitoring_module
+    from ScanProcessPool import SCAN_PROCESS_POOL
+
+    with stand_ins.StandIns(args.https_port, args.http_port) as servers:
+        stand_ins.install(servers.cert["cert"])
+        SCAN_PROCESS_POOL.initializer = stand_ins.install
+        SCAN_PROCESS_POOL.initargs = (servers.cert["cert"],)
+
+        cases: List[Dict[str, Any]] = []
+        for size in args.sizes:
+            for engine in args.engines:
+                case = run_case(monitoring_module.MonitoringSystem, SCAN_PROCESS_POOL, engine, size, run=f"{engine}{size}")
+                cases.append(case)
+                print(f"{case['case']:>15}: {case['throughput_per_s']:>8} domains/s  "
+                      f"p50 {case['p50_ms']} ms  p99 {case['p99_ms']} ms  "
+                      f"threads {case['peak_threads']}  RSS {case['peak_rss_mb']} MB  "
+                      f"live {case['live']}/{case['expected_live']}")
+        SCAN_PROCESS_POOL.shutdown()
+
+    config = {
+        "sizes": args.sizes,
+        "engines": args.engines,
+        "mix": stand_ins.DEFAULT_MIX,
+        "slow_delay_s": stand_ins.SLOW_DELAY,
+        "scan_max_workers": monitoring_module.SCAN_EXECUTOR.max_workers,
+        "async_max_inflight": monitoring_module.ASYNC_MAX_INFLIGHT,
+        "scan_processes": SCAN_PROCESS_POOL.processes,
+    }
+    print(f"Report written to {write_report('scan', cases, config)}")
+
+    if baseline:
+        regressions = compare(baseline, cases, REGRESSION_METRICS, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Machine-readable benchmark reports under reports/, and comparison with a baseline."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REPORTS_DIR = os.path.join(REPO_ROOT, "reports")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(name: str, cases: List[Dict[str, Any]], config: Dict[str, Any],
+                 directory: str = REPORTS_DIR) -> str:
+    """Write reports/<name>-<timestamp>.json and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    report = {
+        "benchmark": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "cases": cases,
+    }
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare(baseline_path: str, cases: List[Dict[str, Any]], metrics: Dict[str, str],
+            tolerance: float = 0.2) -> List[str]:
+    """
+    Compare cases with the same-named cases of a baseline report.
+    :param metrics: metric -> "higher" or "lower" (the better direction)
+    :param tolerance: relative change in the worse direction reported as a regression
+    :return: one line per regression
+    """
+    with open(baseline_path) as f:
+        baseline = {case["case"]: case for case in json.load(f)["cases"]}
+
+    regressions = []
+    for case in cases:
+        old = baseline.get(case["case"])
+        if old is None:
+            continue
+        for metric, better in metrics.items():
+            before, after = old.get(metric), case.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if better == "higher" else change
+            if worse > tolerance:
+                regressions.append(f"{case['case']}: {metric} {before} -> {after} ({change:+.0%})")
+    return regressions
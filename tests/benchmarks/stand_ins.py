@@ -0,0 +1,183 @@
+"""
+Local stand-ins for the hosts a scan meets on the internet, so benchmarks are
+reproducible and need no network:
+
+    tls    self-signed HTTPS server                  -> Live (certificate read)
+    http   plain HTTP server, HTTPS port closed      -> Live (port-80 fallback)
+    slow   HTTPS server that waits before handshaking -> Live, slowly
+    bh     black hole: the HTTPS port never accepts  -> Down after timeouts
+    nx     no DNS record                             -> Down at once
+
+Each kind listens on its own loopback address (127.0.0.x, Linux) on the
+ports the probes are pointed at through PROBE_HTTPS_PORT / PROBE_HTTP_PORT.
+Servers run in a child process, so their threads and memory do not count
+against the scanner being measured.
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+DOMAIN_SUFFIX = "bench.test"
+
+# Loopback address of every kind of stand-in (nx has none: it fails DNS)
+ADDRESSES = {
+    "tls": "127.0.0.2",
+    "http": "127.0.0.3",
+    "bh": "127.0.0.4",
+    "slow": "127.0.0.5",
+}
+
+# Share of each kind in a generated domain list
+DEFAULT_MIX = {"tls": 0.6, "http": 0.15, "slow": 0.1, "bh": 0.05, "nx": 0.1}
+
+# Seconds the slow server waits before its TLS handshake (below PROBE_TIMEOUT)
+SLOW_DELAY = 0.3
+
+
+def make_certificate(directory: str) -> Dict[str, str]:
+    """Self-signed EC certificate for *.tls / *.slow under DOMAIN_SUFFIX (needs the openssl CLI)."""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-nodes", "-days", "30",
+         "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+         "-keyout", key, "-out", cert, "-subj", f"/CN={DOMAIN_SUFFIX}",
+         "-addext", f"subjectAltName=DNS:*.tls.{DOMAIN_SUFFIX},DNS:*.slow.{DOMAIN_SUFFIX}"],
+        check=True, capture_output=True
+    )
+    return {"cert": cert, "key": key}
+
+
+def stub_resolver(host: str) -> str:
+    """DnsCache resolver mapping <name>.<kind>.bench.test to the kind's stand-in."""
+    labels = host.split(".")
+    kind = labels[-3] if host.endswith("." + DOMAIN_SUFFIX) and len(labels) >= 4 else None
+    if kind not in ADDRESSES:
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    return ADDRESSES[kind]
+
+
+def install(cert: str) -> None:
+    """
+    Point the backend of this process at the stand-ins: trust their certificate
+    and resolve through stub_resolver. Also used as the scan worker processes'
+    initializer.
+    """
+    import MonitoringSystem
+    from ProbeCaches import DNS_CACHE
+
+    MonitoringSystem.SSL_CTX.load_verify_locations(cert)
+    DNS_CACHE.resolver = stub_resolver
+
+
+def make_domains(count: int, run: str, mix: Optional[Dict[str, float]] = None) -> List[str]:
+    """
+    `count` distinct synthetic domains in the given mix. `run` goes into every
+    name, so separate runs never share cached DNS, sessions or timeouts.
+    """
+    mix = mix or DEFAULT_MIX
+    domains = []
+    kinds = list(mix)
+    for kind in kinds:
+        share = count - len(domains) if kind == kinds[-1] else round(count * mix[kind])
+        domains += [f"{run}-{i}.{kind}.{DOMAIN_SUFFIX}" for i in range(share)]
+    return domains[:count]
+
+
+def expected_kind(domain: str) -> str:
+    return domain.split(".")[-3]
+
+
+# -------------------------------------------------
+# Servers (child process)
+# -------------------------------------------------
+async def _answer_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        await reader.read(1024)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+    except (ConnectionError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+
+
+def _serve_slow_tls(ctx: ssl.SSLContext, listener: socket.socket) -> None:
+    """
+    Blocking accept loop with a thread per connection: asyncio's start_tls
+    cannot be used here, as the stream reader would already have buffered
+    the ClientHello sent while the server was waiting.
+    """
+    def answer(conn: socket.socket) -> None:
+        try:
+            time.sleep(SLOW_DELAY)
+            with ctx.wrap_socket(conn, server_side=True) as tls:
+                tls.recv(1024)
+                tls.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (OSError, ssl.SSLError):
+            conn.close()
+
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=answer, args=(conn,), daemon=True).start()
+
+
+async def _serve(https_port: int, http_port: int, cert: Dict[str, str], ready) -> None:
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert["cert"], cert["key"])
+
+    servers = [
+        await asyncio.start_server(_answer_http, ADDRESSES["tls"], https_port, ssl=ctx, backlog=4096),
+        await asyncio.start_server(_answer_http, ADDRESSES["http"], http_port, backlog=4096),
+    ]
+
+    slow = socket.create_server((ADDRESSES["slow"], https_port), backlog=4096)
+    threading.Thread(target=_serve_slow_tls, args=(ctx, slow), daemon=True).start()
+
+    # Black hole: a listening socket that never accepts. Once its tiny backlog
+    # is full, the kernel drops further SYNs and connects time out.
+    black_hole = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    black_hole.bind((ADDRESSES["bh"], https_port))
+    black_hole.listen(0)
+
+    ready.set()
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def _run_servers(https_port: int, http_port: int, cert: Dict[str, str], ready) -> None:
+    asyncio.run(_serve(https_port, http_port, cert, ready))
+
+
+class StandIns:
+    """Starts the stand-in servers in a child process; use as a context manager."""
+
+    def __init__(self, https_port: int = 18443, http_port: int = 18080):
+        self.https_port = https_port
+        self.http_port = http_port
+        self._tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        self.cert = make_certificate(self._tmp.name)
+        self._process: Optional[multiprocessing.Process] = None
+
+    def __enter__(self) -> "StandIns":
+        ready = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=_run_servers, args=(self.https_port, self.http_port, self.cert, ready), daemon=True
+        )
+        self._process.start()
+        if not ready.wait(10):
+            self.__exit__()
+            raise RuntimeError("stand-in servers did not start")
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+        self._tmp.cleanup()
@@ -0,0 +1,156 @@
+"""
+Stress test of DomainManagementEngine across processes: like several gunicorn
+workers plus the scheduler, N processes add, update and remove domains of the
+same few users at once (--threads writers each, like threaded API workers,
+so the json store's group commit gets bursts to batch). Afterwards every user's list must hold exactly the
+domains that were added and not removed, with the last result written for each.
+
+    python tests/benchmarks/stress_domain_locks.py                     # json store, 8 processes
+    python tests/benchmarks/stress_domain_locks.py --store sqlite --processes 16
+    python tests/benchmarks/stress_domain_locks.py --store log --compact-bytes 65536
+    python tests/benchmarks/stress_domain_locks.py --no-file-locks     # shows the lost updates
+
+Exits non-zero if any write was lost.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+from report import REPO_ROOT
+
+
+def _worker(index: int, args: argparse.Namespace, workdir: str, start: Any, done: Any) -> None:
+    # The engine reads its lock configuration on import
+    os.environ["DOMAIN_LOCK_DIR"] = "" if args.no_file_locks else os.path.join(workdir, "locks")
+    os.chdir(workdir)  # the backend's logs/ go here
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    from DomainManagementEngine import DomainManagementEngine
+    from DomainStore import JsonDomainStore, LogDomainStore, SqliteDomainStore
+
+    if args.store == "sqlite":
+        store = SqliteDomainStore(os.path.join(workdir, "domains.db"))
+    elif args.store == "log":
+        store = LogDomainStore(workdir, compact_bytes=args.compact_bytes)
+    else:
+        store = JsonDomainStore(workdir, group_commit=not args.no_group_commit)
+    dme = DomainManagementEngine(store)
+
+    def write(name: str, kept: Dict[str, Dict[str, str]]) -> None:
+        for i in range(args.ops):
+            username = f"user{i % args.users}"
+            domain = f"{name}-{i}.example.com"
+            if not dme.add_domain(username, domain):
+                raise RuntimeError(f"add of {domain} reported a duplicate")
+            kept[username][domain] = "Pending"
+
+            if i % 10 == 9:
+                # Remove an earlier domain of ours
+                victim = next(iter(kept[username]))
+                dme.remove_domains(username, [victim])
+                del kept[username][victim]
+            if i % 5 == 4:
+                # Store results for our domains, like a scan
+                status = f"Live-{i}"
+                results = [{"domain": d, "status": status, "last_check": "2000-01-01T00:00:00Z"}
+                           for d in kept[username]]
+                dme.update_domain_results(username, results)
+                kept[username] = dict.fromkeys(kept[username], status)
+
+    kept = [{f"user{u}": {} for u in range(args.users)} for _ in range(args.threads)]
+    threads = [threading.Thread(target=write, args=(f"w{index}.{t}", kept[t])) for t in range(args.threads)]
+    start.wait()
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - started
+
+    merged: Dict[str, Dict[str, str]] = {f"user{u}": {} for u in range(args.users)}
+    for per_thread in kept:
+        for username, domains in per_thread.items():
+            merged[username].update(domains)
+    done.put((index, duration, merged, dme.storage_stats()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Concurrent writers on shared user domain lists")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--users", type=int, default=2, help="users all processes write to")
+    parser.add_argument("--ops", type=int, default=200, help="domains each process adds")
+    parser.add_argument("--store", choices=("json", "log", "sqlite"), default="json")
+    parser.add_argument("--no-file-locks", action="store_true",
+                        help="only in-process locks (expected to lose writes)")
+    parser.add_argument("--no-group-commit", action="store_true",
+                        help="json store: write every change on its own")
+    parser.add_argument("--threads", type=int, default=1, help="writer threads per process")
+    parser.add_argument("--compact-bytes", type=int, default=256 * 1024,
+                        help="log store: log size that triggers compaction")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress-domains-")
+    mp = multiprocessing.get_context("spawn")
+    start, done = mp.Event(), mp.Queue()
+    processes = [mp.Process(target=_worker, args=(i, args, workdir, start, done))
+                 for i in range(args.processes)]
+    for p in processes:
+        p.start()
+    time.sleep(1)  # let every worker import the backend first
+    start.set()
+
+    expected: Dict[str, Dict[str, str]] = {f"user{u}": {} for u in range(args.users)}
+    durations, waits, saves, writes, compactions = [], [], 0, 0, 0
+    for _ in processes:
+        while True:
+            try:
+                index, duration, kept, storage = done.get(timeout=1)
+                break
+            except queue.Empty:
+                if any(p.exitcode for p in processes):
+                    print("a writer process failed")
+                    return 2
+        durations.append(duration)
+        waits.append(max((w["max_ms"] for w in storage["locks"]["wait"].values()), default=0.0))
+        saves += storage.get("commits", {}).get("saves", 0)
+        writes += storage.get("commits", {}).get("writes", 0)
+        compactions += storage["compactor"]["compacted"]
+        for username, domains in kept.items():
+            expected[username].update(domains)
+    for p in processes:
+        p.join()
+
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    os.chdir(workdir)
+    from DomainStore import JsonDomainStore, LogDomainStore, SqliteDomainStore
+    if args.store == "sqlite":
+        store = SqliteDomainStore(os.path.join(workdir, "domains.db"))
+    else:
+        store = LogDomainStore(workdir) if args.store == "log" else JsonDomainStore(workdir)
+
+    lost, resurrected, stale = 0, 0, 0
+    for username, domains in expected.items():
+        stored = {r["domain"]: r.get("status") for r in store.load(username)}
+        lost += sum(1 for d in domains if d not in stored)
+        resurrected += sum(1 for d in stored if d not in domains)
+        stale += sum(1 for d, status in domains.items() if d in stored and stored[d] != status)
+
+    total_ops = args.processes * args.threads * args.ops
+    print(f"{args.processes} processes x {args.threads} threads x {args.ops} adds ({args.store} store, "
+          f"file locks {'off' if args.no_file_locks else 'on'}): "
+          f"{total_ops / max(durations):.0f} adds/s, max lock wait {max(waits):.1f} ms")
+    if saves:
+        print(f"{saves} saves took {writes} file writes")
+    if compactions:
+        print(f"{compactions} log compactions")
+    print(f"lost adds {lost}, removed domains back {resurrected}, lost result updates {stale}")
+    return 1 if lost or resurrected or stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,10 +24,17 @@ users = [f"test{i}" for i in range(1,12)]
 #     users_domains[user] = dme.load_user_domains(user)
 # # [print(domain) for domain in users_domains[user]]
 
-# performing checks
-for user in users:
-    start = time.time()
-
-    ms.scan_user_domains(username=user, dme=dme)
-    end = time.time()
-    print(f"{user}'s domains check ended in {end-start:.2f} Seconds.")
\ No newline at end of file
+# performing checks: a first pass with full TLS handshakes, then a second pass
+# that can resume the TLS sessions kept from the first one (force_refresh skips
+# the certificate cache, so both passes really handshake)
+for scan_pass in ("cold", "resumed"):
+    for user in users:
+        start = time.time()
+        cpu_start = time.process_time()
+
+        ms.scan_user_domains(username=user, dme=dme, force_refresh=True)
+        end = time.time()
+        cpu = time.process_time() - cpu_start
+        tls = ms.get_scan_summary(user)["tls"] if ms.get_scan_summary(user) else {}
+        print(f"[{scan_pass}] {user}'s domains check ended in {end-start:.2f} Seconds "
+              f"(CPU {cpu:.2f}s, TLS resumption {tls.get('resumption_rate', 0):.0%}).")
\ No newline at end of file
@@ -0,0 +1 @@
+# init file so python will see the files in the folder
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Backend modules import each other by bare name, as when run from backend/
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend")
+sys.path.insert(0, BACKEND_DIR)
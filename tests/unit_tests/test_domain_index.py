@@ -0,0 +1,85 @@
+import random
+
+from DomainStore import DomainIndex
+
+
+def _record(domain, status="Pending"):
+    return {"domain": domain, "status": status}
+
+
+def _domains(index):
+    return [r["domain"] for r in index.records()]
+
+
+# -------------------------------------------------
+# 1. Ordering
+# -------------------------------------------------
+def test_records_are_ordered_case_insensitively():
+    index = DomainIndex([_record(d) for d in ("b.example.com", "a.example.com", "B.example.com",
+                                              "_x.example.com", "A.example.com")])
+    # Case-insensitive first, the exact spelling breaks ties
+    assert _domains(index) == ["_x.example.com", "A.example.com", "a.example.com",
+                               "B.example.com", "b.example.com"]
+
+
+def test_first_record_of_a_domain_wins_and_invalid_ones_are_skipped():
+    first = _record("a.example.com", "Live")
+    index = DomainIndex([first, _record("a.example.com", "Down"), {"domain": ""}, {"status": "Live"}, "junk"])
+    assert len(index) == 1
+    assert index.get("a.example.com") is first
+
+
+def test_changes_keep_the_order_of_a_fresh_index():
+    rng = random.Random(7)
+    names = [f"{rng.choice(['', 'W', 'w'])}{rng.randrange(50)}.example.com" for _ in range(200)]
+    index = DomainIndex()
+    for name in names:
+        if rng.random() < 0.3:
+            index.discard(rng.choice(names))
+        else:
+            index.put(_record(name))
+
+    assert _domains(index) == _domains(DomainIndex(index.records()))
+    assert len(index) == len(set(_domains(index)))
+
+
+# -------------------------------------------------
+# 2. Add and replace
+# -------------------------------------------------
+def test_add_does_not_replace():
+    index = DomainIndex([_record("a.example.com")])
+    assert not index.add(_record("a.example.com", "Live"))
+    assert index.get("a.example.com")["status"] == "Pending"
+    assert index.add(_record("C.example.com"))
+    assert "C.example.com" in index and "c.example.com" not in index
+
+
+def test_put_replaces_in_place():
+    index = DomainIndex([_record(d) for d in ("a.example.com", "b.example.com", "c.example.com")])
+    live = _record("b.example.com", "Live")
+
+    assert not index.put(live)
+    assert index.get("b.example.com") is live
+    assert index.records()[1] is live
+    assert len(index) == 3
+
+    assert index.put(_record("B.example.com"))
+    assert _domains(index) == ["a.example.com", "B.example.com", "b.example.com", "c.example.com"]
+
+
+# -------------------------------------------------
+# 3. Remove
+# -------------------------------------------------
+def test_discard():
+    index = DomainIndex([_record(d) for d in ("a.example.com", "A.example.com", "b.example.com")])
+
+    assert index.discard("a.example.com")
+    assert not index.discard("a.example.com")
+    assert not index.discard("missing.example.com")
+    assert _domains(index) == ["A.example.com", "b.example.com"]
+    assert index.get("a.example.com") is None
+
+    records = index.records()
+    records.clear()
+    # records() hands out a copy of the list
+    assert len(index) == 2
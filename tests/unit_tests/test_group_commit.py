@@ -0,0 +1,198 @@
+import os
+import time
+from threading import Event, Thread
+
+import pytest
+
+import DomainManagementEngine as DME
+from DomainStore import JsonDomainStore
+
+fcntl = pytest.importorskip("fcntl")
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture
+def locks(tmp_path, monkeypatch):
+    locks = DME.UserLocks(lock_dir=str(tmp_path / "locks"))
+    monkeypatch.setattr(DME, "_locks", locks)
+    monkeypatch.setattr(DME, "_commits", DME.GroupCommitter())
+    return locks
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JsonDomainStore(data_dir=str(tmp_path), group_commit=True)
+
+
+@pytest.fixture
+def engine(store, locks):
+    return DME.DomainManagementEngine(store=store)
+
+
+@pytest.fixture
+def gated_write(store, monkeypatch):
+    """Make store.write wait for the returned event; set fail=True to make it raise."""
+    release = Event()
+    release.fail = False
+    real_write = store.write
+
+    def write(*args, **kwargs):
+        assert release.wait(5)
+        if release.fail:
+            raise OSError("disk full")
+        real_write(*args, **kwargs)
+
+    monkeypatch.setattr(store, "write", write)
+    return release
+
+
+def _create(store, username):
+    """Write the user's empty file directly (store.write may be gated)."""
+    JsonDomainStore(data_dir=store.data_dir).save(username, [])
+
+
+def _run(target, *args):
+    """Start target in a thread; returns (thread, errors raised by it)."""
+    errors = []
+
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+
+    thread = Thread(target=run)
+    thread.start()
+    return thread, errors
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _file_lock_free(locks, username):
+    """True if another open file description can take the user's flock."""
+    fd = os.open(locks._lock_path(username), os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
+
+
+# -------------------------------------------------
+# 1. Concurrent writers share one write
+# -------------------------------------------------
+def test_concurrent_writers_coalesce(engine, store, locks, gated_write):
+    _create(store, "alice")
+    domains = [f"site{i}.example.com" for i in range(8)]
+    runs = [_run(engine.add_domain, "alice", domain) for domain in domains]
+
+    # The first writer leads and waits in its write; the others stage behind it
+    _wait_for(lambda: store.saves == len(domains))
+    gated_write.set()
+    for thread, errors in runs:
+        thread.join(5)
+        assert not errors
+
+    # One write for the leader's own change, one for everything staged meanwhile
+    assert store.writes == 2
+    assert [r["domain"] for r in JsonDomainStore(data_dir=store.data_dir).load("alice")] == domains
+    assert store.staged("alice") is None
+    assert _file_lock_free(locks, "alice")
+
+
+# -------------------------------------------------
+# 2. A failed write fails every staged change
+# -------------------------------------------------
+def test_failed_write_fails_every_staged_generation(engine, store, locks, gated_write):
+    _create(store, "bob")
+    runs = [_run(engine.add_domain, "bob", f"site{i}.example.com") for i in range(4)]
+
+    _wait_for(lambda: store.saves == 4)
+    gated_write.fail = True
+    gated_write.set()
+    for thread, errors in runs:
+        thread.join(5)
+        assert len(errors) == 1 and isinstance(errors[0], OSError)
+
+    # Nothing staged survives and the list is what is on disk
+    assert store.staged("bob") is None
+    assert engine.list_domains("bob") == []
+    assert _file_lock_free(locks, "bob")
+
+
+# -------------------------------------------------
+# 3. Dropping a user while its changes are being committed
+# -------------------------------------------------
+def test_drop_waits_for_the_write_in_progress(engine, store, locks, gated_write):
+    _create(store, "carol")
+    adding, add_errors = _run(engine.add_domain, "carol", "site.example.com")
+    _wait_for(lambda: DME._commits.busy("carol"))
+
+    dropping, drop_errors = _run(engine.remove_user_domains, "carol")
+    time.sleep(0.2)
+    assert dropping.is_alive()
+
+    gated_write.set()
+    adding.join(5)
+    dropping.join(5)
+    assert not add_errors and not drop_errors
+    # The leader's write did not recreate the deleted file
+    assert not os.path.exists(store._path("carol"))
+    assert _file_lock_free(locks, "carol")
+
+
+def test_drop_before_commit_releases_the_pinned_lock(engine, store, locks):
+    with DME._locks.hold("dave", "add"):
+        store.insert("dave", [{"domain": "site.example.com"}])
+        generation = store.generation("dave")
+        DME._locks.pin("dave")
+
+    # Dropped after staging, before a leader wrote the staged list
+    engine.remove_user_domains("dave")
+    DME._commits.commit(store, "dave", generation)
+
+    assert store.staged("dave") is None
+    assert not os.path.exists(store._path("dave"))
+    assert _file_lock_free(locks, "dave")
+
+
+# -------------------------------------------------
+# 4. A flush writes the kept index
+# -------------------------------------------------
+def test_leader_writes_a_snapshot_of_the_staged_index(engine, store, gated_write, monkeypatch):
+    _create(store, "erin")
+    written = []
+    gated = store.write
+
+    def write(username, records=None, index=None):
+        written.append((records, index))
+        gated(username, records, index)
+
+    monkeypatch.setattr(store, "write", write)
+    adding, errors = _run(engine.add_domain, "erin", "b.example.com")
+    _wait_for(lambda: written)
+
+    # Changes staged while the leader writes do not touch the index it writes
+    assert store.generation("erin") == 1
+    with DME._locks.hold("erin", "test"):
+        store.insert("erin", [{"domain": "a.example.com"}])
+    assert store.generation("erin") == 2
+    records, index = written[0]
+    assert records is None
+    assert [r["domain"] for r in index.records()] == ["b.example.com"]
+
+    gated_write.set()
+    adding.join(5)
+    assert not errors
+    # The leader went on to write the change staged meanwhile
+    assert [r["domain"] for r in written[-1][1].records()] == ["a.example.com", "b.example.com"]
+    assert store.generation("erin") is None
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import socket
+import time
+from threading import Thread
+
+import pytest
+
+import MonitoringSystem as monitoring
+from MonitoringSystem import MonitoringSystem, _HostTiming, _empty_result
+from ProbeCaches import HostTimeouts
+
+HOST = "slow.example.com"
+DELAY = 0.3
+
+
+class StandInHttpServer:
+    """HTTP server on localhost that answers every request after `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.listener.accept()
+            with conn:
+                conn.recv(512)
+                time.sleep(self.delay)
+                conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture
+def timeouts(monkeypatch):
+    timeouts = HostTimeouts(initial=1, floor=0.1, ceiling=2, path=None)
+    monkeypatch.setattr(monitoring, "HOST_TIMEOUTS", timeouts)
+    return timeouts
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = StandInHttpServer(DELAY)
+    monkeypatch.setattr(monitoring, "HTTP_PORT", server.port)
+    return server
+
+
+# -------------------------------------------------
+# 1. Each phase has its own estimate
+# -------------------------------------------------
+@pytest.mark.parametrize("engine", ["thread", "asyncio"])
+def test_http_response_time_does_not_feed_the_handshake_estimate(timeouts, server, engine):
+    result = _empty_result(HOST)
+    if engine == "thread":
+        MonitoringSystem._check_http(HOST, HOST, "127.0.0.1", result, _HostTiming(HOST))
+    else:
+        asyncio.run(MonitoringSystem._check_http_async(HOST, HOST, "127.0.0.1", result, _HostTiming(HOST)))
+    assert result["status"] == "Live"
+
+    assert timeouts.timeout(HOST, "handshake") == 1
+    assert timeouts.timeout(HOST, "http") >= DELAY
+
+
+def test_http_timeout_does_not_back_off_the_handshake(timeouts, monkeypatch):
+    server = StandInHttpServer(delay=0.5)
+    monkeypatch.setattr(monitoring, "HTTP_PORT", server.port)
+    timeouts.observe(HOST, "http", 0.05)
+
+    result = _empty_result(HOST)
+    MonitoringSystem._check_http(HOST, HOST, "127.0.0.1", result, _HostTiming(HOST))
+    assert result["status"] != "Live"
+
+    assert timeouts.timeout(HOST, "handshake") == 1
+    assert timeouts.timeout(HOST, "http") > 0.1
+
+
+# -------------------------------------------------
+# 2. Saved estimates
+# -------------------------------------------------
+def test_estimates_saved_without_the_http_phase_still_load(tmp_path):
+    path = tmp_path / "host_timeouts.json"
+    path.write_text(json.dumps({HOST: {"connect": [0.05, 0.01, 0], "handshake": [0.1, 0.02, 0], "retry_at": 0}}))
+
+    timeouts = HostTimeouts(initial=1, floor=0.1, ceiling=2, path=str(path))
+    assert timeouts.timeout(HOST, "handshake") == pytest.approx(0.18)
+    assert timeouts.timeout(HOST, "http") == 1
+    timeouts.observe(HOST, "http", 0.2)
+    assert timeouts.timeout(HOST, "http") == pytest.approx(0.6)
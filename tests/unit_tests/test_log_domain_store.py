@@ -0,0 +1,149 @@
+import os
+import time
+from threading import Thread
+
+import pytest
+
+import DomainManagementEngine as DME
+from DomainStore import LogDomainStore
+
+
+def _record(domain, status="Pending"):
+    return {"domain": domain, "status": status, "ssl_expiration": "N/A", "ssl_issuer": "N/A"}
+
+
+def _domains(store, username):
+    return [r["domain"] for r in store.load(username)]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return str(tmp_path)
+
+
+# -------------------------------------------------
+# 1. Replay
+# -------------------------------------------------
+def test_log_is_replayed_over_the_snapshot(data_dir):
+    writer = LogDomainStore(data_dir)
+    writer.save("alice", [_record("b.example.com")])
+    assert writer.insert("alice", [_record("c.example.com"), _record("a.example.com")]) == \
+        ["c.example.com", "a.example.com"]
+    writer.update("alice", [_record("b.example.com", "Live"), _record("gone.example.com", "Live")])
+    assert writer.delete("alice", ["c.example.com", "missing.example.com"]) == ["c.example.com"]
+
+    # Another process reads the snapshot plus the log
+    reader = LogDomainStore(data_dir)
+    assert reader.load("alice") == [_record("a.example.com"), _record("b.example.com", "Live")]
+
+    # ... and later only the lines appended since
+    writer.insert("alice", [_record("d.example.com")])
+    assert _domains(reader, "alice") == ["a.example.com", "b.example.com", "d.example.com"]
+
+
+def test_compaction_by_another_process_is_picked_up(data_dir):
+    first, second = LogDomainStore(data_dir), LogDomainStore(data_dir)
+    first.insert("bob", [_record("a.example.com")])
+    assert _domains(second, "bob") == ["a.example.com"]
+
+    first.compact("bob")
+    assert not os.path.exists(first._log_path("bob"))
+    first.insert("bob", [_record("b.example.com")])
+
+    assert _domains(second, "bob") == ["a.example.com", "b.example.com"]
+
+
+# -------------------------------------------------
+# 2. Crashes: a torn last line, an interrupted save
+# -------------------------------------------------
+def test_torn_last_line_keeps_every_acknowledged_write(data_dir):
+    store = LogDomainStore(data_dir)
+    store.save("carol", [_record("a.example.com")])
+    store.insert("carol", [_record("b.example.com")])
+    store.delete("carol", ["a.example.com"])
+    # The process died halfway through appending the next operation
+    with open(store._log_path("carol"), "ab") as f:
+        f.write(b'{"op":"put","record":{"domain":"torn.exam')
+
+    restarted = LogDomainStore(data_dir)
+    assert _domains(restarted, "carol") == ["b.example.com"]
+
+    # Writes after the restart are appended past the torn line and replayed
+    restarted.insert("carol", [_record("c.example.com")])
+    assert _domains(LogDomainStore(data_dir), "carol") == ["b.example.com", "c.example.com"]
+
+    # Compaction keeps them all and leaves the torn operation out
+    restarted.compact("carol")
+    assert not os.path.exists(restarted._log_path("carol"))
+    assert _domains(LogDomainStore(data_dir), "carol") == ["b.example.com", "c.example.com"]
+
+
+def test_damaged_line_in_the_middle_is_skipped(data_dir):
+    store = LogDomainStore(data_dir)
+    store.insert("dave", [_record("a.example.com")])
+    with open(store._log_path("dave"), "ab") as f:
+        f.write(b'not json\n{"op":"del"}\n')
+    store_after = LogDomainStore(data_dir)
+    store_after.insert("dave", [_record("b.example.com")])
+
+    assert _domains(LogDomainStore(data_dir), "dave") == ["a.example.com", "b.example.com"]
+
+
+@pytest.mark.parametrize("crash_after", ["replace line", "snapshot"])
+def test_save_interrupted_by_a_crash_does_not_bring_old_domains_back(data_dir, monkeypatch, crash_after):
+    store = LogDomainStore(data_dir)
+    store.save("frank", [_record("a.example.com"), _record("b.example.com")])
+    store.delete("frank", ["a.example.com"])
+    store.update("frank", [_record("b.example.com", "Live")])
+
+    def crash(username, records):
+        if crash_after == "snapshot":
+            store.snapshots.write(username, records)
+        raise SystemExit("process died")
+
+    monkeypatch.setattr(store, "_write_snapshot", crash)
+    with pytest.raises(SystemExit):
+        store.save("frank", [_record("c.example.com")])
+
+    # The old log replays under the new list, not over it
+    restarted = LogDomainStore(data_dir)
+    assert restarted.load("frank") == [_record("c.example.com")]
+    restarted.insert("frank", [_record("d.example.com")])
+    restarted.compact("frank")
+    assert _domains(LogDomainStore(data_dir), "frank") == ["c.example.com", "d.example.com"]
+
+
+# -------------------------------------------------
+# 3. Background compaction while writing
+# -------------------------------------------------
+def test_compaction_alongside_writes_loses_nothing(data_dir, monkeypatch):
+    monkeypatch.setattr(DME, "_locks", DME.UserLocks(lock_dir=os.path.join(data_dir, "locks")))
+    compactor = DME.LogCompactor()
+    monkeypatch.setattr(DME, "_compactor", compactor)
+    # A few adds fill the log past the threshold, so compactions run between them
+    store = LogDomainStore(data_dir, compact_bytes=512)
+    engine = DME.DomainManagementEngine(store=store)
+
+    def add(writer):
+        for i in range(40):
+            assert engine.add_domain("erin", f"w{writer}-{i}.example.com")
+            if i % 10 == 0:
+                engine.update_domain_results("erin", [dict(_record(f"w{writer}-{i}.example.com"), status="Live")])
+
+    writers = [Thread(target=add, args=(w,)) for w in range(4)]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join(30)
+
+    deadline = time.monotonic() + 10
+    while compactor.stats()["queued"] or compactor._pending:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    with DME._locks.hold("erin", "test"):
+        pass  # the last compaction has finished
+
+    assert compactor.compacted > 0 and compactor.failed == 0
+    records = LogDomainStore(data_dir).load("erin")
+    assert len(records) == 160
+    assert sum(r["status"] == "Live" for r in records) == 16
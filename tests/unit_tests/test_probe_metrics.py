@@ -0,0 +1,58 @@
+import asyncio
+import socket
+
+import pytest
+
+import MonitoringSystem as monitoring
+from ProbeCaches import DnsCache, ProbeCoalescer
+from ProbeMetrics import ScanStats, current_scan
+
+
+class StandInResolver:
+    """Stands in for the system resolver: no name exists."""
+
+    def __init__(self):
+        self.lookups = []
+
+    def __call__(self, host):
+        self.lookups.append(host)
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture
+def resolver(monkeypatch):
+    resolver = StandInResolver()
+    monkeypatch.setattr(monitoring, "DNS_CACHE", DnsCache(resolver=resolver))
+    monkeypatch.setattr(monitoring, "PROBE_COALESCER", ProbeCoalescer())
+    return resolver
+
+
+@pytest.fixture
+def scan():
+    scan = ScanStats()
+    token = current_scan.set(scan)
+    yield scan
+    current_scan.reset(token)
+
+
+# -------------------------------------------------
+# 1. Outcomes of a name that does not resolve
+# -------------------------------------------------
+def test_unresolved_name_is_recorded_as_failed_dns(resolver, scan):
+    result = monitoring.MonitoringSystem._probe("Missing.example.invalid")
+    assert result["domain"] == "Missing.example.invalid"
+    assert result["status"] == "Down"
+
+    # The asyncio engine records the same labels; the lookup is answered by the negative cache
+    result = asyncio.run(monitoring.MonitoringSystem._probe_async("missing.example.invalid", force_refresh=True))
+    assert result["status"] == "Down"
+    assert resolver.lookups == ["missing.example.invalid"]
+
+    phases = scan.phases(buckets=False)
+    assert phases["dns"]["outcomes"] == {"failed": 2}
+    assert phases["probe"]["outcomes"] == {"Down": 2}
+    # Nothing was connected to
+    assert set(phases) == {"dns", "probe"}
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+import ScanCheckpoint as checkpoints
+from ScanCheckpoint import BatchedResultWriter, ScanCheckpoint
+
+DOMAINS = [f"site{i}.example.com" for i in range(5)]
+
+
+class StandInEngine:
+    """Stands in for DomainManagementEngine: keeps the stored results."""
+
+    def __init__(self):
+        self.stored = []
+
+    def update_domain_results(self, username, results):
+        self.stored.extend(results)
+        return len(results)
+
+
+def _scan(checkpoint, domains):
+    """Store the results of the given domains the way a running scan does."""
+    writer = BatchedResultWriter(StandInEngine(), checkpoint.username, checkpoint, batch=2, interval=60)
+    for domain in domains:
+        writer.add({"domain": domain, "status": "Live"})
+    writer.flush()
+
+
+def _checkpoint_files(data_dir):
+    return sorted(name for name in os.listdir(data_dir) if name.endswith("_scan.checkpoint"))
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "USERS_DATA_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+# -------------------------------------------------
+# 1. Resuming an interrupted scan
+# -------------------------------------------------
+def test_interrupted_scan_resumes_with_the_remaining_domains(data_dir):
+    crashed = ScanCheckpoint("alice", "scan1")
+    assert crashed.resume(DOMAINS) == DOMAINS
+    _scan(crashed, DOMAINS[:3])
+    # The worker died: the checkpoint is left behind, its lock released
+    crashed.close()
+
+    resumed = ScanCheckpoint("alice", "scan2")
+    assert resumed.resume(DOMAINS) == DOMAINS[3:]
+    # The scan took over the checkpoint, so a crash now still remembers the first three
+    assert _checkpoint_files(data_dir) == ["alice_scan2_scan.checkpoint"]
+    _scan(resumed, DOMAINS[3:4])
+    resumed.close()
+
+    again = ScanCheckpoint("alice", "scan3")
+    assert again.resume(DOMAINS) == DOMAINS[4:]
+    again.clear()
+    assert _checkpoint_files(data_dir) == []
+
+
+def test_completed_scan_starts_over(data_dir):
+    completed = ScanCheckpoint("alice")
+    completed.resume(DOMAINS)
+    _scan(completed, DOMAINS)
+    completed.clear()
+
+    assert ScanCheckpoint("alice").resume(DOMAINS) == DOMAINS
+
+
+def test_expired_checkpoint_is_ignored(data_dir, monkeypatch):
+    crashed = ScanCheckpoint("alice", "scan1")
+    crashed.resume(DOMAINS)
+    _scan(crashed, DOMAINS[:3])
+    crashed.close()
+
+    # Its stored results are too old to skip the domains
+    monkeypatch.setattr(checkpoints, "SCAN_CHECKPOINT_MAX_AGE", 0)
+    fresh = ScanCheckpoint("alice", "scan2")
+    assert fresh.resume(DOMAINS) == DOMAINS
+    assert _checkpoint_files(data_dir) == ["alice_scan2_scan.checkpoint"]
+    fresh.close()
+
+
+# -------------------------------------------------
+# 2. Scans of the same user in other workers
+# -------------------------------------------------
+def test_running_scan_keeps_its_checkpoint(data_dir):
+    running = ScanCheckpoint("alice", "scan1")
+    running.resume(DOMAINS)
+    _scan(running, DOMAINS[:3])
+
+    # Another worker scans the same user: it neither resumes nor removes the running scan's progress
+    other = ScanCheckpoint("alice", "scan2")
+    assert other.resume(DOMAINS) == DOMAINS
+    assert _checkpoint_files(data_dir) == ["alice_scan1_scan.checkpoint", "alice_scan2_scan.checkpoint"]
+    _scan(running, DOMAINS[3:4])
+    other.clear()
+
+    running.close()
+    assert ScanCheckpoint("alice", "scan3").resume(DOMAINS) == DOMAINS[4:]
+
+
+def test_checkpoints_of_other_users_are_not_resumed(data_dir):
+    # "alice_b" shares the file name prefix with "alice"
+    for username in ("alice_b", "bob"):
+        crashed = ScanCheckpoint(username, "scan1")
+        crashed.resume(DOMAINS)
+        _scan(crashed, DOMAINS[:3])
+        crashed.close()
+
+    alice = ScanCheckpoint("alice", "scan2")
+    assert alice.resume(DOMAINS) == DOMAINS
+    alice.clear()
+    assert _checkpoint_files(data_dir) == ["alice_b_scan1_scan.checkpoint", "bob_scan1_scan.checkpoint"]
@@ -0,0 +1,87 @@
+import concurrent.futures
+from threading import Event
+
+from ProbeMetrics import ScanStats, current_scan
+from ScanExecutor import ScanExecutor
+
+
+def _blocked_executor():
+    """One-worker executor whose worker waits on the returned event, so work queues up behind it."""
+    executor = ScanExecutor(max_workers=1)
+    gate, started = Event(), Event()
+
+    def hold():
+        started.set()
+        gate.wait(5)
+
+    first = executor.submit("gate", hold)
+    assert started.wait(5)
+    return executor, gate, first
+
+
+def test_heavy_user_does_not_starve_a_light_one():
+    executor, gate, first = _blocked_executor()
+    order = []
+    heavy = [executor.submit("heavy", order.append, f"heavy-{i}") for i in range(100)]
+    light = [executor.submit("light", order.append, f"light-{i}") for i in range(5)]
+
+    gate.set()
+    concurrent.futures.wait([first, *heavy, *light], timeout=10)
+
+    # Queued after all 100 heavy tasks, the light user still takes turns with the heavy one
+    assert len(order) == 105
+    last_light = max(order.index(f"light-{i}") for i in range(5))
+    assert last_light < 10
+    assert [task for task in order if task.startswith("heavy")] == [f"heavy-{i}" for i in range(100)]
+
+
+def test_weight_gives_a_larger_share():
+    executor, gate, first = _blocked_executor()
+    order = []
+    futures = [executor.submit("normal", order.append, "normal") for _ in range(20)]
+    futures += [executor.submit("double", order.append, "double", weight=2.0) for _ in range(20)]
+
+    gate.set()
+    concurrent.futures.wait([first, *futures], timeout=10)
+
+    assert order[:15].count("double") == 10
+
+
+def test_users_are_forgotten_once_drained():
+    executor, gate, first = _blocked_executor()
+    futures = [executor.submit(f"alice{i}", lambda: None) for i in range(10)]
+
+    queued = executor.stats()
+    assert queued["users_queued"] == 10
+    assert queued["queue_depth"] == 10
+
+    gate.set()
+    concurrent.futures.wait([first, *futures], timeout=10)
+
+    stats = executor.stats()
+    assert stats["users_queued"] == 0
+    assert stats["wait"]["tasks"] == 11
+    assert stats["wait"]["worst_user_avg_wait_ms"] == 0.0
+    # No usernames in the (unauthenticated) stats, no per-user state left behind
+    assert "alice" not in repr(stats)
+    assert executor._queued == executor._last_tag == executor._user_wait == {}
+
+
+def test_queue_wait_is_recorded_in_the_submitters_scan():
+    executor, gate, first = _blocked_executor()
+    scans = {user: ScanStats() for user in ("alice", "bob")}
+    futures = []
+    for user, tasks in (("alice", 3), ("bob", 1)):
+        token = current_scan.set(scans[user])
+        try:
+            futures += [executor.submit(user, lambda: None) for _ in range(tasks)]
+        finally:
+            current_scan.reset(token)
+
+    gate.set()
+    concurrent.futures.wait([first, *futures], timeout=10)
+
+    # Each user sees the wait of their own tasks only, in their own scan
+    alice, bob = (scans[user].phases(buckets=False)["queue"] for user in ("alice", "bob"))
+    assert alice["count"] == 3 and bob["count"] == 1
+    assert alice["max_ms"] > 0
@@ -0,0 +1,175 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import Event
+
+import pytest
+
+import ScanJobs
+from ScanJobs import ScanJobManager
+
+
+class StandInScanner:
+    """Stands in for MonitoringSystem: reports its results, then scans until cancelled or released."""
+
+    def __init__(self, domains: int = 3):
+        self.domains = domains
+        self.release = Event()
+        self.calls = 0
+
+    def scan_user_domains(self, username, dme, force_refresh=False, on_result=None, cancel=None, on_start=None,
+                          scan_id=None):
+        self.calls += 1
+        on_start(self.domains)
+        for i in range(self.domains):
+            on_result({"domain": f"site{i}.example.com", "status": "Live"})
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                break
+        return {"scanned": self.domains}
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture(autouse=True)
+def fast_sync(monkeypatch):
+    monkeypatch.setattr(ScanJobs, "SCAN_JOB_SYNC_INTERVAL", 0.02)
+
+
+@pytest.fixture
+def jobs_file(tmp_path):
+    return str(tmp_path / "scan_jobs.db")
+
+
+@pytest.fixture
+def scanner():
+    scanner = StandInScanner()
+    yield scanner
+    scanner.release.set()
+
+
+def _wait_for_job(manager, job_id, username, condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = manager.get(job_id, username)
+        if condition(job):
+            return job
+        assert time.monotonic() < deadline, f"timed out, last seen: {job}"
+        time.sleep(0.01)
+
+
+def _finished(job):
+    return job["status"] not in ScanJobs.ACTIVE_STATES
+
+
+# -------------------------------------------------
+# 1. Join and cancel
+# -------------------------------------------------
+def test_second_start_joins_and_cancel_stops_the_scan(jobs_file, scanner):
+    manager = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+
+    first, created = manager.start("alice")
+    assert created
+    second, joined_created = manager.start("alice")
+    assert not joined_created
+    assert second["job_id"] == first["job_id"]
+
+    cancelled = manager.cancel(first["job_id"], "alice")
+    assert cancelled["job_id"] == first["job_id"]
+
+    job = _wait_for_job(manager, first["job_id"], "alice", _finished)
+    assert job["status"] == "cancelled"
+    assert scanner.calls == 1
+    # Results gathered before the cancel are kept
+    assert job["done"] == len(job["results"]) == 3
+
+
+def test_completed_job_results_are_polled_incrementally(jobs_file, scanner):
+    manager = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+    job_id = manager.start("bob")[0]["job_id"]
+    _wait_for_job(manager, job_id, "bob", lambda job: job["done"] == 3)
+
+    scanner.release.set()
+    job = _wait_for_job(manager, job_id, "bob", _finished)
+    assert job["status"] == "completed"
+    assert job["total"] == 3
+    assert job["summary"] == {"scanned": 3}
+    assert [r["domain"] for r in manager.get(job_id, "bob", since=2)["results"]] == ["site2.example.com"]
+
+    # The next start is a new job
+    assert manager.start("bob")[1]
+
+
+def test_job_of_other_user_not_found(jobs_file, scanner):
+    manager = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+    job_id = manager.start("carol")[0]["job_id"]
+
+    assert manager.get(job_id, "mallory") is None
+    assert manager.cancel(job_id, "mallory") is None
+    assert manager.get("does-not-exist", "carol") is None
+    assert manager.get(job_id, "carol")["status"] in ScanJobs.ACTIVE_STATES
+
+
+# -------------------------------------------------
+# 2. Jobs are shared by the API worker processes
+# -------------------------------------------------
+def test_jobs_are_shared_between_workers(jobs_file, scanner):
+    # Two managers on one file stand for two gunicorn workers
+    running = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+    other = ScanJobManager(None, monitoring_system=StandInScanner(), path=jobs_file)
+
+    job_id = running.start("dave")[0]["job_id"]
+    joined, created = other.start("dave")
+    assert not created and joined["job_id"] == job_id
+
+    # Progress written by the running worker is seen by the other one
+    _wait_for_job(other, job_id, "dave", lambda job: job["done"] == 3)
+
+    # A cancel through the other worker stops the scan in the running one
+    other.cancel(job_id, "dave")
+    job = _wait_for_job(other, job_id, "dave", _finished)
+    assert job["status"] == "cancelled"
+    assert scanner.calls == 1
+
+
+def test_job_of_a_stopped_worker_fails(jobs_file, scanner):
+    manager = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+    # A job whose worker process died: its heartbeat stopped a while ago
+    conn = sqlite3.connect(jobs_file)
+    with conn:
+        conn.execute("INSERT INTO scan_jobs (id, username, status, created_at, heartbeat_at) "
+                     "VALUES ('orphan', 'erin', 'running', ?, ?)", (time.time() - 120, time.time() - 60))
+    conn.close()
+
+    job = manager.get("orphan", "erin")
+    assert job["status"] == "failed"
+
+    # Starting again does not join the dead job
+    started, created = manager.start("erin")
+    assert created and started["job_id"] != "orphan"
+    assert manager.get("orphan", "erin")["status"] == "failed"
+
+
+def test_job_fails_when_it_cannot_be_marked_running(jobs_file, scanner, monkeypatch):
+    manager = ScanJobManager(None, monitoring_system=scanner, path=jobs_file)
+    real_transaction = manager._transaction
+    calls = []
+
+    @contextmanager
+    def transaction():
+        calls.append(1)
+        if len(calls) == 2:
+            # The first one inserts the job, the second marks it running
+            raise sqlite3.OperationalError("database is locked")
+        with real_transaction() as conn:
+            yield conn
+
+    monkeypatch.setattr(manager, "_transaction", transaction)
+    job_id = manager.start("frank")[0]["job_id"]
+
+    job = _wait_for_job(manager, job_id, "frank", _finished)
+    assert job["status"] == "failed"
+    assert scanner.calls == 0
+    # The failed job does not block the next scan
+    assert manager.start("frank")[1]
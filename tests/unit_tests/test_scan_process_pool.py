@@ -0,0 +1,9 @@
+from ProbeCaches import _normalize_host
+from ScanProcessPool import _shard_of
+
+
+def test_spellings_of_a_host_share_a_worker():
+    spellings = ["example.com", "Example.COM", " https://example.com/status", "http://EXAMPLE.com"]
+    assert {_normalize_host(domain) for domain in spellings} == {"example.com"}
+    for shards in (2, 3, 7):
+        assert len({_shard_of(domain, shards) for domain in spellings}) == 1
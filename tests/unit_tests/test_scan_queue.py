@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from ScanQueue import ScanQueue
+
+# Short leases keep the tests fast; EXPIRED waits them out
+LEASE = 0.05
+EXPIRED = 0.08
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ScanQueue(path=str(tmp_path / "scan_queue.db"), visibility_timeout=LEASE, max_attempts=3)
+
+
+def _result(domain):
+    return {"domain": domain, "status": "Live"}
+
+
+# -------------------------------------------------
+# 1. Leases and the visibility timeout
+# -------------------------------------------------
+def test_leased_task_is_hidden_until_its_lease_expires(queue):
+    assert queue.enqueue("alice", ["a.example.com", "b.example.com"]) == 2
+
+    first = queue.lease("worker-1", limit=10)
+    assert sorted(t.domain for t in first) == ["a.example.com", "b.example.com"]
+    assert all(t.attempts == 1 for t in first)
+    assert queue.lease("worker-2", limit=10) == []
+
+    # The first worker died: after the visibility timeout the tasks are delivered again
+    time.sleep(EXPIRED)
+    redelivered = queue.lease("worker-2", limit=10)
+    assert sorted(t.domain for t in redelivered) == ["a.example.com", "b.example.com"]
+    assert all(t.attempts == 2 for t in redelivered)
+
+
+def test_extended_lease_stays_hidden(queue):
+    queue.enqueue("alice", ["a.example.com"])
+    task, = queue.lease("worker-1", limit=1)
+
+    assert queue.extend("worker-1", [task.id], visibility_timeout=5) == 1
+    assert queue.extend("worker-2", [task.id]) == 0
+    time.sleep(EXPIRED)
+    assert queue.lease("worker-2", limit=1) == []
+
+
+def test_task_is_queued_once_while_pending(queue):
+    assert queue.enqueue("alice", ["a.example.com"]) == 1
+    assert queue.enqueue("alice", ["a.example.com"]) == 0
+    task, = queue.lease("worker-1", limit=1)
+    assert queue.enqueue("alice", ["a.example.com"]) == 0
+    # Another user's domain of the same name is its own task
+    assert queue.enqueue("bob", ["a.example.com"]) == 1
+
+    queue.complete("worker-1", [(task.id, _result(task.domain))])
+    assert queue.enqueue("alice", ["a.example.com"]) == 1
+
+
+# -------------------------------------------------
+# 2. Completion by a worker whose lease expired
+# -------------------------------------------------
+def test_stale_worker_cannot_complete_a_released_task(queue):
+    queue.enqueue("alice", ["a.example.com"])
+    stale, = queue.lease("worker-1", limit=1)
+    time.sleep(EXPIRED)
+    fresh, = queue.lease("worker-2", limit=1)
+    assert fresh.id == stale.id
+
+    # The first worker finishes late: its result is ignored, the new owner's counts
+    assert queue.complete("worker-1", [(stale.id, dict(_result(stale.domain), status="Down"))]) == 0
+    queue.fail("worker-1", stale.id, "late")
+    assert queue.complete("worker-2", [(fresh.id, _result(fresh.domain))]) == 1
+
+    results = queue.results()
+    assert results == [(fresh.id, "alice", _result("a.example.com"))]
+    queue.mark_collected([fresh.id])
+    assert queue.results() == []
+    assert queue.stats()["collected"] == 1
+
+
+# -------------------------------------------------
+# 3. Giving up (dead letter)
+# -------------------------------------------------
+def test_task_fails_after_max_attempts_of_expired_leases(queue):
+    queue.enqueue("alice", ["a.example.com"])
+    for attempt in range(1, 4):
+        task, = queue.lease(f"worker-{attempt}", limit=1)
+        assert task.attempts == attempt
+        time.sleep(EXPIRED)
+
+    # Its third lease expired too: it is given up instead of leased again
+    assert queue.lease("worker-4", limit=1) == []
+    stats = queue.stats()
+    assert stats["failed"] == 1 and stats["queued"] == stats["leased"] == 0
+    # A failed task no longer blocks queuing the domain again
+    assert queue.enqueue("alice", ["a.example.com"]) == 1
+
+
+def test_failed_probe_is_retried_then_given_up(queue):
+    queue.enqueue("alice", ["a.example.com"])
+    for attempt in range(1, 3):
+        task, = queue.lease("worker-1", limit=1)
+        queue.fail("worker-1", task.id, "probe crashed", retry_after=0)
+        assert queue.stats()["queued"] == 1
+
+    task, = queue.lease("worker-1", limit=1)
+    assert task.attempts == 3
+    queue.fail("worker-1", task.id, "probe crashed", retry_after=0)
+    assert queue.lease("worker-1", limit=1) == []
+    assert queue.stats()["failed"] == 1
+
+
+def test_purge_keeps_recent_finished_tasks(queue):
+    queue.enqueue("alice", ["a.example.com"])
+    task, = queue.lease("worker-1", limit=1)
+    queue.complete("worker-1", [(task.id, _result(task.domain))])
+    queue.mark_collected([task.id])
+
+    assert queue.purge(retention=60) == 0
+    assert queue.purge(retention=0) == 1
+    assert queue.stats()["collected"] == 0
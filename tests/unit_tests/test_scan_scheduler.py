@@ -0,0 +1,149 @@
+import concurrent.futures
+from datetime import datetime, timezone
+
+import pytest
+
+import ScanScheduler as scheduling
+from ScanQueue import ScanQueue
+from ScanScheduler import ScanScheduler
+
+
+class StandInUsers:
+    """Stands in for UserManager: only the usernames are needed."""
+
+    def __init__(self, *usernames):
+        self.users = {username: {} for username in usernames}
+
+    def load_users_json_to_memory(self):
+        pass
+
+
+class StandInEngine:
+    """Stands in for DomainManagementEngine: domain lists in memory, counting the reads."""
+
+    def __init__(self, domains):
+        self.records = {user: [{"domain": d, "status": "Pending"} for d in names] for user, names in domains.items()}
+        self.versions = {user: 0 for user in domains}
+        self.loads = {user: 0 for user in domains}
+
+    def add(self, username, domain):
+        self.records[username].append({"domain": domain, "status": "Pending"})
+        self.versions[username] += 1
+
+    def domains_version(self, username):
+        return str(self.versions[username])
+
+    def load_user_domains(self, username):
+        self.loads[username] += 1
+        return [dict(record) for record in self.records[username]]
+
+    def update_domain_results(self, username, results):
+        by_domain = {r["domain"]: r for r in results}
+        for record in self.records[username]:
+            record.update(by_domain.get(record["domain"], {}))
+        self.versions[username] += 1
+        return len(results)
+
+
+class StandInExecutor:
+    """Stands in for ScanExecutor: keeps the probes for the test to finish."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, user, fn, domain):
+        future = concurrent.futures.Future()
+        self.submitted.append((user, domain, future))
+        return future
+
+    def finish(self, status="Live"):
+        for _, domain, future in self.submitted:
+            if not future.done():
+                future.set_result({"domain": domain, "status": status,
+                                   "last_check": datetime.now(timezone.utc).isoformat()})
+
+
+def _submitted(executor):
+    return sorted(domain for _, domain, _ in executor.submitted)
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture(autouse=True)
+def refresh_every_round(monkeypatch):
+    monkeypatch.setattr(scheduling, "SCHEDULER_REFRESH", 0)
+
+
+@pytest.fixture
+def executor():
+    return StandInExecutor()
+
+
+# -------------------------------------------------
+# 1. Probes run on the executor
+# -------------------------------------------------
+def test_round_does_not_wait_for_its_probes(executor):
+    engine = StandInEngine({"alice": ["a.example.com", "b.example.com", "c.example.com"]})
+    scheduler = ScanScheduler(engine, StandInUsers("alice"), rate=10, executor=executor)
+
+    assert scheduler.run_once() == 3
+    assert _submitted(executor) == ["a.example.com", "b.example.com", "c.example.com"]
+    # Still probing: not handed out again
+    assert scheduler.run_once() == 0
+    assert len(executor.submitted) == 3
+
+    executor.finish()
+    assert scheduler.run_once() == 0
+    assert {r["status"] for r in engine.records["alice"]} == {"Live"}
+    # Checked just now: not due for SCHEDULER_INTERVAL
+    assert scheduler.run_once() == 0
+    assert len(executor.submitted) == 3
+
+
+def test_failed_probe_is_due_again(executor, monkeypatch):
+    engine = StandInEngine({"alice": ["a.example.com"]})
+    scheduler = ScanScheduler(engine, StandInUsers("alice"), rate=10, executor=executor)
+    scheduler.run_once()
+
+    monkeypatch.setattr(scheduling, "SCHEDULER_DOWN_INTERVAL", 0)
+    executor.submitted[0][2].set_exception(RuntimeError("probe crashed"))
+    assert scheduler.run_once() == 1
+    assert _submitted(executor) == ["a.example.com", "a.example.com"]
+
+
+# -------------------------------------------------
+# 2. Only changed domain lists are re-read
+# -------------------------------------------------
+def test_only_changed_users_are_re_read(executor):
+    engine = StandInEngine({"alice": ["a.example.com"], "bob": ["b.example.com"], "carol": []})
+    scheduler = ScanScheduler(engine, StandInUsers("alice", "bob", "carol"), rate=10, executor=executor)
+
+    scheduler.run_once()
+    executor.finish()
+    for _ in range(3):
+        # Nothing due, carol has no domains at all
+        assert scheduler.run_once() == 0
+    # Once more for the results the scheduler stored itself
+    assert engine.loads == {"alice": 2, "bob": 2, "carol": 1}
+
+    engine.add("bob", "new.example.com")
+    assert scheduler.run_once() == 1
+    assert engine.loads == {"alice": 2, "bob": 3, "carol": 1}
+    assert executor.submitted[-1][1] == "new.example.com"
+
+
+# -------------------------------------------------
+# 3. The rate budget with a scan queue
+# -------------------------------------------------
+def test_already_queued_domains_do_not_use_up_the_budget(tmp_path):
+    queue = ScanQueue(path=str(tmp_path / "scan_queue.db"))
+    domains = ["a.example.com", "b.example.com", "c.example.com", "d.example.com"]
+    engine = StandInEngine({"alice": domains})
+    # Queued by an earlier run; they are first in due order
+    assert queue.enqueue("alice", domains[:2]) == 2
+
+    scheduler = ScanScheduler(engine, StandInUsers("alice"), rate=2, scan_queue=queue)
+    assert scheduler.run_once() == 2
+    assert queue.stats()["queued"] == 4
+    assert scheduler.run_once() == 0
@@ -0,0 +1,130 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import DomainStore
+from DomainQuery import DomainQuery
+from DomainStore import JsonDomainStore, LogDomainStore, SqliteDomainStore
+
+
+def _record(domain, status="Pending"):
+    return {"domain": domain, "status": status, "ssl_expiration": "N/A", "ssl_issuer": "N/A"}
+
+
+def _write_users(directory, *usernames):
+    directory.mkdir(exist_ok=True)
+    (directory / "users.json").write_text(json.dumps([{"username": u, "password": "x"} for u in usernames]))
+
+
+def _migrate(source, db, check=True):
+    return subprocess.run(
+        [sys.executable, os.path.abspath(DomainStore.__file__), "migrate", "--source", source, "--db", db],
+        cwd=os.path.dirname(db), capture_output=True, text=True, check=check
+    )
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SqliteDomainStore(str(tmp_path / "domains.db"))
+
+
+# -------------------------------------------------
+# 1. Store operations
+# -------------------------------------------------
+def test_insert_update_delete(sqlite_store):
+    assert sqlite_store.insert("alice", [_record("a.example.com"), _record("b.example.com")]) == \
+        ["a.example.com", "b.example.com"]
+    assert sqlite_store.insert("alice", [_record("a.example.com"), _record("c.example.com")]) == ["c.example.com"]
+
+    sqlite_store.update("alice", [_record("b.example.com", "Live"), _record("new.example.com", "Live")])
+    assert sqlite_store.get("alice", ["b.example.com", "new.example.com"]) == {
+        "b.example.com": _record("b.example.com", "Live")}
+
+    assert sqlite_store.delete("alice", ["a.example.com", "missing.example.com"]) == ["a.example.com"]
+    assert sqlite_store.load("alice") == [_record("b.example.com", "Live"), _record("c.example.com")]
+    # Users do not see each other's rows
+    assert sqlite_store.load("bob") == []
+
+    sqlite_store.drop_user("alice")
+    assert sqlite_store.load("alice") == []
+
+
+def test_same_order_and_pages_as_the_other_stores(tmp_path, sqlite_store):
+    # Upper case sorts before lower case byte-wise, but not in the list order
+    records = [_record(d) for d in ("b.example.com", "A.example.com", "a.example.com", "Z.example.com",
+                                    "c.example.com", "_c.example.com")]
+    stores = [JsonDomainStore(str(tmp_path / "json")), LogDomainStore(str(tmp_path / "log")), sqlite_store]
+    for store in stores:
+        store.save("alice", list(records))
+        store.insert("alice", [_record("B.example.com")])
+
+    orders = [[r["domain"] for r in store.load("alice")] for store in stores]
+    assert orders[0] == orders[1] == orders[2]
+    assert orders[0][:4] == ["_c.example.com", "A.example.com", "a.example.com", "B.example.com"]
+
+    # Keyset cursors made on one store's list continue on another's
+    first = DomainQuery(limit=3).run(stores[2].load("alice"))
+    for store in stores:
+        rest = DomainQuery(limit=10, cursor=first["next_cursor"]).run(store.load("alice"))
+        assert [r["domain"] for r in first["domains"] + rest["domains"]] == orders[0]
+
+
+def test_incomplete_backend_is_refused_at_construction():
+    class ReadOnlyStore(DomainStore.DomainStore):
+        def load(self, username):
+            return []
+
+    with pytest.raises(TypeError, match="abstract"):
+        ReadOnlyStore()
+
+
+# -------------------------------------------------
+# 2. Migration (DomainStore.py migrate)
+# -------------------------------------------------
+def test_migrate_round_trip_json_sqlite_json(tmp_path):
+    source = str(tmp_path / "json")
+    JsonDomainStore(source).save("alice", [_record("b.example.com", "Live"), _record("A.example.com")])
+    JsonDomainStore(source).save("bob", [])
+    # A user of the log store: snapshot plus log
+    log_store = LogDomainStore(source)
+    log_store.save("carol", [_record("a.example.com")])
+    log_store.insert("carol", [_record("d.example.com")])
+    log_store.delete("carol", ["a.example.com"])
+    expected = {user: LogDomainStore(source).load(user) for user in ("alice", "bob", "carol")}
+    _write_users(tmp_path / "json", "alice", "bob", "carol")
+
+    db = str(tmp_path / "domains.db")
+    for _ in range(2):
+        # Re-running the import replaces instead of duplicating
+        assert "Imported 3 domains of 3 users" in _migrate(source, db).stdout
+
+    imported = SqliteDomainStore(db)
+    target = JsonDomainStore(str(tmp_path / "back"))
+    for user, records in expected.items():
+        assert imported.load(user) == records
+        target.save(user, imported.load(user))
+        assert JsonDomainStore(str(tmp_path / "back")).load(user) == records
+
+
+def test_migrate_maps_file_names_back_to_usernames(tmp_path):
+    source = tmp_path / "json"
+    # Stored as dev_ops_domains.json
+    JsonDomainStore(str(source)).save("dev ops", [_record("a.example.com")])
+    # Two users share a file name, one file has no user at all
+    JsonDomainStore(str(source)).save("a+b", [_record("b.example.com")])
+    JsonDomainStore(str(source)).save("ghost", [_record("c.example.com")])
+    _write_users(source, "dev ops", "a+b", "a=b")
+
+    db = str(tmp_path / "domains.db")
+    result = _migrate(str(source), db, check=False)
+    assert result.returncode == 1
+    assert "Imported 1 domains of 1 users" in result.stdout
+    assert "Skipped 2 files" in result.stdout
+    assert "a_b_domains.json" in result.stdout and "ghost_domains.json" in result.stdout
+
+    imported = SqliteDomainStore(db)
+    assert imported.load("dev ops") == [_record("a.example.com")]
+    assert imported.load("dev_ops") == []
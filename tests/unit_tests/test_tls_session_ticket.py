@@ -0,0 +1,93 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import time
+from threading import Thread
+
+import pytest
+
+import MonitoringSystem as monitoring
+from ProbeCaches import TlsSessionCache
+
+HOST = "tickets.test"
+WAIT = 0.5
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="needs the openssl CLI")
+
+
+class StandInTlsServer:
+    """TLS 1.3 server on localhost that sends `tickets` session tickets after each handshake."""
+
+    def __init__(self, directory, tickets):
+        self.cert, key = str(directory / "cert.pem"), str(directory / "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+             "-nodes", "-days", "1", "-keyout", key, "-out", self.cert, "-subj", f"/CN={HOST}",
+             "-addext", f"subjectAltName=DNS:{HOST}"],
+            check=True, capture_output=True
+        )
+        self.ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ctx.minimum_version = ssl.TLSVersion.TLSv1_3
+        self.ctx.load_cert_chain(self.cert, key)
+        self.ctx.num_tickets = tickets
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+                with self.ctx.wrap_socket(conn, server_side=True) as tls:
+                    tls.recv(1)  # Until the client closes
+            except (ssl.SSLError, OSError):
+                pass
+
+    def connect(self):
+        ctx = ssl.create_default_context(cafile=self.cert)
+        sock = socket.create_connection(self.listener.getsockname(), timeout=5)
+        return ctx.wrap_socket(sock, server_hostname=HOST)
+
+
+def _read_ticket(server):
+    """Seconds _read_session_ticket took on a new connection, and whether it got a ticket."""
+    with server.connect() as ssock:
+        started = time.monotonic()
+        monitoring.MonitoringSystem._read_session_ticket(ssock, HOST, have_ticket=False)
+        return time.monotonic() - started, bool(ssock.session and ssock.session.has_ticket)
+
+
+# -------------------------------------------------
+# Fixtures
+# -------------------------------------------------
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    sessions = TlsSessionCache()
+    monkeypatch.setattr(monitoring, "TLS_SESSIONS", sessions)
+    monkeypatch.setattr(monitoring, "TLS_TICKET_WAIT", WAIT)
+    return sessions
+
+
+# -------------------------------------------------
+# 1. Waiting for the ticket
+# -------------------------------------------------
+def test_ticket_ends_the_wait(tmp_path, sessions):
+    server = StandInTlsServer(tmp_path, tickets=1)
+
+    took, ticket = _read_ticket(server)
+    assert ticket
+    assert took < WAIT / 2
+    assert sessions.sends_tickets(HOST)
+
+
+def test_host_without_tickets_is_waited_for_once(tmp_path, sessions):
+    server = StandInTlsServer(tmp_path, tickets=0)
+
+    took, ticket = _read_ticket(server)
+    assert not ticket
+    assert took >= WAIT * 0.9
+    assert not sessions.sends_tickets(HOST)
+
+    # Later probes of the host do not wait
+    took, _ = _read_ticket(server)
+    assert took < WAIT / 2